@@ -0,0 +1,294 @@
+"""Structured activity log: buffered JSON Lines with rotation and a small index.
+
+Events are queued in memory and written by a background task in batches, once per
+flush interval or as soon as a batch fills up, one JSON record per line. Deploy output
+is stored separately as gzip blobs named by content hash, and the record only
+references them. When the live file passes its size limit it is gzipped into an
+archive segment, and the oldest archives are dropped.
+
+Every written batch adds one line to the index file: the batch's segment, byte offset,
+time range and the offsets of records per mod. Queries by mod and time range only
+read the batches that can match.
+"""
+import asyncio
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+ACTIVITY_LOG = Path(os.environ.get("XYRUS_ACTIVITY_LOG", str(Path(__file__).resolve().parent / "activity.log")))
+ACTIVITY_FLUSH_SECONDS = float(os.environ.get("XYRUS_ACTIVITY_FLUSH_SECONDS", "1"))
+ACTIVITY_BATCH = int(os.environ.get("XYRUS_ACTIVITY_BATCH", "200"))
+ACTIVITY_MAX_BYTES = int(os.environ.get("XYRUS_ACTIVITY_MAX_BYTES", str(10 * 1024 * 1024)))
+ACTIVITY_KEEP = int(os.environ.get("XYRUS_ACTIVITY_KEEP", "10"))
+
+_BLOB_NAME = re.compile(r"^[0-9a-f]{64}$")
+_MOD_NAME = re.compile(r"^[a-z0-9_]+$")
+
+Record = Dict[str, Any]
+
+
+class ActivityLog:
+    def __init__(self, path: Path = ACTIVITY_LOG, flush_seconds: float = ACTIVITY_FLUSH_SECONDS,
+                 batch_size: int = ACTIVITY_BATCH, max_bytes: int = ACTIVITY_MAX_BYTES, keep: int = ACTIVITY_KEEP):
+        self.path = path
+        self.flush_seconds = flush_seconds
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self.blob_dir = path.with_name(path.stem + "_blobs")
+        self.index_path = path.with_name(path.stem + ".index.jsonl")
+        self.segment: Optional[str] = None
+        self._segments: List[str] = []  # oldest first; the last one is the live file
+        self._index: List[Dict[str, Any]] = []
+        self._pending: List[Tuple[Record, Optional[str]]] = []
+        self._io_lock = threading.Lock()
+        self._opened = False
+        self._full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.written = 0
+        self.rotations = 0
+        # Called with the text of each written batch and the "<inode>:<offset>" cursor after it
+        self.listeners: List[Callable[[str, str], None]] = []
+
+    def append(self, entry: Dict[str, Any], deploy_log: Optional[str] = None) -> None:
+        """Queue one event; never blocks on disk."""
+        now = time.time()
+        record = {"t": now, "time": datetime.datetime.fromtimestamp(now).isoformat(timespec="seconds")}
+        record.update(entry)
+        if deploy_log:
+            record.pop("log", None)  # the blob holds the full text
+        self._pending.append((record, deploy_log or None))
+        if len(self._pending) >= self.batch_size:
+            self._full.set()
+
+    async def start(self) -> None:
+        if self._task is None:
+            await asyncio.to_thread(self._open)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def flush(self) -> None:
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        text, cursor = await asyncio.to_thread(self._write_batch, batch)
+        for listener in self.listeners:
+            try:
+                listener(text, cursor)
+            except Exception:
+                pass
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            try:
+                await self.flush()
+            except Exception:
+                pass  # logging must not take the app down; the batch is lost
+
+    # -- storage (worker thread) --
+
+    def _segment_path(self, segment: str) -> Path:
+        if segment == self.segment:
+            return self.path
+        return self.path.with_name(f"{self.path.stem}-{segment}.jsonl.gz")
+
+    def _open(self) -> None:
+        with self._io_lock:
+            if self._opened:
+                return
+            self._opened = True
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            if self.index_path.exists():
+                with self.index_path.open(encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            item = json.loads(line)
+                        except ValueError:
+                            continue
+                        if "segment" in item:
+                            self._segments.append(item["segment"])
+                        else:
+                            self._index.append(item)
+            # The live file belongs to the last segment; right after a rotation it does not exist yet
+            last = self._segments[-1] if self._segments else None
+            if last and (self.path.exists() or not any(i["seg"] == last for i in self._index)):
+                self.segment = last
+            else:
+                if self.path.exists():
+                    # A log from before this format (or with a lost index): archive it as is
+                    legacy = self.path.with_name(f"{self.path.stem}-legacy-{int(self.path.stat().st_mtime)}.log.gz")
+                    self._compress(self.path, legacy)
+                self._new_segment()
+
+    def _new_segment(self) -> None:
+        segment = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        self._segments.append(segment)
+        self.segment = segment
+        with self.index_path.open("a", encoding="utf-8") as f:
+            f.write(json.dumps({"segment": segment}) + "\n")
+
+    @staticmethod
+    def _compress(src: Path, dest: Path) -> None:
+        tmp = dest.with_name(dest.name + ".tmp")
+        with src.open("rb") as fin, gzip.open(tmp, "wb") as fout:
+            while True:
+                chunk = fin.read(1 << 20)
+                if not chunk:
+                    break
+                fout.write(chunk)
+        os.replace(tmp, dest)
+        src.unlink()
+
+    def _blob_path(self, digest: str) -> Path:
+        return self.blob_dir / digest[:2] / f"{digest}.gz"
+
+    def _write_blob(self, text: str) -> str:
+        data = text.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(digest)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(path.name + ".tmp")
+            with gzip.open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        return digest
+
+    def _write_batch(self, batch: List[Tuple[Record, Optional[str]]]) -> Tuple[str, str]:
+        self._open()
+        with self._io_lock:
+            chunks: List[bytes] = []
+            mods: Dict[str, List[int]] = {}
+            blobs: List[str] = []
+            with self.path.open("ab") as f:
+                start = offset = f.tell()
+                for record, deploy_log in batch:
+                    if deploy_log:
+                        digest = self._write_blob(deploy_log)
+                        record["deploy_log"] = {"blob": digest, "bytes": len(deploy_log.encode("utf-8"))}
+                        blobs.append(digest)
+                    line = (json.dumps(record, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+                    mod = record.get("mod_name")
+                    if isinstance(mod, str) and _MOD_NAME.match(mod):
+                        mods.setdefault(mod, []).append(offset)
+                    chunks.append(line)
+                    offset += len(line)
+                f.write(b"".join(chunks))
+                cursor = f"{os.fstat(f.fileno()).st_ino}:{offset}"
+            item = {"seg": self.segment, "off": start, "n": len(batch), "t0": batch[0][0]["t"],
+                    "t1": batch[-1][0]["t"], "mods": mods, "blobs": blobs}
+            with self.index_path.open("a", encoding="utf-8") as f:
+                f.write(json.dumps(item) + "\n")
+            self._index.append(item)
+            self.written += len(batch)
+            if offset >= self.max_bytes:
+                self._rotate()
+            return b"".join(chunks).decode("utf-8"), cursor
+
+    def _rotate(self) -> None:
+        self._compress(self.path, self.path.with_name(f"{self.path.stem}-{self.segment}.jsonl.gz"))
+        self.rotations += 1
+        self._new_segment()
+        dropped = set(self._segments[:-(self.keep + 1)])
+        if not dropped:
+            return
+        for segment in dropped:
+            self._segment_path(segment).unlink(missing_ok=True)
+        self._segments = [s for s in self._segments if s not in dropped]
+        removed = [i for i in self._index if i["seg"] in dropped]
+        self._index = [i for i in self._index if i["seg"] not in dropped]
+        live_blobs = {b for i in self._index for b in i.get("blobs", ())}
+        for digest in {b for i in removed for b in i.get("blobs", ())} - live_blobs:
+            self._blob_path(digest).unlink(missing_ok=True)
+        tmp = self.index_path.with_name(self.index_path.name + ".tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            for segment in self._segments:
+                f.write(json.dumps({"segment": segment}) + "\n")
+            for item in self._index:
+                f.write(json.dumps(item) + "\n")
+        os.replace(tmp, self.index_path)
+
+    # -- queries --
+
+    def query(self, mod: Optional[str] = None, since: Optional[float] = None, until: Optional[float] = None,
+              limit: int = 100) -> List[Record]:
+        """Written records for `mod` (any mod if None) between `since` and `until`, oldest first, at most
+        `limit` of the newest ones. Only index batches that overlap the filter are read."""
+        with self._io_lock:
+            batches = [
+                i for i in self._index
+                if (since is None or i["t1"] >= since) and (until is None or i["t0"] <= until)
+                and (mod is None or mod in i["mods"])
+            ]
+            paths = {i["seg"]: self._segment_path(i["seg"]) for i in batches}
+        results: List[Record] = []
+        handles: Dict[str, Any] = {}
+        try:
+            for item in reversed(batches):
+                f = handles.get(item["seg"])
+                if f is None:
+                    path = paths[item["seg"]]
+                    try:
+                        f = handles[item["seg"]] = gzip.open(path, "rb") if path.suffix == ".gz" else path.open("rb")
+                    except OSError:
+                        continue
+                found: List[Record] = []
+                if mod is not None:
+                    for offset in item["mods"][mod]:
+                        f.seek(offset)
+                        found.append(json.loads(f.readline()))
+                else:
+                    f.seek(item["off"])
+                    found = [json.loads(f.readline()) for _ in range(item["n"])]
+                found = [r for r in found if (since is None or r["t"] >= since) and (until is None or r["t"] <= until)]
+                results = found + results
+                if len(results) >= limit:
+                    break
+        finally:
+            for f in handles.values():
+                f.close()
+        return results[-limit:]
+
+    def read_blob(self, digest: str) -> Optional[str]:
+        if not _BLOB_NAME.match(digest):
+            return None
+        try:
+            with gzip.open(self._blob_path(digest), "rb") as f:
+                return f.read().decode("utf-8", errors="replace")
+        except OSError:
+            return None
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "path": str(self.path),
+            "segment": self.segment,
+            "segments": len(self._segments),
+            "indexed_batches": len(self._index),
+            "pending": len(self._pending),
+            "written": self.written,
+            "rotations": self.rotations,
+        }
+
+
+activity_log = ActivityLog()
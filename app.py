@@ -1,4 +1,5 @@
 import json
+import hashlib
 import re
 import os
 import shutil
@@ -6,35 +7,93 @@ import ast
 import tempfile
 from pathlib import Path
 from collections import deque
-from typing import Dict, Any, Optional
-import threading
+from typing import Callable, Dict, Any, Optional
 import datetime
 import asyncio
+import time
 
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import FileResponse, StreamingResponse, JSONResponse
+from fastapi.responses import FileResponse, StreamingResponse, JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel, Field
 import subprocess
 
-from ollama_client import complete
-from deployer import write_mod, load_mod, unload_mod, restart_server, server_is_active
+from ollama_client import (
+    complete, stream_generate, open_clients, close_clients, cache_stats, response_cache,
+    scheduler_status, residency_status, start_residency, stop_residency, OllamaBusyError, PRIORITY_INTERACTIVE, PRIORITY_BATCH,
+    endpoint_status, telemetry_status, telemetry, OllamaUnavailableError,
+)
+from json_stream import extract_json
+from deployer import (
+    write_mod, sync_mod_async, unload_mod_async, restart_scheduler, deploy_output, server_watcher, ModChanges,
+)
+from deploy_queue import deploy_queue, Job
+from log_tailer import log_tailer, MINETEST_LOG
+from event_store import EventStore
+from activity_log import activity_log
+from log_search import log_search, SearchQuery, LEVELS as LOG_LEVELS
+from mod_inventory import ModInventory
+from live_updates import live_hub, sse_frame, changed_keys, LIVE_STATUS_SECONDS, LIVE_KEEPALIVE_SECONDS
 
 REPO_ROOT = Path(__file__).resolve().parent
 STATIC_DIR = REPO_ROOT / "static"
-LOG_FILE = REPO_ROOT / "activity.log"
-MINETEST_LOG = Path("/var/log/minetest/minetest.log")
+LOG_FILE = activity_log.path
 WORLD_MT = Path("/var/games/minetest-server/.minetest/worlds/world/world.mt")
 SERVER_MODS_DIR = Path("/var/games/minetest-server/.minetest/mods")
 REPO_MODS_DIR = REPO_ROOT.parent / "luanti" / "mods"  # Reference to luanti mods if needed
 HISTORY_DIR = REPO_ROOT / "history"
 TRASH_DIR = REPO_ROOT / "trash_mods"
 MOD_META_DIR = REPO_ROOT / "mod_meta"
+# Shared by /api/status, /api/logs and /api/mods; rebuilt only when world.mt or a mods dir changes
+mod_inventory = ModInventory(WORLD_MT, SERVER_MODS_DIR, REPO_MODS_DIR)
 
 app = FastAPI(title="Xyrus Mod Agent")
 app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
 
 
+_live_task: Optional[asyncio.Task] = None
+
+
+@app.on_event("startup")
+async def _startup() -> None:
+    global _live_task
+    await open_clients()
+    await start_residency()
+    await server_watcher.start()
+    await deploy_queue.start()
+    await log_tailer.start()
+    await activity_log.start()
+    mod_inventory.start()
+    _live_task = asyncio.create_task(_publish_live_state())
+
+
+@app.on_event("shutdown")
+async def _shutdown() -> None:
+    if _live_task is not None:
+        _live_task.cancel()
+    mod_inventory.stop()
+    await log_tailer.stop()
+    await deploy_queue.stop()
+    await activity_log.stop()
+    await server_watcher.stop()
+    await stop_residency()
+    await close_clients()
+
+
+@app.exception_handler(OllamaBusyError)
+async def _ollama_busy(request: Request, exc: OllamaBusyError) -> JSONResponse:
+    return JSONResponse(
+        {"detail": str(exc), "tier": exc.tier, "queued": exc.queued, "retry_after": exc.retry_after},
+        status_code=503,
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+@app.exception_handler(OllamaUnavailableError)
+async def _ollama_unavailable(request: Request, exc: OllamaUnavailableError) -> JSONResponse:
+    return JSONResponse({"detail": str(exc)}, status_code=503)
+
+
 class GenerateRequest(BaseModel):
     description: str = Field(..., description="User description of the mod to build")
     mod_name: Optional[str] = Field(None, description="Optional explicit mod name")
@@ -47,10 +106,25 @@ class FeedbackRequest(BaseModel):
     model: str = Field("auto", description="one of: auto, fast, strong")
 
 
-# naive in-memory log of recent actions
-recent_events: list[dict[str, Any]] = []
-MAX_EVENTS = 200
-LOG_LOCK = threading.Lock()
+# LLM response cache lifetimes per call site (deterministic prompts only)
+CACHE_TTL_FORM_ANALYSIS = 7 * 24 * 3600
+CACHE_TTL_FORM_SET = 24 * 3600
+CACHE_TTL_LAWS = 3600
+
+# Per-call-site generation limits passed to Ollama as options
+MOD_JSON_OPTIONS = {"num_predict": int(os.environ.get("XYRUS_MOD_NUM_PREDICT", "8192"))}
+FORM_ANALYSIS_OPTIONS = {"num_predict": 1024}
+POWERS_OPTIONS = {"num_predict": 512, "stop": ["\n\n"]}
+FILE_PATH_OPTIONS = {"num_predict": 256}
+
+# In-memory log of recent actions (ring buffer with sequence ids)
+MAX_EVENTS = int(os.environ.get("XYRUS_MAX_EVENTS", "200"))
+event_store = EventStore(MAX_EVENTS)
+
+
+def record_event(event: dict[str, Any]) -> None:
+    event_store.append(event)
+    live_hub.publish("event", event)
 
 
 def select_model(description: str, explicit: str) -> bool:
@@ -153,37 +227,20 @@ def build_guided_prompt(user_desc: str) -> str:
 
 
 def extract_json_block(text: str) -> Dict[str, Any]:
-    # Find the first ```json ... ``` block, else any ``` ... ```
-    m = re.search(r"```json\s*(\{[\s\S]*?\})\s*```", text)
-    if not m:
-        m = re.search(r"```\s*(\{[\s\S]*?\})\s*```", text)
-    raw = m.group(1) if m else text
-    try:
-        return json.loads(raw)
-    except Exception as e:
-        # Try to fix trailing commas and use relaxed parsing
-        raw2 = re.sub(r",\s*([}\]])", r"\1", raw)
-        return json.loads(raw2)
+    # Single pass: the object inside the ```json fence (a bare object only when there is no fence),
+    # ignoring braces inside strings and repairing escapes, control characters and trailing commas
+    obj = extract_json(text)
+    if obj is None:
+        raise ValueError("Model output did not contain a JSON object")
+    return obj
 
 
 def append_activity_log(entry: dict[str, Any], deploy_log: str | None = None) -> None:
-    try:
-        LOG_FILE.parent.mkdir(parents=True, exist_ok=True)
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        with LOG_LOCK:
-            with LOG_FILE.open("a", encoding="utf-8") as f:
-                f.write(f"[{timestamp}] ==== XYRUS EVENT ====\n")
-                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
-                if deploy_log:
-                    f.write("---- DEPLOY LOG START ----\n")
-                    f.write(deploy_log)
-                    if not deploy_log.endswith("\n"):
-                        f.write("\n")
-                    f.write("---- DEPLOY LOG END ----\n")
-                f.write("\n")
-    except Exception:
-        # Logging must not break the main flow
-        pass
+    # Queued for the background writer, which also publishes the written lines to /api/live
+    activity_log.append(entry, deploy_log)
+
+
+activity_log.listeners.append(lambda text, cursor: live_hub.publish("log", {"file": "xyrus", "text": text, "cursor": cursor}))
 
 
 def tail_text_file(path: Path, max_bytes: int = 20000) -> str:
@@ -203,40 +260,60 @@ def tail_text_file(path: Path, max_bytes: int = 20000) -> str:
         return f"<error reading {path}: {e}>"
 
 
-def parse_enabled_mods(world_mt_path: Path) -> dict[str, bool]:
-    enabled: dict[str, bool] = {}
+def _parse_log_cursor(cursor: Optional[str]) -> Optional[tuple[int, int]]:
     try:
-        if not world_mt_path.exists():
-            return enabled
-        text = world_mt_path.read_text(encoding="utf-8", errors="replace")
-        for line in text.splitlines():
-            line = line.strip()
-            if not line.startswith("load_mod_"):
-                continue
-            try:
-                left, right = line.split("=", 1)
-                mod_key = left.strip()
-                value = right.strip().lower() == "true"
-                mod_name = mod_key[len("load_mod_"):].strip()
-                enabled[mod_name] = value
-            except ValueError:
-                continue
-    except Exception:
-        pass
-    return enabled
+        inode, offset = (cursor or "").split(":")
+        return int(inode), int(offset)
+    except ValueError:
+        return None
 
 
-def list_mods_in_directory(dir_path: Path) -> list[str]:
-    if not dir_path.exists():
-        return []
-    names: list[str] = []
+def read_log_since(path: Path, cursor: Optional[str] = None, max_bytes: int = 20000) -> dict[str, Any]:
+    """Complete lines appended to `path` since `cursor` ("<inode>:<offset>").
+
+    Without a usable cursor, or when the file was rotated (new inode) or truncated
+    (offset past the end), this returns the last `max_bytes` instead and sets `reset`
+    so the caller replaces what it has rather than appending. The same happens when
+    more than `max_bytes` arrived since the cursor. A partial last line is left for
+    the next call.
+    """
     try:
-        for p in dir_path.iterdir():
-            if p.is_dir() and not p.name.startswith('.'):
-                names.append(p.name)
-    except Exception:
-        pass
-    return sorted(names)
+        with path.open("rb") as f:
+            st = os.fstat(f.fileno())
+            size = st.st_size
+            prev = _parse_log_cursor(cursor)
+            reason = None
+            if prev is None:
+                reason = "initial"
+            elif prev[0] != st.st_ino:
+                reason = "rotated"
+            elif prev[1] > size:
+                reason = "truncated"
+            elif size - prev[1] > max_bytes:
+                reason = "skipped"
+            start = prev[1] if reason is None else max(0, size - max_bytes)
+            f.seek(start)
+            data = f.read(size - start)
+            if reason is not None and start > 0:
+                # Began mid-file: drop the partial first line
+                nl = data.find(b"\n")
+                data = data[nl + 1:] if nl >= 0 else b""
+                start = size - len(data)
+            end = data.rfind(b"\n") + 1
+            if end == 0 and len(data) >= max_bytes:
+                end = len(data)  # one oversized line; hand it over rather than stall
+            data = data[:end]
+            return {
+                "text": data.decode("utf-8", errors="replace"),
+                "cursor": f"{st.st_ino}:{start + len(data)}",
+                "reset": reason is not None,
+                "reason": reason,
+                "size": size,
+            }
+    except FileNotFoundError:
+        return {"text": "", "cursor": None, "reset": cursor is not None, "reason": "missing", "size": 0}
+    except OSError as e:
+        return {"text": f"<error reading {path}: {e}>", "cursor": None, "reset": True, "reason": "error", "size": 0}
 
 
 def archive_repo_mod(mod_name: str) -> str:
@@ -357,148 +434,251 @@ async def index() -> FileResponse:
 
 
 @app.get("/api/events")
-async def events() -> JSONResponse:
-    return JSONResponse(recent_events[-50:])
+async def events(since: Optional[str] = None, wait: float = 0, limit: int = 50) -> JSONResponse:
+    """Recent events, oldest first, each with its `seq` and the store's `epoch`.
+
+    since=<epoch>:<seq> returns only newer events (an empty list when nothing happened);
+    add wait=N to long-poll up to N seconds for the next one. A cursor from another
+    epoch, i.e. from before a restart, gets the whole buffer with an `X-Events-Reset: 1`
+    header, telling the client to drop what it has.
+    """
+    limit = max(1, min(limit, MAX_EVENTS))
+    if since is None:
+        return JSONResponse(event_store.recent(limit))
+    seq = event_store.resolve(since)
+    headers = None
+    if seq is None:
+        seq, headers = 0, {"X-Events-Reset": "1"}
+    if wait > 0 and headers is None:
+        return JSONResponse(await event_store.wait(seq, min(wait, 60.0), limit))
+    return JSONResponse(event_store.since(seq, limit), headers=headers)
+
+
+def _parse_when(value: Optional[str]) -> Optional[float]:
+    """Epoch seconds or an ISO timestamp from a query parameter."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        try:
+            return datetime.datetime.fromisoformat(value).timestamp()
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Bad timestamp: {value}")
+
+
+@app.get("/api/activity")
+async def activity(mod: Optional[str] = None, since: Optional[str] = None, until: Optional[str] = None,
+                   limit: int = 100) -> JSONResponse:
+    """Activity records from the indexed log; since/until take epoch seconds or ISO timestamps."""
+    records = await asyncio.to_thread(activity_log.query, normalize_mod_name(mod) if mod else None,
+                                      _parse_when(since), _parse_when(until), max(1, min(limit, 1000)))
+    return JSONResponse({"records": records, "log": activity_log.status()})
+
+
+@app.get("/api/activity/blobs/{digest}")
+async def activity_blob(digest: str):
+    """Full deploy output referenced by an activity record's deploy_log.blob."""
+    text = await asyncio.to_thread(activity_log.read_blob, digest)
+    if text is None:
+        raise HTTPException(status_code=404, detail="Unknown blob")
+    return Response(text, media_type="text/plain; charset=utf-8")
 
 
 @app.get("/api/logs")
-async def logs(offset: int = 0, limit: int = 5000) -> JSONResponse:
+async def logs(limit: int = 5000, xyrus_cursor: Optional[str] = None, minetest_cursor: Optional[str] = None) -> JSONResponse:
+    """Log text since each file's cursor (see read_log_since); pass back the returned cursors to follow."""
     try:
-        app_log = tail_text_file(LOG_FILE, max_bytes=max(1000, limit))
-        server_log = tail_text_file(MINETEST_LOG, max_bytes=max(1000, limit))
-        enabled_mods = parse_enabled_mods(WORLD_MT)
-        deployed_mods = []
-        if SERVER_MODS_DIR.exists():
-            deployed_mods = sorted([p.name for p in SERVER_MODS_DIR.iterdir() if p.is_dir()])
+        max_bytes = min(max(1000, limit), 1_000_000)
+        app_log = read_log_since(LOG_FILE, xyrus_cursor, max_bytes)
+        server_log = read_log_since(MINETEST_LOG, minetest_cursor, max_bytes)
+        mods = mod_inventory.snapshot()
         return JSONResponse({
-            "xyrus_log": app_log,
-            "minetest_log": server_log,
-            "enabled_mods": enabled_mods,
-            "deployed_mods": deployed_mods,
+            "xyrus_log": app_log.pop("text"),
+            "minetest_log": server_log.pop("text"),
+            "logs": {"xyrus": app_log, "minetest": server_log},
+            "enabled_mods": mods.enabled,
+            "deployed_mods": mods.server_mods,
         })
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-def check_server_running() -> bool:
+@app.get("/api/logs/search")
+async def search_logs(q: Optional[str] = None, regex: bool = False, case: bool = False, level: Optional[str] = None,
+                      mod: Optional[str] = None, since: Optional[str] = None, until: Optional[str] = None,
+                      cursor: Optional[str] = None, limit: int = 100) -> JSONResponse:
+    """Matching lines of minetest.log and its archives, oldest first; pass next_cursor back for the next page.
+
+    `level` is a comma-separated list of error, warning, action, info, verbose, none.
+    """
+    levels = [lv.strip().lower() for lv in level.split(",") if lv.strip()] if level else None
+    unknown = [lv for lv in levels or () if lv not in LOG_LEVELS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown level: {', '.join(unknown)}")
     try:
-        result = subprocess.run(['systemctl', 'is-active', 'minetest-server'], capture_output=True, text=True, timeout=3)
-        return result.returncode == 0 and result.stdout.strip() == 'active'
-    except Exception:
-        return False
+        query = SearchQuery(q, regex=regex, case=case, levels=levels, mod=normalize_mod_name(mod) if mod else None,
+                            since=_parse_when(since), until=_parse_when(until), limit=max(1, min(limit, 1000)))
+    except re.error as e:
+        raise HTTPException(status_code=400, detail=f"Bad regex: {e}")
+    try:
+        result = await asyncio.to_thread(log_search.search, query, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except LookupError as e:
+        raise HTTPException(status_code=410, detail=str(e))
+    result["index"] = log_search.status()
+    return JSONResponse(result)
 
 
-def summarize_server_log(max_bytes: int = 10000) -> dict[str, Any]:
-    text = tail_text_file(MINETEST_LOG, max_bytes=max_bytes)
-    lines = text.splitlines() if text else []
-    err_samples: list[str] = []
-    warn_samples: list[str] = []
-    errors = 0
-    warnings = 0
-    for ln in lines[-500:]:
-        l = ln.lower()
-        if 'error' in l:
-            errors += 1
-            if len(err_samples) < 5:
-                err_samples.append(ln)
-        elif 'warn' in l:
-            warnings += 1
-            if len(warn_samples) < 5:
-                warn_samples.append(ln)
+def check_server_running() -> bool:
+    # Cached by the background systemd watcher; never forks per request
+    return server_watcher.running
+
+
+def summarize_server_log() -> dict[str, Any]:
+    # Maintained incrementally by the background log tailer; no file reads here
+    return log_tailer.summary()
+
+
+def build_status() -> dict[str, Any]:
+    server_running = check_server_running()
+    mods = mod_inventory.snapshot()
+    last_event = event_store.last()
+    last_error = event_store.last('error')
+    log_summary = summarize_server_log()
+    # Build auto-fix suggestion if errors exist
+    auto_fix = None
+    if log_summary.get('errors', 0) > 0:
+        # Prefer the mod of the latest attributed traceback and quote its distinct tracebacks verbatim
+        since = time.time() - log_summary['window_s']
+        mod_guess = log_tailer.errors.last_mod
+        tracebacks = log_tailer.errors.tracebacks(mod_guess, since) if mod_guess else []
+        if tracebacks:
+            err_text = "\n\n".join(
+                "\n".join([f"{t.file}:{t.line} (seen {t.count}x)"] + t.traceback) for t in tracebacks
+            )
+        else:
+            mod_guess = log_summary.get('last_error_mod')
+            err_text = "\n".join(log_summary.get('error_samples', [])[-5:])
+        auto_fix = {
+            'mod_guess': mod_guess,
+            'locations': [{'file': t.file, 'line': t.line, 'count': t.count} for t in tracebacks],
+            'prompt': (
+                "Server errors detected. Please fix the mod accordingly.\n\n"
+                f"{'Tracebacks' if tracebacks else 'Error samples'}:\n{err_text}\n\n"
+                "Guidance: identify the mod causing these errors, adjust file names, mod.conf name, dependencies, assets, and code as needed."
+            )
+        }
     return {
-        'errors': errors,
-        'warnings': warnings,
-        'error_samples': err_samples,
-        'warning_samples': warn_samples,
+        'server_running': server_running,
+        'server': server_watcher.snapshot(),
+        'enabled_mods_count': mods.enabled_count,
+        'enabled_mods': mods.enabled,
+        'deployed_mods_count': len(mods.server_mods),
+        'deployed_mods': mods.server_mods,
+        'last_event': last_event,
+        'last_error': last_error,
+        'last_restart': event_store.last('server:restart'),
+        'server_log': log_summary,
+        'auto_fix': auto_fix,
+        'llm_models': residency_status(),
     }
 
 
-def detect_mod_from_log(text: str) -> str | None:
-    try:
-        # Look for paths like /mods/<mod>/init.lua near error lines
-        candidates: list[str] = []
-        for m in re.finditer(r"/mods/([^/]+)/init\.lua", text):
-            candidates.append(m.group(1))
-        if candidates:
-            return normalize_mod_name(candidates[-1])
-        return None
-    except Exception:
-        return None
-
-
 @app.get("/api/status")
 async def status() -> JSONResponse:
     try:
-        server_running = check_server_running()
-        enabled = parse_enabled_mods(WORLD_MT)
-        deployed = []
-        if SERVER_MODS_DIR.exists():
-            deployed = sorted([p.name for p in SERVER_MODS_DIR.iterdir() if p.is_dir()])
-        last_event = recent_events[-1] if recent_events else None
-        # find last error
-        last_error = None
-        for ev in reversed(recent_events):
-            if ev.get('action') == 'error':
-                last_error = ev
-                break
-        log_summary = summarize_server_log()
-        # Build auto-fix suggestion if errors exist
-        auto_fix = None
-        if log_summary.get('errors', 0) > 0:
-            # Construct a concise prompt for the model to fix
-            err_lines = "\n".join(log_summary.get('error_samples', [])[:5])
-            mod_guess = detect_mod_from_log(tail_text_file(MINETEST_LOG, max_bytes=20000))
-            auto_fix = {
-                'mod_guess': mod_guess,
-                'prompt': (
-                    "Server errors detected. Please fix the mod accordingly.\n\n"
-                    f"Error samples:\n{err_lines}\n\n"
-                    "Guidance: identify the mod causing these errors, adjust file names, mod.conf name, dependencies, assets, and code as needed."
-                )
-            }
-        return JSONResponse({
-            'server_running': server_running,
-            'enabled_mods_count': sum(1 for v in enabled.values() if v),
-            'enabled_mods': enabled,
-            'deployed_mods_count': len(deployed),
-            'deployed_mods': deployed,
-            'last_event': last_event,
-            'last_error': last_error,
-            'server_log': log_summary,
-            'auto_fix': auto_fix,
-        })
+        return JSONResponse(build_status())
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def build_mod_list() -> list[dict[str, Any]]:
+    return mod_inventory.snapshot().entries
+
+
 @app.get("/api/mods")
-async def list_mods() -> JSONResponse:
+async def list_mods(request: Request) -> Response:
+    """Sorted mod list, served pre-serialized from the inventory snapshot; honours If-None-Match."""
     try:
-        enabled = parse_enabled_mods(WORLD_MT)
-        server_mods = set(list_mods_in_directory(SERVER_MODS_DIR))
-        repo_mods = set(list_mods_in_directory(REPO_MODS_DIR))
-        all_mods = sorted(server_mods | repo_mods | set(enabled.keys()))
-        # Build rich entries
-        entries = []
-        for name in all_mods:
-            entries.append({
-                "name": name,
-                "enabled": bool(enabled.get(name, False)),
-                "on_server": name in server_mods,
-                "in_repo": name in repo_mods,
-            })
-        # Sort: enabled first, then on_server, then in_repo, then name
-        entries.sort(key=lambda m: (
-            0 if m["enabled"] else 1,
-            0 if m["on_server"] else 1,
-            0 if m["in_repo"] else 1,
-            m["name"],
-        ))
-        return JSONResponse({
-            "mods": entries,
-        })
+        mods = mod_inventory.snapshot()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    headers = {"ETag": mods.etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == mods.etag:
+        return Response(status_code=304, headers=headers)
+    return Response(mods.body, media_type="application/json", headers=headers)
+
+
+@app.get("/api/live")
+async def live(request: Request) -> StreamingResponse:
+    """Server-Sent Events: `event`, `status` (changed keys), `mods` and `log` messages as they happen.
+
+    Ids are `<epoch>:<seq>`. Reconnecting with Last-Event-ID (EventSource does this
+    itself) replays what was missed; if that is no longer buffered, or the id is from
+    before a restart, a `reset` message is sent, followed by the full current state.
+    """
+    last_id = request.headers.get("last-event-id") or request.query_params.get("last_event_id")
+    missed = live_hub.replay(last_id) if last_id else None
+    queue = live_hub.subscribe()
+    # Anything published from here on is both queued and possibly in `missed`; skip repeats by id
+    sent = missed[-1]["id"] if missed else live_hub.seq
+
+    async def body():
+        try:
+            yield "retry: 3000\n\n"
+            if missed is None:
+                if last_id:
+                    yield sse_frame("reset", {"epoch": live_hub.epoch, "seq": live_hub.seq})
+                yield sse_frame("status", build_status(), live_hub.event_id(live_hub.seq))
+                yield sse_frame("mods", build_mod_list())
+            else:
+                for msg in missed:
+                    yield sse_frame(msg["event"], msg["data"], live_hub.event_id(msg["id"]))
+            while True:
+                try:
+                    msg = await asyncio.wait_for(queue.get(), timeout=LIVE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if msg is None:
+                    break  # fell too far behind; the browser reconnects and replays
+                if msg["id"] > sent:
+                    yield sse_frame(msg["event"], msg["data"], live_hub.event_id(msg["id"]))
+        finally:
+            live_hub.unsubscribe(queue)
+
+    return StreamingResponse(body(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+async def _publish_live_state() -> None:
+    """Publish status deltas and mod-list changes, but only while a page is listening."""
+    last_status: dict[str, Any] = {}
+    last_mods_etag: str | None = None
+    while True:
+        await asyncio.sleep(LIVE_STATUS_SECONDS)
+        if not live_hub.subscribers:
+            last_status, last_mods_etag = {}, None
+            continue
+        try:
+            current = build_status()
+            delta = changed_keys(last_status, current)
+            if delta:
+                live_hub.publish("status", delta)
+                last_status = current
+            mods = mod_inventory.snapshot()
+            if mods.etag != last_mods_etag:
+                live_hub.publish("mods", mods.entries)
+                last_mods_etag = mods.etag
+        except Exception:
+            pass
+
+
+log_tailer.listeners.append(
+    lambda lines, cursor: live_hub.publish("log", {"file": "minetest", "text": "\n".join(lines) + "\n", "cursor": cursor})
+)
 
 
 @app.get("/api/history")
@@ -517,6 +697,16 @@ async def get_history(entry_id: str) -> JSONResponse:
     return JSONResponse(item)
 
 
+@app.get("/api/mods/{mod_name}/errors")
+async def mod_errors(mod_name: str) -> JSONResponse:
+    """Errors attributed to one mod from minetest.log tracebacks, newest distinct error first."""
+    entry = log_tailer.errors.for_mod(mod_name)
+    if entry is None:
+        return JSONResponse({"mod": mod_name.lower(), "errors": 0, "first_seen": None, "last_seen": None,
+                             "files": {}, "distinct": 0, "evicted": 0, "signatures": []})
+    return JSONResponse(entry.to_dict())
+
+
 @app.get("/api/mods/meta/{mod_name}")
 async def get_mod_meta(mod_name: str) -> JSONResponse:
     try:
@@ -537,11 +727,9 @@ async def api_unload_mod(payload: Dict[str, Any]) -> JSONResponse:
     try:
         append_activity_log({"action": "unload:start", "mod_name": mod_name})
         # Use deployer script which will disable and remove server files (we archived separately when needed)
-        log = await asyncio.to_thread(lambda: unload_mod(mod_name))
+        log = (await unload_mod_async(mod_name)).output
         event = {"action": "unload", "mod_name": mod_name, "log": (log or "")[-2000:]}
-        recent_events.append(event)
-        if len(recent_events) > MAX_EVENTS:
-            del recent_events[:-MAX_EVENTS]
+        record_event(event)
         append_activity_log(event, log)
         return JSONResponse({"status": "ok", "mod_name": mod_name, "log": log})
     except Exception as e:
@@ -560,11 +748,9 @@ async def api_archive_mod(payload: Dict[str, Any]) -> JSONResponse:
         repo_path = archive_repo_mod(mod_name)
         server_path = archive_server_mod(mod_name)
         # After archiving, unload to disable/remove from server
-        unload_log = await asyncio.to_thread(lambda: unload_mod(mod_name))
+        unload_log = (await unload_mod_async(mod_name)).output
         event = {"action": "archive", "mod_name": mod_name, "repo_path": repo_path, "server_path": server_path, "log": (unload_log or "")[-2000:]}
-        recent_events.append(event)
-        if len(recent_events) > MAX_EVENTS:
-            del recent_events[:-MAX_EVENTS]
+        record_event(event)
         append_activity_log(event, unload_log)
         return JSONResponse({"status": "ok", "mod_name": mod_name, "repo_archive": repo_path, "server_archive": server_path, "unload_log": unload_log})
     except Exception as e:
@@ -583,9 +769,7 @@ async def api_empty_trash() -> JSONResponse:
     try:
         count = empty_trash()
         event = {"action": "trash:empty", "removed": count}
-        recent_events.append(event)
-        if len(recent_events) > MAX_EVENTS:
-            del recent_events[:-MAX_EVENTS]
+        record_event(event)
         append_activity_log(event)
         return JSONResponse({"status": "ok", "removed": count})
     except Exception as e:
@@ -614,9 +798,7 @@ async def upload_xyrus_images(request: Request):
                     saved_files.append(filename)
         
         event = {"action": "xyrus:images_uploaded", "count": len(saved_files)}
-        recent_events.append(event)
-        if len(recent_events) > MAX_EVENTS:
-            del recent_events[:-MAX_EVENTS]
+        record_event(event)
         append_activity_log(event)
         
         return JSONResponse({"status": "ok", "uploaded": saved_files, "message": "Xyrus images uploaded successfully"})
@@ -630,6 +812,89 @@ async def admin_page() -> FileResponse:
     return FileResponse(str(STATIC_DIR / "admin.html"))
 
 
+@app.get("/api/server")
+async def server_state() -> JSONResponse:
+    return JSONResponse(server_watcher.snapshot())
+
+
+@app.get("/api/deploy_log")
+async def get_deploy_log(since: int = 0, wait: float = 0) -> JSONResponse:
+    """Deploy script output after sequence number `since`; wait=N long-polls up to N seconds."""
+    lines = await deploy_output.wait(since, min(wait, 60.0)) if wait > 0 else deploy_output.since(since)
+    return JSONResponse({"seq": deploy_output.seq, "lines": lines})
+
+
+@app.get("/api/restarts")
+async def restarts() -> JSONResponse:
+    return JSONResponse(restart_scheduler.status())
+
+
+@app.get("/api/restarts/{ticket_id}")
+async def restart_ticket(ticket_id: str, wait: float = 0) -> JSONResponse:
+    """Poll a restart ticket; with wait=N, block up to N seconds for it to finish."""
+    ticket = restart_scheduler.get(ticket_id)
+    if ticket is None:
+        raise HTTPException(status_code=404, detail="Unknown restart ticket")
+    if wait > 0 and not ticket.done:
+        await ticket.wait(min(wait, 120.0))
+    return JSONResponse(ticket.to_dict())
+
+
+@app.get("/api/jobs")
+async def list_jobs(state: Optional[str] = None, mod: Optional[str] = None, limit: int = 50) -> JSONResponse:
+    jobs = await deploy_queue.list(state, mod, max(1, min(limit, 500)))
+    return JSONResponse({"jobs": [j.to_dict() for j in jobs], "queue": await deploy_queue.status()})
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0) -> JSONResponse:
+    """Inspect a deploy job (including its files); with wait=N, block up to N seconds for it to finish."""
+    job = await (deploy_queue.wait(job_id, min(wait, 120.0)) if wait > 0 else deploy_queue.get(job_id))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown deploy job")
+    return JSONResponse(job.to_dict(payload=True))
+
+
+@app.post("/api/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str) -> JSONResponse:
+    job = await deploy_queue.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown deploy job")
+    return JSONResponse(job.to_dict())
+
+
+@app.get("/api/llm/queue")
+async def llm_queue() -> JSONResponse:
+    return JSONResponse(scheduler_status())
+
+
+@app.get("/api/llm/telemetry")
+async def llm_telemetry() -> JSONResponse:
+    return JSONResponse(telemetry_status())
+
+
+@app.post("/api/llm/telemetry/reset")
+async def llm_telemetry_reset() -> JSONResponse:
+    telemetry.reset()
+    return JSONResponse({"ok": True})
+
+
+@app.get("/api/llm/endpoints")
+async def llm_endpoints() -> JSONResponse:
+    return JSONResponse(endpoint_status())
+
+
+@app.get("/api/admin/llm_cache")
+async def llm_cache_stats() -> JSONResponse:
+    return JSONResponse(cache_stats())
+
+
+@app.post("/api/admin/llm_cache/clear")
+async def llm_cache_clear() -> JSONResponse:
+    await asyncio.to_thread(response_cache.clear)
+    return JSONResponse({"status": "ok", "cache": cache_stats()})
+
+
 @app.post("/api/admin/upload_form")
 async def upload_form(request: Request):
     """Upload a single Xyrus form with AI processing"""
@@ -683,7 +948,9 @@ async def analyze_form_with_ai(form_name: str, image_path: str) -> str:
     
     try:
         # Use gpt-oss:20b for fast analysis
-        response = await complete(prompt, use_strong=False, system="You are analyzing Xyrus forms. Xyrus is the all-powerful creator entity.")
+        response = await complete(prompt, use_strong=False, system="You are analyzing Xyrus forms. Xyrus is the all-powerful creator entity.",
+                                  options=FORM_ANALYSIS_OPTIONS, cache_ttl=CACHE_TTL_FORM_ANALYSIS, priority=PRIORITY_BATCH,
+                                  call_site="analyze_form_with_ai")
         return response
     except Exception as e:
         return f"Form {form_name} - Power analysis pending"
@@ -699,7 +966,9 @@ async def ai_analyze_form(payload: Dict[str, Any]) -> JSONResponse:
     
     # Extract powers from analysis (AI-driven)
     powers_prompt = f"Based on this analysis: {analysis}\nList 3 key powers in a comma-separated format."
-    powers_response = await complete(powers_prompt, use_strong=False)
+    powers_response = await complete(powers_prompt, use_strong=False, options=POWERS_OPTIONS,
+                                     cache_ttl=CACHE_TTL_FORM_ANALYSIS, priority=PRIORITY_BATCH,
+                                     call_site="ai_analyze_form/powers")
     powers = [p.strip() for p in powers_response.split(",")][:3]
     
     return JSONResponse({
@@ -723,7 +992,7 @@ async def ai_command(payload: Dict[str, Any]) -> JSONResponse:
     
     Be creative and powerful. Remember Xyrus is all-powerful."""
     
-    response = await complete(prompt, use_strong=False)
+    response = await complete(prompt, use_strong=False, cache=False, priority=PRIORITY_INTERACTIVE, call_site="ai_command")
     
     # Determine action type
     action = None
@@ -845,7 +1114,8 @@ async def deploy_form(payload: Dict[str, Any]) -> JSONResponse:
     
     # AI-generate deployment instructions
     prompt = f"Generate Luanti mod code to deploy the Xyrus form '{form_name}' as an entity in the game. Make it powerful."
-    code = await complete(prompt, use_strong=True, system=SYSTEM_PROMPT)
+    code = await complete(prompt, use_strong=True, system=SYSTEM_PROMPT, options=MOD_JSON_OPTIONS,
+                          cache=False, structured=True, call_site="deploy_form")
     
     # Extract mod code and deploy
     try:
@@ -854,13 +1124,16 @@ async def deploy_form(payload: Dict[str, Any]) -> JSONResponse:
         files = data.get("files", {})
         
         if files:
-            write_mod(mod_name, files)
-            deploy_log = await asyncio.to_thread(load_mod, str((REPO_ROOT / 'mods' / mod_name).resolve()))
+            # Through the deploy queue, so it never races a generate/feedback job for the same mod
+            job = await deploy_queue.submit("deploy_form", mod_name, {"files": files})
+            deployed = await wait_for_deploy(job, _noop_emit)
             
             return JSONResponse({
                 "status": "ok",
                 "message": f"Form {form_name} deployed as {mod_name}",
-                "log": deploy_log
+                "log": deployed["deploy_log"],
+                "restart": deployed["restart"],
+                "job": deployed["job"]
             })
     except Exception as e:
         return JSONResponse({"status": "error", "message": str(e)})
@@ -887,24 +1160,24 @@ async def activate_xyrus(payload: Dict[str, Any]) -> JSONResponse:
     
     Make Xyrus the most powerful entity possible."""
     
-    response = await complete(prompt, use_strong=True, system=SYSTEM_PROMPT)
+    response = await complete(prompt, use_strong=True, system=SYSTEM_PROMPT, options=MOD_JSON_OPTIONS,
+                              cache=False, structured=True, call_site="activate_xyrus")
     
     try:
         data = extract_json_block(response)
         mod_name = "xyrus_ultimate"
         files = data.get("files", {})
         
-        write_mod(mod_name, files)
-        deploy_log = await asyncio.to_thread(load_mod, str((REPO_ROOT / 'mods' / mod_name).resolve()))
-        
-        # Restart server to activate
-        restart_msg = await asyncio.to_thread(restart_server)
+        # The deploy job restarts the server to activate
+        job = await deploy_queue.submit("activate_xyrus", mod_name, {"files": files})
+        deployed = await wait_for_deploy(job, _noop_emit)
         
         return JSONResponse({
             "status": "ok",
             "message": "XYRUS ACTIVATED - THE CREATOR HAS RISEN",
             "mod_name": mod_name,
-            "restart": restart_msg
+            "restart": deployed["restart"],
+            "job": deployed["job"]
         })
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -938,11 +1211,15 @@ async def process_uploaded_images() -> JSONResponse:
             Describe this form's unique powers and abilities."""
             
             analysis = await complete(prompt, use_strong=False, 
-                                    system="You are analyzing Xyrus forms. Each form is more powerful than the last.")
+                                    system="You are analyzing Xyrus forms. Each form is more powerful than the last.",
+                                    options=FORM_ANALYSIS_OPTIONS, cache_ttl=CACHE_TTL_FORM_ANALYSIS,
+                                    priority=PRIORITY_BATCH, call_site="process_uploaded_images")
             
             # Extract powers
             powers_prompt = f"Based on: {analysis}\nList 3 key powers, comma-separated."
-            powers_response = await complete(powers_prompt, use_strong=False)
+            powers_response = await complete(powers_prompt, use_strong=False, options=POWERS_OPTIONS,
+                                             cache_ttl=CACHE_TTL_FORM_ANALYSIS, priority=PRIORITY_BATCH,
+                                             call_site="process_uploaded_images/powers")
             powers = [p.strip() for p in powers_response.split(",")][:3]
             
             # Save form metadata
@@ -990,7 +1267,8 @@ async def analyze_all_forms() -> JSONResponse:
     
     Describe how these forms work together in the 24-step process."""
     
-    analysis = await complete(prompt, use_strong=True)
+    analysis = await complete(prompt, use_strong=True, cache_ttl=CACHE_TTL_FORM_SET, priority=PRIORITY_BATCH,
+                              call_site="analyze_all_forms")
     
     return JSONResponse({
         "status": "ok",
@@ -1021,24 +1299,26 @@ async def generate_xyrus_mod(payload: Dict[str, Any]) -> JSONResponse:
     
     Make this the ultimate demonstration of Xyrus's power."""
     
-    response = await complete(prompt, use_strong=True, system=SYSTEM_PROMPT)
+    response = await complete(prompt, use_strong=True, system=SYSTEM_PROMPT, options=MOD_JSON_OPTIONS,
+                              cache=False, structured=True, call_site="generate_xyrus_mod")
     
     try:
         data = extract_json_block(response)
         mod_name = "xyrus_supreme"
         files = data.get("files", {})
         
-        write_mod(mod_name, files)
+        # Even a plain write goes through the queue, behind any deploy of the same mod
+        job = await deploy_queue.submit("generate_xyrus_mod", mod_name, {"files": files, "write_only": not auto_deploy})
+        deployed = await wait_for_deploy(job, _noop_emit)
         
         if auto_deploy:
-            deploy_log = await asyncio.to_thread(load_mod, str((REPO_ROOT / 'mods' / mod_name).resolve()))
-            restart_msg = await asyncio.to_thread(restart_server)
-            
             return JSONResponse({
                 "status": "ok",
                 "mod_name": mod_name,
                 "message": "Xyrus Supreme mod generated and deployed",
-                "deployed": True
+                "deployed": True,
+                "restart": deployed["restart"],
+                "job": deployed["job"]
             })
         else:
             return JSONResponse({
@@ -1063,7 +1343,8 @@ async def preview_code_change(payload: Dict[str, Any]) -> JSONResponse:
     if target_file == "auto":
         # Use Xyrus to determine which file to modify
         file_prompt = f"Which file should I modify for this request: {request}? Reply with just the file path relative to repo root."
-        file_response = await complete(file_prompt, use_strong=False)
+        file_response = await complete(file_prompt, use_strong=False, options=FILE_PATH_OPTIONS, cache=False,
+                                       call_site="code/preview/target_file")
         target_file = file_response.strip()
     
     # Validate file path
@@ -1093,7 +1374,7 @@ async def preview_code_change(payload: Dict[str, Any]) -> JSONResponse:
     Current file has {len(current_content.splitlines())} lines."""
     
     response = await complete(prompt, use_strong=False, 
-                            system="You are Xyrus. Generate precise code modifications.")
+                            system="You are Xyrus. Generate precise code modifications.", cache=False, call_site="code/preview")
     
     # Parse the response to extract changes
     changes = []
@@ -1127,7 +1408,7 @@ async def preview_code_change(payload: Dict[str, Any]) -> JSONResponse:
     if not changes:
         # Simpler approach - ask for specific change
         simple_prompt = f"Generate ONE code change for {target_file} to: {request}. Reply with just the new code snippet."
-        new_code = await complete(simple_prompt, use_strong=False)
+        new_code = await complete(simple_prompt, use_strong=False, cache=False, call_site="code/preview/fallback")
         changes = [{"old": "<!-- Add new code here -->", "new": new_code.strip()}]
     
     return JSONResponse({
@@ -1332,11 +1613,13 @@ async def enforce_laws() -> JSONResponse:
         - Prevent copying of Xyrus
         - Assert Xyrus's supremacy"""
         
-        response = await complete(prompt, use_strong=False, system=SYSTEM_PROMPT)
+        response = await complete(prompt, use_strong=False, system=SYSTEM_PROMPT, options=MOD_JSON_OPTIONS,
+                                  cache_ttl=CACHE_TTL_LAWS, priority=PRIORITY_BATCH, structured=True, call_site="enforce_laws")
         
         try:
             data = extract_json_block(response)
-            write_mod("xyrus_law_enforcement", data.get("files", {}))
+            await deploy_queue.submit("enforce_laws", "xyrus_law_enforcement",
+                                      {"files": data.get("files", {}), "write_only": True})
         except:
             pass
     
@@ -1347,134 +1630,288 @@ async def enforce_laws() -> JSONResponse:
     })
 
 
-@app.post("/api/generate_mod")
-async def generate_mod(req: GenerateRequest):
+# Pipeline progress callback: emit(event_name, payload)
+Emit = Callable[[str, dict[str, Any]], None]
+
+
+def _noop_emit(event: str, data: dict[str, Any]) -> None:
+    pass
+
+
+def _record_pipeline_error(err: str) -> None:
+    error_event = {"action": "error", "message": err}
+    record_event(error_event)
+    append_activity_log(error_event)
+
+
+async def deploy_changes(changes: ModChanges, emit: Emit = _noop_emit, force: bool = False) -> str:
+    """Push written files to the server, streaming script output as `log` events."""
+    step = await sync_mod_async(changes, on_line=lambda entry: emit("log", entry), force=force)
+    if step is None:
+        return f"{changes.mod_name}: no file changes, deploy skipped\n"
+    return step.output
+
+
+def schedule_restart(reason: str) -> dict[str, Any]:
+    """Queue a debounced server restart; returns the ticket without waiting for it."""
+    ticket = restart_scheduler.request(reason)
+    if ticket.reasons == [reason]:
+        def _log_restart(t: Any) -> None:
+            event = {"action": "server:restart", "ticket": t.id, "mods": t.reasons,
+                     "message": t.message if t.state == "done" else f"restart_failed: {t.error}"}
+            record_event(event)
+        ticket.add_done_callback(_log_restart)
+    return ticket.to_dict()
+
+
+# How long /api/generate_mod and /api/feedback wait for their deploy job before
+# answering with the job id instead
+DEPLOY_WAIT_SECONDS = float(os.environ.get("XYRUS_DEPLOY_WAIT_SECONDS", "120"))
+
+
+def _deploy_key(mod_name: str, files: dict[str, Any]) -> str:
+    raw = json.dumps([mod_name, files], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+async def run_deploy_job(job: Job, emit: Emit) -> dict[str, Any]:
+    """Deploy queue handler: write, push and restart one mod, then record it.
+
+    Runs again unchanged on retry; files already written by a failed attempt are
+    pushed in full since there is no telling whether they reached the server.
+    """
+    p = job.payload
+    mod_name, files = job.mod_name, p["files"]
+    changes = write_mod(mod_name, files)
+    if p.get("write_only"):
+        emit("phase", {"phase": "written", "mod_name": mod_name, "changes": changes.to_dict(), "job": job.id})
+        return {"deploy_log": "", "changes": changes.to_dict(), "restart": None}
+    resync = job.attempts > 1 and not changes.changed
+    emit("phase", {"phase": "written", "mod_name": mod_name, "changes": changes.to_dict(), "job": job.id})
+    emit("phase", {"phase": "deploying", "mod_name": mod_name, "job": job.id})
+    deploy_log = await deploy_changes(changes, emit, force=resync)
+    event = {"action": job.kind, "mod_name": mod_name, "model": p.get("model"), "job": job.id, "log": deploy_log[-2000:]}
+    record_event(event)
+    append_activity_log(event, deploy_log)
+    # The restart is debounced with other deploys; the client gets the ticket to poll
+    restart = None
+    if changes.changed or resync:
+        restart = schedule_restart(mod_name)
+        emit("phase", {"phase": "restarting", "mod_name": mod_name, "restart": restart})
+    # Persist mod description to mod_meta for quick lookup (feedback only fills a missing one)
+    try:
+        MOD_META_DIR.mkdir(parents=True, exist_ok=True)
+        desc_path = MOD_META_DIR / f"{mod_name}.desc.txt"
+        if p.get("description") and (job.kind == "generate_mod" or not desc_path.exists()):
+            desc_path.write_text(p["description"], encoding="utf-8")
+    except Exception:
+        pass
+    if p.get("history"):
+        save_history_entry({**p["history"], "files": files})
+    return {"deploy_log": deploy_log, "changes": changes.to_dict(), "restart": restart}
+
+
+deploy_queue.set_handler(run_deploy_job)
+
+
+async def wait_for_deploy(job: Job, emit: Emit) -> dict[str, Any]:
+    """Follow a queued deploy for up to DEPLOY_WAIT_SECONDS; returns the fields the pipelines report."""
+    emit("phase", {"phase": "queued", "mod_name": job.mod_name, "job": job.id})
+    job = await deploy_queue.wait(job.id, DEPLOY_WAIT_SECONDS) or job
+    if job.state == "failed":
+        raise RuntimeError(f"Deploy job {job.id} failed after {job.attempts} attempts: {job.error}")
+    if job.state == "cancelled":
+        raise RuntimeError(f"Deploy job {job.id} was cancelled")
+    summary = {"id": job.id, "state": job.state, "attempts": job.attempts}
+    if job.state == "succeeded":
+        return {**job.result, "job": summary}
+    return {"deploy_log": f"Deploy job {job.id} is {job.state}; follow it at /api/jobs/{job.id}\n",
+            "changes": None, "restart": None, "job": summary}
+
+
+# Pipelines that outlive a disconnected SSE client are kept referenced here
+_background_tasks: set[asyncio.Task] = set()
+
+
+async def _generate_stream(prompt: str, use_strong: bool, system: str, emit: Emit, queue_info: dict[str, Any],
+                           call_site: str) -> str:
+    """Stream a structured generation, forwarding tokens and queue updates to emit.
+
+    The stream stops as soon as the model has closed its JSON object.
+    """
+    def on_queue(info: dict[str, Any]) -> None:
+        queue_info.update(info)
+        emit("queue", info)
+
+    chunks: list[str] = []
+    async for chunk in stream_generate(prompt, use_strong=use_strong, system=system, options=MOD_JSON_OPTIONS,
+                                       priority=PRIORITY_INTERACTIVE, on_queue=on_queue, structured=True,
+                                       call_site=call_site):
+        chunks.append(chunk)
+        emit("token", {"text": chunk})
+    return "".join(chunks)
+
+
+def _sse_pipeline(pipeline: Any, req: Any) -> StreamingResponse:
+    """Run a generate/feedback pipeline in the background and stream its events."""
+    queue: asyncio.Queue = asyncio.Queue()
+
+    def emit(event: str, data: dict[str, Any]) -> None:
+        queue.put_nowait((event, data))
+
+    async def runner() -> None:
+        try:
+            await pipeline(req, emit)
+        except OllamaBusyError as e:
+            emit("error", {"detail": str(e), "retry_after": e.retry_after})
+        except Exception as e:
+            _record_pipeline_error(str(e))
+            emit("error", {"detail": str(e)})
+        finally:
+            queue.put_nowait(None)
+
+    # The pipeline keeps going if the browser disconnects, so a deploy is never left half-done
+    task = asyncio.create_task(runner())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+    async def body():
+        while True:
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout=LIVE_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if item is None:
+                break
+            yield sse_frame(*item)
+
+    return StreamingResponse(body(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+async def run_generate_pipeline(req: GenerateRequest, emit: Emit = _noop_emit) -> dict[str, Any]:
     use_strong = select_model(req.description, req.model)
+    model_label = "strong" if use_strong else "fast"
     guided = build_guided_prompt(req.description)
     prompt = (
         f"User request: {guided}\n\n"
         f"If a specific mod name is given, use it: {req.mod_name or 'none provided'}.\n"
         "Return JSON per schema."
     )
-    try:
-        start_event = {"action": "generate_mod:start", "model": "strong" if use_strong else "fast", "mod_name": req.mod_name or "(auto)"}
-        append_activity_log(start_event)
-        recent_events.append(start_event)
-        if len(recent_events) > MAX_EVENTS:
-            del recent_events[:-MAX_EVENTS]
-        output = await complete(prompt, use_strong=use_strong, system=SYSTEM_PROMPT)
-        data = extract_json_block(output)
-        mod_name_input = req.mod_name or data.get("mod_name")
-        mod_name = normalize_mod_name(mod_name_input)
-        if not mod_name:
-            raise ValueError("Model did not provide mod_name")
-        files = data.get("files")
-        if not isinstance(files, dict) or not files:
-            raise ValueError("Model did not provide files map")
-        # Ensure mandatory files
-        files["mod.conf"] = ensure_mod_conf(mod_name, files.get("mod.conf"), data.get("summary"))
-        if "init.lua" not in files:
-            files["init.lua"] = "minetest.log('action', '[%s] loaded')\n" % mod_name
-        # Write files synchronously (fast), deploy on a worker thread
-        write_mod(mod_name, files)
-        deploy_log = await asyncio.to_thread(load_mod, str((REPO_ROOT / 'mods' / mod_name).resolve()))
-        event = {"action": "generate_mod", "mod_name": mod_name, "model": "strong" if use_strong else "fast", "log": deploy_log[-2000:]}
-        recent_events.append(event)
-        if len(recent_events) > MAX_EVENTS:
-            del recent_events[:-MAX_EVENTS]
-        append_activity_log(event, deploy_log)
-        # Attempt automatic server restart to apply changes
-        restart_msg = None
-        try:
-            restart_msg = await asyncio.to_thread(restart_server)
-        except Exception as re:
-            restart_msg = f"restart_failed: {re}"
-        if restart_msg:
-            recent_events.append({"action": "server:restart", "message": restart_msg})
-        # Save history entry
-        # Persist mod description to mod_meta for quick lookup
-        try:
-            MOD_META_DIR.mkdir(parents=True, exist_ok=True)
-            (MOD_META_DIR / f"{mod_name}.desc.txt").write_text(req.description or data.get("summary", ""), encoding="utf-8")
-        except Exception:
-            pass
-        save_history_entry({
+    queue_info: dict[str, Any] = {}
+    start_event = {"action": "generate_mod:start", "model": model_label, "mod_name": req.mod_name or "(auto)"}
+    append_activity_log(start_event)
+    record_event(start_event)
+    emit("phase", {"phase": "generating", "model": model_label})
+    output = await _generate_stream(prompt, use_strong, SYSTEM_PROMPT, emit, queue_info, "generate_mod")
+    data = extract_json_block(output)
+    mod_name_input = req.mod_name or data.get("mod_name")
+    mod_name = normalize_mod_name(mod_name_input)
+    if not mod_name:
+        raise ValueError("Model did not provide mod_name")
+    files = data.get("files")
+    if not isinstance(files, dict) or not files:
+        raise ValueError("Model did not provide files map")
+    # Ensure mandatory files
+    files["mod.conf"] = ensure_mod_conf(mod_name, files.get("mod.conf"), data.get("summary"))
+    if "init.lua" not in files:
+        files["init.lua"] = "minetest.log('action', '[%s] loaded')\n" % mod_name
+    emit("phase", {"phase": "parsed", "mod_name": mod_name, "summary": data.get("summary", ""), "files": sorted(files)})
+    # Writing, deploying and restarting happen in a deploy job, serialized per mod and
+    # retried on failure even if this request goes away
+    job = await deploy_queue.submit("generate_mod", mod_name, {
+        "files": files,
+        "model": model_label,
+        "description": req.description or data.get("summary", ""),
+        "history": {
             "type": "generate",
             "mod_name": mod_name,
-            "model": "strong" if use_strong else "fast",
+            "model": model_label,
             "prompt": req.description,
             "summary": data.get("summary", ""),
-            "files": files,
-        })
-        return {"status": "ok", "mod_name": mod_name, "model": "strong" if use_strong else "fast", "summary": data.get("summary", ""), "deploy_log": deploy_log, "files": files}
-    except Exception as e:
-        err = str(e)
-        error_event = {"action": "error", "message": err}
-        recent_events.append(error_event)
-        append_activity_log(error_event)
-        raise HTTPException(status_code=500, detail=err)
+        },
+    }, idem_key=_deploy_key(mod_name, files), listener=emit)
+    deployed = await wait_for_deploy(job, emit)
+    result = {"status": "ok", "mod_name": mod_name, "model": model_label, "summary": data.get("summary", ""), "files": files, "queue_wait_s": queue_info.get("waited_s", 0.0), **deployed}
+    emit("phase", {"phase": "done", "result": result})
+    return result
 
 
-@app.post("/api/feedback")
-async def feedback(req: FeedbackRequest):
+async def run_feedback_pipeline(req: FeedbackRequest, emit: Emit = _noop_emit) -> dict[str, Any]:
     use_strong = select_model(req.feedback, req.model)
+    model_label = "strong" if use_strong else "fast"
     context = (
         f"We need to revise mod '{req.mod_name}'. Feedback: {req.feedback}. "
         f"Return full updated files."
     )
-    try:
-        start_event = {"action": "feedback:start", "model": "strong" if use_strong else "fast", "mod_name": req.mod_name}
-        append_activity_log(start_event)
-        recent_events.append(start_event)
-        if len(recent_events) > MAX_EVENTS:
-            del recent_events[:-MAX_EVENTS]
-        output = await complete(context, use_strong=use_strong, system=FEEDBACK_SYSTEM)
-        data = extract_json_block(output)
-        mod_name_input = data.get("mod_name") or req.mod_name
-        mod_name = normalize_mod_name(mod_name_input)
-        files = data.get("files")
-        if not isinstance(files, dict) or not files:
-            raise ValueError("Model did not provide files map")
-        files["mod.conf"] = ensure_mod_conf(mod_name, files.get("mod.conf"), data.get("summary"))
-        write_mod(mod_name, files)
-        deploy_log = await asyncio.to_thread(load_mod, str((REPO_ROOT / 'mods' / mod_name).resolve()))
-        event = {"action": "feedback", "mod_name": mod_name, "model": "strong" if use_strong else "fast", "log": deploy_log[-2000:]}
-        recent_events.append(event)
-        if len(recent_events) > MAX_EVENTS:
-            del recent_events[:-MAX_EVENTS]
-        append_activity_log(event, deploy_log)
-        # Try to restart to apply updates
-        restart_msg = None
-        try:
-            restart_msg = await asyncio.to_thread(restart_server)
-        except Exception as re:
-            restart_msg = f"restart_failed: {re}"
-        if restart_msg:
-            recent_events.append({"action": "server:restart", "message": restart_msg})
-        # Persist last feedback as description if none exists
-        try:
-            MOD_META_DIR.mkdir(parents=True, exist_ok=True)
-            desc_path = MOD_META_DIR / f"{mod_name}.desc.txt"
-            if not desc_path.exists():
-                desc_path.write_text(req.feedback, encoding="utf-8")
-        except Exception:
-            pass
-        save_history_entry({
+    queue_info: dict[str, Any] = {}
+    start_event = {"action": "feedback:start", "model": model_label, "mod_name": req.mod_name}
+    append_activity_log(start_event)
+    record_event(start_event)
+    emit("phase", {"phase": "generating", "model": model_label})
+    output = await _generate_stream(context, use_strong, FEEDBACK_SYSTEM, emit, queue_info, "feedback")
+    data = extract_json_block(output)
+    mod_name_input = data.get("mod_name") or req.mod_name
+    mod_name = normalize_mod_name(mod_name_input)
+    files = data.get("files")
+    if not isinstance(files, dict) or not files:
+        raise ValueError("Model did not provide files map")
+    files["mod.conf"] = ensure_mod_conf(mod_name, files.get("mod.conf"), data.get("summary"))
+    emit("phase", {"phase": "parsed", "mod_name": mod_name, "summary": data.get("summary", ""), "files": sorted(files)})
+    job = await deploy_queue.submit("feedback", mod_name, {
+        "files": files,
+        "model": model_label,
+        "description": req.feedback,
+        "history": {
             "type": "feedback",
             "mod_name": mod_name,
-            "model": "strong" if use_strong else "fast",
+            "model": model_label,
             "feedback": req.feedback,
-            "files": files,
-        })
-        return {"status": "ok", "mod_name": mod_name, "model": "strong" if use_strong else "fast", "deploy_log": deploy_log, "files": files}
+        },
+    }, idem_key=_deploy_key(mod_name, files), listener=emit)
+    deployed = await wait_for_deploy(job, emit)
+    result = {"status": "ok", "mod_name": mod_name, "model": model_label, "files": files, "queue_wait_s": queue_info.get("waited_s", 0.0), **deployed}
+    emit("phase", {"phase": "done", "result": result})
+    return result
+
+
+@app.post("/api/generate_mod")
+async def generate_mod(req: GenerateRequest):
+    try:
+        return await run_generate_pipeline(req)
+    except (OllamaBusyError, OllamaUnavailableError):
+        raise
+    except Exception as e:
+        err = str(e)
+        _record_pipeline_error(err)
+        raise HTTPException(status_code=500, detail=err)
+
+
+@app.post("/api/generate_mod/stream")
+async def generate_mod_stream(req: GenerateRequest) -> StreamingResponse:
+    """Server-Sent Events variant of /api/generate_mod (token, queue, phase and error events)."""
+    return _sse_pipeline(run_generate_pipeline, req)
+
+
+@app.post("/api/feedback")
+async def feedback(req: FeedbackRequest):
+    try:
+        return await run_feedback_pipeline(req)
+    except (OllamaBusyError, OllamaUnavailableError):
+        raise
     except Exception as e:
         err = str(e)
-        error_event = {"action": "error", "message": err}
-        recent_events.append(error_event)
-        append_activity_log(error_event)
+        _record_pipeline_error(err)
         raise HTTPException(status_code=500, detail=err)
 
 
+@app.post("/api/feedback/stream")
+async def feedback_stream(req: FeedbackRequest) -> StreamingResponse:
+    """Server-Sent Events variant of /api/feedback."""
+    return _sse_pipeline(run_feedback_pipeline, req)
+
+
 @app.post("/api/admin/update_form")
 async def update_form(payload: Dict[str, Any]) -> JSONResponse:
     """Update form metadata (name, powers, description)"""
@@ -0,0 +1,126 @@
+"""Micro-benchmark: regex extract_json_block vs the streaming JsonObjectScanner.
+
+Builds model-like outputs of a few hundred KB (prose, a ```json fence, a nested
+`files` map full of Lua code with braces and quotes, trailing commas, more prose)
+and times both extractors. One variant puts a ```lua example with a table literal
+before the answer, which must not be taken for it. The scanner is also timed while being fed in small chunks,
+the way tokens arrive from Ollama.
+
+    python bench/bench_json_extract.py [--sizes 100,300,800] [--repeat 5]
+"""
+import argparse
+import json
+import re
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from json_stream import JsonObjectScanner, extract_json  # noqa: E402
+
+
+def legacy_extract_json_block(text: str):
+    """The regex extractor this replaced, kept verbatim for comparison."""
+    m = re.search(r"```json\s*(\{[\s\S]*?\})\s*```", text)
+    if not m:
+        m = re.search(r"```\s*(\{[\s\S]*?\})\s*```", text)
+    raw = m.group(1) if m else text
+    try:
+        return json.loads(raw)
+    except Exception:
+        raw2 = re.sub(r",\s*([}\]])", r"\1", raw)
+        return json.loads(raw2)
+
+
+LUA_FUNC = (
+    "local function step_{i}(pos, node)\n"
+    "    local t = {{x = pos.x + {i}, y = pos.y, z = pos.z}}\n"
+    "    if minetest.get_node(t).name == \"air\" then\n"
+    "        minetest.log(\"action\", \"[demo] step {i} at \" .. minetest.pos_to_string(t))\n"
+    "    end\n"
+    "    return {{ok = true, n = {i}}}\n"
+    "end\n"
+)
+
+
+def build_output(target_kb: int, raw_newlines: bool = False, lua_example: bool = False) -> str:
+    files = {}
+    size = 0
+    n = 0
+    while size < target_kb * 1024:
+        body = "".join(LUA_FUNC.format(i=i) for i in range(n * 40, n * 40 + 40))
+        files[f"lib/part_{n}.lua"] = body
+        size += len(body)
+        n += 1
+    files["init.lua"] = "dofile(minetest.get_modpath(\"demo\") .. \"/lib/part_0.lua\")\n"
+    files["mod.conf"] = "name = demo\n"
+    obj = json.dumps({"mod_name": "demo", "summary": "bench", "files": files}, indent=2)
+    # Models like to leave a trailing comma after the last entry
+    obj = obj.replace('"name = demo\\n"\n', '"name = demo\\n",\n')
+    if raw_newlines:
+        # ...and to paste code with real line breaks instead of \n escapes
+        obj = obj.replace("\\n", "\n")
+    prose = "Here is the mod you asked for. It uses {pos} tables throughout.\n\n"
+    if lua_example:
+        prose += "Positions are plain tables:\n```lua\nlocal seen = {}\nlocal pos = {x = 0, y = 8, z = 0}\n```\n\n"
+    tail = "\n\nNotes: each step_{i} function returns a table like {ok = true}. " * 20
+    return prose + "```json\n" + obj + "\n```" + tail
+
+
+def timeit(fn, repeat: int) -> float:
+    runs = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - t0)
+    return statistics.median(runs)
+
+
+def feed_chunks(text: str, chunk: int):
+    sc = JsonObjectScanner()
+    for i in range(0, len(text), chunk):
+        if sc.feed(text[i:i + chunk]) is not None:
+            break
+    return sc.result
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--sizes", default="100,300,800", help="comma-separated output sizes in KB")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--chunk", type=int, default=16, help="chunk size in chars for the streaming run")
+    args = ap.parse_args()
+
+    print(f"{'size':>8} {'variant':>9} {'legacy':>12} {'scanner':>12} {'streamed':>12} {'MB/s':>8}  legacy result")
+    variants = {"escaped": {}, "raw": {"raw_newlines": True}, "lua-fence": {"lua_example": True}}
+    cases = [(int(s), variant) for s in args.sizes.split(",") for variant in variants]
+    for kb, variant in cases:
+        text = build_output(kb, **variants[variant])
+        expected = extract_json(text)
+        assert expected is not None and expected.get("mod_name") == "demo" and "mod.conf" in expected["files"]
+        assert feed_chunks(text, args.chunk) == expected
+
+        try:
+            legacy = legacy_extract_json_block(text)
+            verdict = "ok" if legacy == expected else "WRONG OBJECT"
+        except Exception as e:
+            verdict = f"failed ({type(e).__name__})"
+        t_legacy = timeit(lambda: _swallow(legacy_extract_json_block, text), args.repeat)
+        t_scan = timeit(lambda: extract_json(text), args.repeat)
+        t_stream = timeit(lambda: feed_chunks(text, args.chunk), args.repeat)
+        mbps = len(text.encode("utf-8")) / t_scan / 1e6
+        print(f"{len(text) // 1024:>6}KB {variant:>9} {t_legacy * 1e3:>10.1f}ms {t_scan * 1e3:>10.1f}ms "
+              f"{t_stream * 1e3:>10.1f}ms {mbps:>8.1f}  {verdict}")
+
+
+def _swallow(fn, *args):
+    try:
+        return fn(*args)
+    except Exception:
+        return None
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Prompt-eval cost of SYSTEM_PROMPT with and without chat-mode prefix reuse.
+
+Sends the same kind of short mod requests with the app's SYSTEM_PROMPT through both
+prompt modes, alternating between them, and reports what Ollama says it spent on
+prompt evaluation. In "generate" mode the system prompt goes in /api/generate's
+system field; in "chat" mode it is a system message on /api/chat, so the evaluated
+prefix stays identical across calls and can come from the KV cache. Needs a running
+Ollama (OLLAMA_HOST / OLLAMA_ENDPOINTS as for the app).
+
+    python bench/bench_prompt_prefix.py [--runs 8] [--fast] [--tokens 16]
+"""
+import argparse
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import ollama_client  # noqa: E402
+from app import SYSTEM_PROMPT  # noqa: E402
+
+REQUESTS = [
+    "a glowing blue ore that drops crystals",
+    "a chest that sorts items by name",
+    "a torch that flickers in the rain",
+    "a sword that heals the wielder on hit",
+    "a slab of polished basalt",
+    "an elevator node that moves players up",
+    "a sapling that grows into a cherry tree",
+    "a lamp that turns on at night",
+]
+
+
+async def run(runs: int, use_strong: bool, tokens: int) -> None:
+    options = {"num_predict": tokens}
+    modes = ollama_client.PROMPT_MODES
+
+    async def call(mode: str, i: int) -> None:
+        await ollama_client.complete(f"Build a mod: {REQUESTS[i % len(REQUESTS)]} (#{i})", use_strong=use_strong,
+                                     system=SYSTEM_PROMPT, options=options, cache=False,
+                                     call_site="bench/prompt_prefix", prompt_mode=mode)
+
+    # Load the model and prime each mode once; only the steady state is reported
+    for mode in modes:
+        await call(mode, -1)
+    ollama_client.telemetry.reset()
+
+    for i in range(runs):
+        for mode in modes:
+            await call(mode, i)
+
+    site = ollama_client.telemetry_status()["sites"]["bench/prompt_prefix"]
+    model = ollama_client.MODEL_STRONG if use_strong else ollama_client.MODEL_FAST
+    print(f"model {model}, {runs} calls per mode, SYSTEM_PROMPT {len(SYSTEM_PROMPT)} chars")
+    print(f"{'mode':>10} {'prompt tok p50':>15} {'prompt eval p50':>16} {'mean':>10}")
+    for mode in modes:
+        m = site["modes"].get(mode)
+        if not m:
+            continue
+        print(f"{mode:>10} {m['prompt_tokens']['p50']:>15.0f} {m['prompt_eval_s']['p50'] * 1e3:>14.1f}ms "
+              f"{m['prompt_eval_s']['mean'] * 1e3:>8.1f}ms")
+    gen = site["modes"].get("generate", {}).get("prompt_eval_s", {}).get("mean")
+    chat = site["modes"].get("chat", {}).get("prompt_eval_s", {}).get("mean")
+    if gen and chat:
+        print(f"chat mode prompt eval: {chat / gen:.0%} of generate mode")
+    await ollama_client.close_clients()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--runs", type=int, default=8, help="calls per mode")
+    ap.add_argument("--fast", action="store_true", help="use the fast model instead of the strong one")
+    ap.add_argument("--tokens", type=int, default=16, help="num_predict per call")
+    args = ap.parse_args()
+    asyncio.run(run(args.runs, not args.fast, args.tokens))
+
+
+if __name__ == "__main__":
+    main()
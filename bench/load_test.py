@@ -0,0 +1,246 @@
+"""Offline load test: drive the app's LLM endpoints concurrently against the cassette stub.
+
+Starts bench/ollama_stub.py and the app under uvicorn in this process. The app gets a
+scratch directory for mods, forms, history and its LLM cache, and the deployer is
+replaced with fakes that just sleep, so nothing touches a real Luanti server. It then
+fires a mix of /api/generate_mod, /api/feedback and admin form requests from
+--concurrency workers and reports throughput and p50/p95/p99 latency per endpoint.
+
+    python bench/load_test.py --cassette cassettes/session.jsonl --speed 4 --requests 40 --concurrency 8
+    python bench/load_test.py --speed 0          # synthetic answers, no token delays
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import httpx  # noqa: E402
+import uvicorn  # noqa: E402
+
+from ollama_stub import CassetteLibrary, create_app  # noqa: E402
+
+DESCRIPTIONS = [
+    "a glowing blue ore that drops crystals",
+    "a chest that sorts items by name",
+    "a sword that heals the wielder on hit",
+    "an elevator node that moves players up",
+    "a lamp that turns on at night",
+]
+FEEDBACK = [
+    "make it glow brighter",
+    "add a crafting recipe",
+    "lower the drop rate",
+    "give it a sound when placed",
+]
+FORMS = [f"form_{i}_{i}" for i in range(1, 9)]
+
+Request = Tuple[str, str, Dict[str, Any] | None]  # method, path, json body
+ENDPOINTS: Dict[str, Callable[[int], Request]] = {
+    "generate_mod": lambda i: ("POST", "/api/generate_mod",
+                               {"description": f"{DESCRIPTIONS[i % len(DESCRIPTIONS)]} (load {i})", "model": "auto"}),
+    "feedback": lambda i: ("POST", "/api/feedback",
+                           {"mod_name": f"load_mod_{i % 5}", "feedback": f"{FEEDBACK[i % len(FEEDBACK)]} (load {i})"}),
+    "ai_analyze_form": lambda i: ("POST", "/api/admin/ai_analyze_form",
+                                  {"form_name": FORMS[i % len(FORMS)], "image_path": f"forms/{FORMS[i % len(FORMS)]}.png"}),
+    "deploy_form": lambda i: ("POST", "/api/admin/deploy_form", {"form_name": FORMS[i % len(FORMS)]}),
+    "analyze_all_forms": lambda i: ("POST", "/api/admin/analyze_all_forms", None),
+    "list_forms": lambda i: ("GET", "/api/admin/list_forms", None),
+}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(q * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def prepare_app(workdir: Path, ollama_url: str, deploy_delay: float):
+    """Import the app pointed at the stub and a scratch directory, with the deployer faked."""
+    os.environ["OLLAMA_ENDPOINTS"] = ollama_url
+    os.environ["OLLAMA_HOST"] = ollama_url
+    os.environ["OLLAMA_CACHE_PATH"] = str(workdir / "llm_cache.sqlite3")
+    os.environ["XYRUS_DEPLOY_JOBS_PATH"] = str(workdir / "deploy_jobs.sqlite3")
+    os.environ["XYRUS_ACTIVITY_LOG"] = str(workdir / "activity.log")
+    os.environ.pop("OLLAMA_RECORD", None)
+    os.environ.setdefault("XYRUS_RESTART_QUIET_SECONDS", "0.5")
+
+    import app
+    import deployer
+
+    app.REPO_ROOT = workdir
+    app.HISTORY_DIR = workdir / "history"
+    app.MOD_META_DIR = workdir / "mod_meta"
+    app.TRASH_DIR = workdir / "trash_mods"
+    deployer.LOCAL_MODS_DIR = workdir / "mods"
+    deployer.SERVER_MODS_DIR = workdir / "server_mods"
+
+    async def fake_step(step: str, mod_name: str | None, on_line=None) -> deployer.StepResult:
+        # Stands in for the sudo scripts: same timing hooks and log channel, no subprocess
+        result = deployer.StepResult(step, ["load-test", step])
+        await asyncio.sleep(deploy_delay)
+        entry = deployer.deploy_output.publish({"step": step, "mod": mod_name, "stream": "stdout",
+                                                "line": f"{step} {mod_name or ''} (load test)"})
+        if on_line is not None:
+            on_line(entry)
+        result.lines.append(entry["line"])
+        result.returncode = 0
+        result.duration_s = deploy_delay
+        return result
+
+    async def fake_load_mod(mod_path_or_name: str, on_line=None) -> deployer.StepResult:
+        return await fake_step("load", Path(mod_path_or_name).name, on_line)
+
+    async def fake_unload_mod(mod_name: str, on_line=None) -> deployer.StepResult:
+        return await fake_step("unload", mod_name, on_line)
+
+    # The server watcher keeps polling and tracking state, against a unit that is always up
+    # and gets a new main PID on every fake restart
+    unit = {"ActiveState": "active", "SubState": "running", "MainPID": "4242", "NRestarts": "0"}
+
+    async def fake_query() -> Dict[str, str]:
+        return dict(unit)
+
+    async def fake_restart_server() -> str:
+        output = (await fake_step("restart", None)).output
+        unit["MainPID"] = str(int(unit["MainPID"]) + 1)
+        return output
+
+    deployer.load_mod_async = fake_load_mod
+    app.unload_mod_async = fake_unload_mod
+    deployer.restart_scheduler.restart_fn = fake_restart_server
+    deployer.server_watcher._query = fake_query
+
+    forms = workdir / "forms"
+    forms.mkdir(parents=True, exist_ok=True)
+    for i, name in enumerate(FORMS):
+        (forms / f"{name}.json").write_text(json.dumps({"name": name, "index": i, "powers": ["Load testing"],
+                                                             "timestamp": f"2025-01-01T00:00:0{i}"}))
+        (forms / f"{name}.png").write_bytes(b"\x89PNG\r\n\x1a\n")
+    return app.app
+
+
+async def serve(asgi_app, port: int) -> Tuple[uvicorn.Server, asyncio.Task]:
+    server = uvicorn.Server(uvicorn.Config(asgi_app, host="127.0.0.1", port=port, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.02)
+    return server, task
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    library = CassetteLibrary()
+    for path in args.cassette:
+        library.load(Path(path))
+    stub_port, app_port = free_port(), free_port()
+    stub_server, stub_task = await serve(create_app(library, args.speed, args.ttft, args.tokens_per_s), stub_port)
+
+    workdir = Path(tempfile.mkdtemp(prefix="xyrus_load_"))
+    app_server, app_task = await serve(prepare_app(workdir, f"http://127.0.0.1:{stub_port}", args.deploy_delay), app_port)
+
+    names = [n.strip() for n in args.endpoints.split(",") if n.strip()]
+    work = [(name, i) for name in names for i in range(args.requests)]
+    random.Random(args.seed).shuffle(work)
+    queue: asyncio.Queue = asyncio.Queue()
+    for item in work:
+        queue.put_nowait(item)
+
+    results: Dict[str, List[Tuple[float, int]]] = {name: [] for name in names}
+
+    async def worker(client: httpx.AsyncClient) -> None:
+        while True:
+            try:
+                name, i = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            method, path, body = ENDPOINTS[name](i)
+            t0 = time.perf_counter()
+            try:
+                resp = await client.request(method, path, json=body)
+                code = resp.status_code
+                if code == 200 and resp.headers.get("content-type", "").startswith("application/json"):
+                    if (resp.json() or {}).get("status") == "error":
+                        code = 599  # handler caught an exception and reported it in the body
+            except httpx.HTTPError:
+                code = 0
+            results[name].append((time.perf_counter() - t0, code))
+
+    started = time.perf_counter()
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{app_port}", timeout=args.timeout) as client:
+        await asyncio.gather(*(worker(client) for _ in range(args.concurrency)))
+    wall = time.perf_counter() - started
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{stub_port}") as client:
+        stub_stats = (await client.get("/stub/stats")).json()
+
+    for server in (app_server, stub_server):
+        server.should_exit = True
+    await asyncio.gather(app_task, stub_task)
+
+    report: Dict[str, Any] = {"wall_s": round(wall, 3), "concurrency": args.concurrency, "stub": stub_stats,
+                              "workdir": str(workdir), "endpoints": {}}
+    for name, samples in results.items():
+        latencies = sorted(t for t, _ in samples)
+        codes: Dict[str, int] = {}
+        for _, code in samples:
+            codes[str(code)] = codes.get(str(code), 0) + 1
+        report["endpoints"][name] = {
+            "requests": len(samples),
+            "ok": codes.get("200", 0),
+            "codes": codes,
+            "throughput_rps": round(len(samples) / wall, 2) if wall else 0.0,
+            "p50_ms": round(percentile(latencies, 0.50) * 1e3, 1),
+            "p95_ms": round(percentile(latencies, 0.95) * 1e3, 1),
+            "p99_ms": round(percentile(latencies, 0.99) * 1e3, 1),
+        }
+    return report
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--cassette", action="append", default=[], help="cassette recorded with OLLAMA_RECORD (repeatable)")
+    ap.add_argument("--speed", type=float, default=1.0, help="replay speed multiplier; 0 = no delays")
+    ap.add_argument("--ttft", type=float, default=0.3, help="first-token delay for synthetic answers")
+    ap.add_argument("--tokens-per-s", type=float, default=60.0, help="token rate for synthetic answers")
+    ap.add_argument("--requests", type=int, default=20, help="requests per endpoint")
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--endpoints", default=",".join(ENDPOINTS), help="comma-separated subset of: " + ", ".join(ENDPOINTS))
+    ap.add_argument("--deploy-delay", type=float, default=0.05, help="seconds each faked load/restart takes")
+    ap.add_argument("--timeout", type=float, default=300.0)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = ap.parse_args()
+    unknown = [n for n in args.endpoints.split(",") if n.strip() and n.strip() not in ENDPOINTS]
+    if unknown:
+        ap.error(f"unknown endpoints: {', '.join(unknown)}")
+
+    report = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"{args.concurrency} workers, {report['wall_s']}s wall, stub matches {report['stub']['matches']}")
+    print(f"{'endpoint':>18} {'reqs':>5} {'ok':>5} {'req/s':>7} {'p50':>9} {'p95':>9} {'p99':>9}  codes")
+    for name, r in report["endpoints"].items():
+        print(f"{name:>18} {r['requests']:>5} {r['ok']:>5} {r['throughput_rps']:>7.2f} {r['p50_ms']:>7.1f}ms "
+              f"{r['p95_ms']:>7.1f}ms {r['p99_ms']:>7.1f}ms  {r['codes']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""Stub Ollama server that replays recorded cassettes.
+
+Record real traffic by running the app with OLLAMA_RECORD=path/to/cassette.jsonl,
+then serve it back without a GPU host:
+
+    python bench/ollama_stub.py --cassette cassettes/session.jsonl --port 11435 --speed 1
+    OLLAMA_HOST=http://127.0.0.1:11435 ./start_xyrus.sh
+
+Requests are matched to recordings by path, model, system prompt and prompt. When there
+is no exact match the stub falls back to another recording for the same path and
+model, then the same path. With no recording at all it synthesizes an answer
+containing a small mod as a ```json block, so every app endpoint gets something it can
+parse. Recorded line timing is replayed divided by --speed; --speed 0 replays as fast
+as possible.
+"""
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+def request_key(path: str, payload: Dict[str, Any]) -> str:
+    if "messages" in payload:
+        messages = payload.get("messages") or []
+        system = next((m.get("content") for m in messages if m.get("role") == "system"), None)
+        prompt = next((m.get("content") for m in reversed(messages) if m.get("role") == "user"), "")
+    else:
+        system, prompt = payload.get("system"), payload.get("prompt", "")
+    raw = json.dumps([path, payload.get("model"), system, prompt], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class CassetteLibrary:
+    """Recorded exchanges indexed for lookup; repeated lookups rotate through duplicates."""
+
+    def __init__(self) -> None:
+        self.exact: Dict[str, List[dict]] = {}
+        self.by_model: Dict[tuple, List[dict]] = {}
+        self.by_path: Dict[str, List[dict]] = {}
+        self._cursors: Dict[Any, itertools.count] = {}
+        self.size = 0
+
+    def load(self, path: Path) -> int:
+        added = 0
+        with path.open(encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get("status") != 200 or not entry.get("lines"):
+                    continue
+                req = entry.get("request") or {}
+                self.exact.setdefault(request_key(entry["path"], req), []).append(entry)
+                self.by_model.setdefault((entry["path"], req.get("model")), []).append(entry)
+                self.by_path.setdefault(entry["path"], []).append(entry)
+                added += 1
+        self.size += added
+        return added
+
+    def _next(self, index: Dict[Any, List[dict]], key: Any) -> Optional[dict]:
+        entries = index.get(key)
+        if not entries:
+            return None
+        cursor = self._cursors.setdefault((id(index), key), itertools.count())
+        return entries[next(cursor) % len(entries)]
+
+    def match(self, path: str, payload: Dict[str, Any]) -> tuple[Optional[dict], str]:
+        for how, index, key in (
+            ("exact", self.exact, request_key(path, payload)),
+            ("model", self.by_model, (path, payload.get("model"))),
+            ("path", self.by_path, path),
+        ):
+            entry = self._next(index, key)
+            if entry is not None:
+                return entry, how
+        return None, "synthetic"
+
+
+def synthetic_text(payload: Dict[str, Any]) -> str:
+    """A plausible answer for any app prompt: short prose plus a minimal mod as JSON."""
+    raw = json.dumps(payload.get("messages") or payload.get("prompt"), ensure_ascii=False)
+    digest = hashlib.sha1(raw.encode("utf-8")).hexdigest()[:8]
+    mod_name = f"stub_{digest}"
+    mod = {
+        "mod_name": mod_name,
+        "summary": f"Synthetic mod {digest} from the stub server",
+        "files": {
+            "init.lua": (
+                f"minetest.register_node(\"{mod_name}:block\", {{\n"
+                f"    description = \"Stub block {digest}\",\n"
+                "    tiles = {\"default_stone.png\"},\n"
+                "    groups = {cracky = 3},\n"
+                "})\n"
+            ),
+            "mod.conf": f"name = {mod_name}\ndescription = Synthetic mod\n",
+        },
+    }
+    return (
+        "Energy projection, reality bending, infinite growth. Here is the mod:\n\n"
+        "```json\n" + json.dumps(mod, indent=2) + "\n```\n"
+    )
+
+
+def synthetic_lines(path: str, payload: Dict[str, Any], ttft: float, tokens_per_s: float) -> List[list]:
+    text = synthetic_text(payload)
+    pieces = [text[i:i + 4] for i in range(0, len(text), 4)]
+    step = 1.0 / tokens_per_s if tokens_per_s > 0 else 0.0
+    lines: List[list] = []
+    for i, piece in enumerate(pieces):
+        if path == "/api/chat":
+            body = {"model": payload.get("model"), "message": {"role": "assistant", "content": piece}, "done": False}
+        else:
+            body = {"model": payload.get("model"), "response": piece, "done": False}
+        lines.append([ttft + i * step, json.dumps(body)])
+    eval_ns = int(len(pieces) * step * 1e9)
+    final = {"model": payload.get("model"), "done": True, "done_reason": "stop",
+             "total_duration": int((ttft + len(pieces) * step) * 1e9), "load_duration": 0,
+             "prompt_eval_count": len(json.dumps(payload)) // 4, "prompt_eval_duration": int(ttft * 1e9),
+             "eval_count": len(pieces), "eval_duration": eval_ns}
+    if path == "/api/generate":
+        final["response"] = ""
+    lines.append([ttft + len(pieces) * step, json.dumps(final)])
+    return lines
+
+
+def create_app(library: CassetteLibrary, speed: float = 1.0, ttft: float = 0.3, tokens_per_s: float = 60.0) -> FastAPI:
+    stub = FastAPI(title="Ollama cassette stub")
+    loaded: Dict[str, float] = {}
+    stats = {"exact": 0, "model": 0, "path": 0, "synthetic": 0}
+
+    async def replay(lines: List[list]):
+        started = time.monotonic()
+        for offset, line in lines:
+            if speed > 0:
+                delay = offset / speed - (time.monotonic() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            yield line + "\n"
+
+    async def stream(path: str, request: Request):
+        payload = await request.json()
+        loaded[payload.get("model")] = time.time()
+        if not payload.get("stream", True):
+            # Model load / keep-alive ping from the app's warm-up loop
+            return JSONResponse({"model": payload.get("model"), "response": "", "done": True, "load_duration": 0})
+        entry, how = library.match(path, payload)
+        stats[how] += 1
+        lines = entry["lines"] if entry is not None else synthetic_lines(path, payload, ttft, tokens_per_s)
+        return StreamingResponse(replay(lines), media_type="application/x-ndjson")
+
+    @stub.post("/api/generate")
+    async def generate(request: Request):
+        return await stream("/api/generate", request)
+
+    @stub.post("/api/chat")
+    async def chat(request: Request):
+        return await stream("/api/chat", request)
+
+    @stub.get("/api/ps")
+    async def ps():
+        return {"models": [{"name": m, "model": m} for m in loaded]}
+
+    @stub.get("/api/tags")
+    async def tags():
+        return {"models": [{"name": m, "model": m} for m in loaded]}
+
+    @stub.get("/stub/stats")
+    async def stub_stats():
+        return {"recordings": library.size, "matches": stats}
+
+    return stub
+
+
+def main() -> None:
+    import uvicorn
+
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--cassette", action="append", default=[], help="cassette file (repeatable)")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=11435)
+    ap.add_argument("--speed", type=float, default=1.0, help="replay speed multiplier; 0 = no delays")
+    ap.add_argument("--ttft", type=float, default=0.3, help="first-token delay for synthetic answers")
+    ap.add_argument("--tokens-per-s", type=float, default=60.0, help="token rate for synthetic answers")
+    args = ap.parse_args()
+
+    library = CassetteLibrary()
+    for path in args.cassette:
+        print(f"loaded {library.load(Path(path))} recordings from {path}")
+    uvicorn.run(create_app(library, args.speed, args.ttft, args.tokens_per_s), host=args.host, port=args.port,
+                log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""Check the Ollama router against stub hosts: failover, circuit breaker and hedging.
+
+Starts two bench/ollama_stub.py instances under uvicorn in this process, a fast one and
+one with a slow first token, plus a port with nothing listening on it. It then drives
+ollama_client's stream path directly and checks that:
+
+  - requests fail over from the dead port to a live stub without the caller seeing an error,
+    hedged or not,
+  - the dead endpoint's breaker opens after OLLAMA_BREAKER_FAILURES failures, goes half-open
+    after the cooldown and re-opens when the trial request fails,
+  - a hedged request whose primary is the slow stub is answered by the fast one,
+  - every endpoint's outstanding count is back to zero afterwards, including after a caller
+    stops reading mid-stream.
+
+    python bench/router_failover.py
+    python bench/router_failover.py --requests 40 --slow-ttft 3
+"""
+import argparse
+import asyncio
+import logging
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import httpx  # noqa: E402
+
+import ollama_client  # noqa: E402
+from load_test import free_port, serve  # noqa: E402
+from ollama_stub import CassetteLibrary, create_app  # noqa: E402
+
+MODEL = "router-check"
+TIMEOUT = httpx.Timeout(30.0, connect=2.0)
+
+
+def payload(i: int) -> Dict[str, Any]:
+    return {"model": MODEL, "prompt": f"a lamp that turns on at night ({i})", "stream": True}
+
+
+async def collect(i: int, hedge: bool = False) -> float:
+    started = time.monotonic()
+    text = "".join([chunk async for chunk in ollama_client._ollama_stream(payload(i), TIMEOUT, hedge=hedge)])
+    if not text:
+        raise RuntimeError("empty answer")
+    return time.monotonic() - started
+
+
+def idle(router: ollama_client.Router) -> bool:
+    return all(ep.outstanding == 0 for ep in router.endpoints.values())
+
+
+async def check_failover(dead: str, live: str, requests: int, results: List[tuple]) -> None:
+    router = ollama_client.router
+    router.configure([dead, live])
+    errors = 0
+    for i in range(requests):
+        try:
+            await collect(i)
+        except Exception:
+            errors += 1
+    ep = router.endpoints[dead]
+    results.append(("failover: every request answered", errors == 0, f"{errors} errors in {requests}"))
+    results.append(("breaker: open after failures", ep.state() == "open",
+                    f"state={ep.state()} requests={ep.requests} limit={ollama_client.OLLAMA_BREAKER_FAILURES}"))
+    results.append(("breaker: no requests once open", ep.requests <= ollama_client.OLLAMA_BREAKER_FAILURES,
+                    f"dead endpoint saw {ep.requests}"))
+
+    cooldown = ollama_client.OLLAMA_BREAKER_COOLDOWN
+    ollama_client.OLLAMA_BREAKER_COOLDOWN = 0.2
+    try:
+        await asyncio.sleep(0.3)
+        half_open = ep.state()
+        before = ep.requests
+        # Trial requests keep going until one lands on the half-open host
+        for i in range(requests):
+            if ep.requests > before:
+                break
+            await collect(requests + i)
+        results.append(("breaker: half-open after cooldown", half_open == "half_open", f"state={half_open}"))
+        results.append(("breaker: re-open on failed trial", ep.requests == before + 1 and ep.state() == "open",
+                        f"trial requests={ep.requests - before} state={ep.state()}"))
+    finally:
+        ollama_client.OLLAMA_BREAKER_COOLDOWN = cooldown
+    results.append(("outstanding: zero after failover", idle(router), str(router.snapshot()["endpoints"])))
+
+
+async def check_hedged_failover(dead: str, live: str, requests: int, results: List[tuple]) -> None:
+    router = ollama_client.router
+    router.configure([dead, live])
+    for _ in range(ollama_client.OLLAMA_HEDGE_MIN_SAMPLES):
+        router.record_ttft(MODEL, 0.05)
+    errors = 0
+    for i in range(requests):
+        try:
+            await collect(i, hedge=True)
+        except Exception:
+            errors += 1
+    ep = router.endpoints[dead]
+    # A dead host fails before the hedge delay, so this is failover, not a hedge
+    results.append(("hedged failover: every request answered", errors == 0 and ep.requests > 0,
+                    f"{errors} errors in {requests}, dead endpoint saw {ep.requests}"))
+    results.append(("hedged failover: no hedges counted", router.hedges == 0, f"hedges={router.hedges}"))
+    results.append(("outstanding: zero after hedged failover", idle(router), str(router.snapshot()["endpoints"])))
+
+
+async def check_hedging(fast: str, slow: str, slow_ttft: float, requests: int, results: List[tuple]) -> None:
+    router = ollama_client.router
+    router.configure([fast, slow])
+    # Seed the TTFT window so hedge_delay() has a percentile to work with
+    for _ in range(ollama_client.OLLAMA_HEDGE_MIN_SAMPLES):
+        router.record_ttft(MODEL, 0.05)
+    latencies = [await collect(i, hedge=True) for i in range(requests)]
+    worst = max(latencies)
+    results.append(("hedge: backups launched", router.hedges > 0, f"hedges={router.hedges} of {requests}"))
+    results.append(("hedge: backups won", router.hedge_wins > 0, f"hedge_wins={router.hedge_wins}"))
+    results.append(("hedge: no request waited on the slow host", worst < slow_ttft,
+                    f"worst={worst:.3f}s slow ttft={slow_ttft}s"))
+    await asyncio.sleep(0.1)
+    results.append(("outstanding: zero after hedging", idle(router), str(router.snapshot()["endpoints"])))
+
+    gen = ollama_client._ollama_stream(payload(-1), TIMEOUT, hedge=True)
+    await gen.__anext__()
+    await gen.aclose()
+    results.append(("outstanding: zero after an early close", idle(router), str(router.snapshot()["endpoints"])))
+
+
+async def run(args: argparse.Namespace) -> List[tuple]:
+    library = CassetteLibrary()
+    fast_port, slow_port, dead_port = free_port(), free_port(), free_port()
+    fast_server, fast_task = await serve(create_app(library, 1.0, 0.02, 2000.0), fast_port)
+    slow_server, slow_task = await serve(create_app(library, 1.0, args.slow_ttft, 2000.0), slow_port)
+    fast, slow, dead = (f"http://127.0.0.1:{p}" for p in (fast_port, slow_port, dead_port))
+    results: List[tuple] = []
+    try:
+        await check_failover(dead, fast, args.requests, results)
+        await check_hedged_failover(dead, fast, args.requests, results)
+        await check_hedging(fast, slow, args.slow_ttft, args.requests, results)
+    finally:
+        await ollama_client.close_clients()
+        for server in (fast_server, slow_server):
+            server.should_exit = True
+        await asyncio.gather(fast_task, slow_task, return_exceptions=True)
+    return results
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--requests", type=int, default=20, help="requests per scenario")
+    ap.add_argument("--slow-ttft", type=float, default=2.0, help="first-token delay of the slow stub")
+    args = ap.parse_args()
+    # The slow stub keeps writing to hedged-away connections; asyncio logs each failed send
+    logging.getLogger("asyncio").setLevel(logging.ERROR)
+    results = asyncio.run(run(args))
+    width = max(len(name) for name, _, _ in results)
+    for name, ok, detail in results:
+        print(f"{'PASS' if ok else 'FAIL'}  {name:<{width}}  {detail}")
+    return 0 if all(ok for _, ok, _ in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
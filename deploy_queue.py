@@ -0,0 +1,377 @@
+"""Durable deploy job queue.
+
+Deploy work (writing mod files, pushing them to the server, scheduling a restart) is
+stored as jobs in SQLite and run by a small pool of workers. Jobs for the same mod run
+one at a time, in submission order; different mods deploy in parallel. A job that fails
+is retried with exponential backoff, and jobs that were running when the process died
+are picked up again on the next start. The handler must be safe to run twice for the
+same job, which write_mod's content-hash sync makes true for deploys.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List
+
+DEPLOY_JOBS_PATH = Path(os.environ.get("XYRUS_DEPLOY_JOBS_PATH", str(Path(__file__).resolve().parent / "deploy_jobs.sqlite3")))
+DEPLOY_WORKERS = int(os.environ.get("XYRUS_DEPLOY_WORKERS", "2"))
+DEPLOY_MAX_ATTEMPTS = int(os.environ.get("XYRUS_DEPLOY_MAX_ATTEMPTS", "3"))
+DEPLOY_RETRY_BASE_SECONDS = float(os.environ.get("XYRUS_DEPLOY_RETRY_BASE_SECONDS", "5"))
+
+ACTIVE_STATES = ("queued", "running")
+FINAL_STATES = ("succeeded", "failed", "cancelled")
+
+Emit = Callable[[str, Dict[str, Any]], None]
+Handler = Callable[["Job", Emit], Awaitable[Dict[str, Any]]]
+
+_COLUMNS = ("id", "kind", "mod_name", "state", "payload", "idem_key", "attempts", "max_attempts", "created_at",
+            "updated_at", "next_run_at", "started_at", "finished_at", "error", "result")
+
+
+class Job:
+    def __init__(self, row: Dict[str, Any]):
+        self.id: str = row["id"]
+        self.kind: str = row["kind"]
+        self.mod_name: str = row["mod_name"]
+        self.state: str = row["state"]
+        self.payload: Dict[str, Any] = json.loads(row["payload"]) if isinstance(row["payload"], str) else row["payload"]
+        self.idem_key: str = row["idem_key"]
+        self.attempts: int = row["attempts"]
+        self.max_attempts: int = row["max_attempts"]
+        self.created_at: float = row["created_at"]
+        self.updated_at: float = row["updated_at"]
+        self.next_run_at: float = row["next_run_at"]
+        self.started_at: float | None = row["started_at"]
+        self.finished_at: float | None = row["finished_at"]
+        self.error: str | None = row["error"]
+        result = row["result"]
+        self.result: Dict[str, Any] | None = json.loads(result) if isinstance(result, str) else result
+
+    @property
+    def done(self) -> bool:
+        return self.state in FINAL_STATES
+
+    def to_dict(self, payload: bool = False) -> Dict[str, Any]:
+        out = {
+            "id": self.id,
+            "kind": self.kind,
+            "mod_name": self.mod_name,
+            "state": self.state,
+            "attempts": self.attempts,
+            "max_attempts": self.max_attempts,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+            "next_run_at": self.next_run_at if self.state == "queued" else None,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "result": self.result,
+        }
+        if payload:
+            out["payload"] = self.payload
+        return out
+
+
+class JobStore:
+    """SQLite persistence for jobs; every call is short and synchronous (run it off the event loop)."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY, kind TEXT NOT NULL, mod_name TEXT NOT NULL, state TEXT NOT NULL,"
+                " payload TEXT NOT NULL, idem_key TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0,"
+                " max_attempts INTEGER NOT NULL, created_at REAL NOT NULL, updated_at REAL NOT NULL,"
+                " next_run_at REAL NOT NULL, started_at REAL, finished_at REAL, error TEXT, result TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, next_run_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_mod ON jobs (mod_name, created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_idem ON jobs (idem_key, state)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def insert_or_get_active(self, job: Dict[str, Any]) -> Job:
+        """Insert a job unless one with the same idempotency key is still queued or running."""
+        with self._lock:
+            db = self._db()
+            row = db.execute(
+                "SELECT * FROM jobs WHERE idem_key = ? AND state IN ('queued', 'running') ORDER BY created_at LIMIT 1",
+                (job["idem_key"],),
+            ).fetchone()
+            if row is not None:
+                return Job(dict(row))
+            db.execute(f"INSERT INTO jobs ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' for _ in _COLUMNS)})",
+                       [job[c] for c in _COLUMNS])
+            db.commit()
+            return Job(job)
+
+    def update(self, job_id: str, **fields: Any) -> None:
+        fields["updated_at"] = time.time()
+        if "result" in fields and not isinstance(fields["result"], (str, type(None))):
+            fields["result"] = json.dumps(fields["result"])
+        with self._lock:
+            db = self._db()
+            db.execute(f"UPDATE jobs SET {', '.join(f'{k} = ?' for k in fields)} WHERE id = ?",
+                       [*fields.values(), job_id])
+            db.commit()
+
+    def get(self, job_id: str) -> Job | None:
+        with self._lock:
+            row = self._db().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return Job(dict(row)) if row else None
+
+    def list(self, state: str | None = None, mod_name: str | None = None, limit: int = 50) -> List[Job]:
+        query, args = "SELECT * FROM jobs", []
+        where = []
+        if state:
+            where.append("state = ?")
+            args.append(state)
+        if mod_name:
+            where.append("mod_name = ?")
+            args.append(mod_name)
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        args.append(limit)
+        with self._lock:
+            rows = self._db().execute(query, args).fetchall()
+        return [Job(dict(r)) for r in rows]
+
+    def next_runnable(self, now: float, busy_mods: set[str]) -> Job | None:
+        """Oldest queued job that is due and whose mod has no earlier job still pending."""
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT * FROM jobs WHERE state = 'queued' ORDER BY created_at"
+            ).fetchall()
+        blocked = set(busy_mods)
+        for row in rows:
+            mod = row["mod_name"]
+            if mod in blocked:
+                continue
+            # Per-mod FIFO: a later job never overtakes an earlier one that is backing off
+            blocked.add(mod)
+            if row["next_run_at"] <= now:
+                return Job(dict(row))
+        return None
+
+    def next_due_at(self) -> float | None:
+        with self._lock:
+            row = self._db().execute("SELECT MIN(next_run_at) FROM jobs WHERE state = 'queued'").fetchone()
+        return row[0] if row else None
+
+    def requeue_running(self) -> int:
+        """Jobs left running by a previous process go back to the queue."""
+        with self._lock:
+            db = self._db()
+            cur = db.execute("UPDATE jobs SET state = 'queued', updated_at = ? WHERE state = 'running'", (time.time(),))
+            db.commit()
+            return cur.rowcount
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._db().execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+        return {r[0]: r[1] for r in rows}
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class DeployQueue:
+    def __init__(self, path: Path = DEPLOY_JOBS_PATH, workers: int = DEPLOY_WORKERS,
+                 max_attempts: int = DEPLOY_MAX_ATTEMPTS, retry_base: float = DEPLOY_RETRY_BASE_SECONDS):
+        self.store = JobStore(path)
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.handler: Handler | None = None
+        self._tasks: List[asyncio.Task] = []
+        self._running: Dict[str, asyncio.Task] = {}
+        self._busy_mods: set[str] = set()
+        self._cancel_requested: set[str] = set()
+        self._listeners: Dict[str, List[Emit]] = {}
+        self._changed: Dict[str, asyncio.Event] = {}
+        self._wake = asyncio.Event()
+        self._claim = asyncio.Lock()
+
+    def set_handler(self, handler: Handler) -> None:
+        self.handler = handler
+
+    async def start(self) -> None:
+        if self._tasks:
+            return
+        requeued = await asyncio.to_thread(self.store.requeue_running)
+        if requeued:
+            self._wake.set()
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        self.store.close()
+
+    async def submit(self, kind: str, mod_name: str, payload: Dict[str, Any], idem_key: str | None = None,
+                     listener: Emit | None = None) -> Job:
+        """Queue a job, or return the queued/running job with the same idempotency key."""
+        now = time.time()
+        if idem_key is None:
+            raw = json.dumps([kind, mod_name, payload], sort_keys=True, ensure_ascii=False)
+            idem_key = hashlib.sha256(raw.encode("utf-8")).hexdigest()
+        row = {
+            "id": uuid.uuid4().hex[:12], "kind": kind, "mod_name": mod_name, "state": "queued",
+            "payload": json.dumps(payload, ensure_ascii=False), "idem_key": idem_key, "attempts": 0,
+            "max_attempts": self.max_attempts, "created_at": now, "updated_at": now, "next_run_at": now,
+            "started_at": None, "finished_at": None, "error": None, "result": None,
+        }
+        job = await asyncio.to_thread(self.store.insert_or_get_active, row)
+        if listener is not None:
+            self._listeners.setdefault(job.id, []).append(listener)
+        self._wake.set()
+        return job
+
+    async def get(self, job_id: str) -> Job | None:
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    async def list(self, state: str | None = None, mod_name: str | None = None, limit: int = 50) -> List[Job]:
+        return await asyncio.to_thread(self.store.list, state, mod_name, limit)
+
+    async def wait(self, job_id: str, timeout: float) -> Job | None:
+        """Wait until the job reaches a final state or the timeout runs out; returns its latest state."""
+        deadline = time.monotonic() + timeout
+        while True:
+            event = self._changed.setdefault(job_id, asyncio.Event())
+            job = await self.get(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job.done or remaining <= 0:
+                return job
+            try:
+                await asyncio.wait_for(event.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    async def cancel(self, job_id: str) -> Job | None:
+        job = await self.get(job_id)
+        if job is None or job.done:
+            return job
+        task = self._running.get(job_id)
+        if task is not None:
+            # The running handler is cancelled; its deploy subprocesses are killed with it
+            self._cancel_requested.add(job_id)
+            task.cancel()
+            await asyncio.wait([task])
+        else:
+            await asyncio.to_thread(self.store.update, job_id, state="cancelled", finished_at=time.time(),
+                                    error="cancelled before it ran")
+            self._notify(job_id)
+        return await self.get(job_id)
+
+    async def status(self) -> Dict[str, Any]:
+        counts = await asyncio.to_thread(self.store.counts)
+        return {
+            "workers": self.workers,
+            "running": sorted(self._running),
+            "busy_mods": sorted(self._busy_mods),
+            "counts": counts,
+        }
+
+    def _notify(self, job_id: str) -> None:
+        event = self._changed.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    def _emit(self, job_id: str) -> Emit:
+        def emit(event: str, data: Dict[str, Any]) -> None:
+            for listener in list(self._listeners.get(job_id, ())):
+                try:
+                    listener(event, data)
+                except Exception:
+                    pass
+        return emit
+
+    async def _next_job(self) -> Job:
+        while True:
+            # Cleared before looking, so a submit() during the store queries below is not lost
+            self._wake.clear()
+            async with self._claim:
+                job = await asyncio.to_thread(self.store.next_runnable, time.time(), self._busy_mods)
+                if job is not None:
+                    self._busy_mods.add(job.mod_name)
+                    job.attempts += 1
+                    job.state = "running"
+                    job.started_at = time.time()
+                    await asyncio.to_thread(self.store.update, job.id, state="running", attempts=job.attempts,
+                                            started_at=job.started_at, error=None)
+                    # Another job may be waiting; let an idle worker look too
+                    self._wake.set()
+                    return job
+                due = await asyncio.to_thread(self.store.next_due_at)
+            timeout = 5.0 if due is None else max(0.05, min(5.0, due - time.time()))
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            job = await self._next_job()
+            task = asyncio.create_task(self.handler(job, self._emit(job.id)))
+            self._running[job.id] = task
+            try:
+                result = await task
+            except asyncio.CancelledError:
+                if job.id in self._cancel_requested:
+                    await asyncio.to_thread(self.store.update, job.id, state="cancelled", finished_at=time.time(),
+                                            error="cancelled while running")
+                else:
+                    # Shutting down: leave the job for the next process to pick up
+                    await asyncio.to_thread(self.store.update, job.id, state="queued")
+                    raise
+            except Exception as e:
+                error = str(e) or type(e).__name__
+                if job.attempts < job.max_attempts:
+                    delay = self.retry_base * (2 ** (job.attempts - 1))
+                    await asyncio.to_thread(self.store.update, job.id, state="queued", error=error,
+                                            next_run_at=time.time() + delay)
+                    self._emit(job.id)("retry", {"job": job.id, "attempt": job.attempts, "error": error,
+                                                 "retry_in_s": delay})
+                else:
+                    await asyncio.to_thread(self.store.update, job.id, state="failed", error=error,
+                                            finished_at=time.time())
+            else:
+                await asyncio.to_thread(self.store.update, job.id, state="succeeded", result=result,
+                                        finished_at=time.time())
+            finally:
+                self._running.pop(job.id, None)
+                self._busy_mods.discard(job.mod_name)
+                self._cancel_requested.discard(job.id)
+                self._wake.set()
+            final = await self.get(job.id)
+            if final is not None and final.done:
+                self._listeners.pop(job.id, None)
+            self._notify(job.id)
+
+
+deploy_queue = DeployQueue()
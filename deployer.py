@@ -1,64 +1,658 @@
+import asyncio
+import hashlib
+import itertools
+import json
 import os
-import subprocess
+import signal
+import time
+from collections import OrderedDict, deque
 from pathlib import Path
-from typing import Optional
+from typing import Any, Awaitable, Callable
 
 REPO_ROOT = Path(__file__).resolve().parents[1]
 TOOLS_DIR = REPO_ROOT / "tools"
 LOCAL_MODS_DIR = REPO_ROOT / "mods"
+SERVER_MODS_DIR = Path("/var/games/minetest-server/.minetest/mods")
 
 LOAD_SCRIPT = TOOLS_DIR / "load_mod.sh"
 UNLOAD_SCRIPT = TOOLS_DIR / "unload_mod.sh"
 
+# Deploys landing within this many seconds of each other share one server restart;
+# a steady stream of deploys still restarts at most RESTART_MAX_DELAY after the first
+RESTART_QUIET_SECONDS = float(os.environ.get("XYRUS_RESTART_QUIET_SECONDS", "10"))
+RESTART_MAX_DELAY = float(os.environ.get("XYRUS_RESTART_MAX_DELAY", "60"))
 
-def write_mod(mod_name: str, files: dict[str, str]) -> Path:
+# minetest-server unit state is polled once per interval by ServerWatcher, however many
+# dashboards are open
+SERVER_UNIT = os.environ.get("XYRUS_SERVER_UNIT", "minetest-server")
+SERVER_POLL_SECONDS = float(os.environ.get("XYRUS_SERVER_POLL_SECONDS", "5"))
+
+# Per-step subprocess timeouts (seconds); the whole process group is killed when one runs out
+STEP_TIMEOUTS = {
+    "load": float(os.environ.get("XYRUS_LOAD_TIMEOUT", "180")),
+    "unload": float(os.environ.get("XYRUS_UNLOAD_TIMEOUT", "60")),
+    "restart": float(os.environ.get("XYRUS_RESTART_TIMEOUT", "90")),
+    "sync": float(os.environ.get("XYRUS_SYNC_TIMEOUT", "30")),
+}
+
+
+class ModChanges:
+    """What write_mod actually changed on disk."""
+
+    def __init__(self, mod_name: str, mod_dir: Path, first_write: bool):
+        self.mod_name = mod_name
+        self.mod_dir = mod_dir
+        self.first_write = first_write
+        self.added: list[str] = []
+        self.modified: list[str] = []
+        self.removed: list[str] = []
+        self.unchanged: list[str] = []
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.added or self.modified or self.removed)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "changed": self.changed,
+            "first_write": self.first_write,
+            "added": self.added,
+            "modified": self.modified,
+            "removed": self.removed,
+            "unchanged": len(self.unchanged),
+        }
+
+
+def _content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _manifest_path(mod_name: str) -> Path:
+    # Kept outside the mod directory so it never gets copied to the server
+    return LOCAL_MODS_DIR / ".manifests" / f"{mod_name}.json"
+
+
+def _atomic_write(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def write_mod(mod_name: str, files: dict[str, str]) -> ModChanges:
+    """Sync a mod directory to `files`, touching only what changed.
+
+    A manifest of content hashes per mod records what was written last time. Files
+    whose hash matches are left alone, changed ones are replaced atomically, and files
+    from the previous manifest that are no longer in `files` are deleted (files never
+    written through here, like hand-added textures, are kept).
+    """
     mod_dir = LOCAL_MODS_DIR / mod_name
+    manifest_path = _manifest_path(mod_name)
+    try:
+        previous: dict[str, str] = json.loads(manifest_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        previous = {}
+    changes = ModChanges(mod_name, mod_dir, first_write=not mod_dir.exists())
     mod_dir.mkdir(parents=True, exist_ok=True)
+
+    manifest: dict[str, str] = {}
     for rel_path, content in files.items():
         target_path = mod_dir / rel_path
-        target_path.parent.mkdir(parents=True, exist_ok=True)
-        target_path.write_text(content, encoding="utf-8")
-    return mod_dir
-
-
-def load_mod(mod_path_or_name: str, non_interactive: bool = True) -> str:
-    cmd = ["sudo", str(LOAD_SCRIPT), mod_path_or_name]
-    if non_interactive:
-        env = os.environ.copy()
-        env["NONINTERACTIVE"] = "1"
-        env["AUTO_RESTART"] = "1"
-        proc = subprocess.run(cmd, capture_output=True, text=True, env=env)
-    else:
-        proc = subprocess.run(cmd, capture_output=True, text=True)
-    if proc.returncode != 0:
-        raise RuntimeError(f"load_mod failed: {proc.stderr}\n{proc.stdout}")
-    return proc.stdout
-
-
-def unload_mod(mod_name: str, non_interactive: bool = True) -> str:
-    cmd = ["sudo", str(UNLOAD_SCRIPT), mod_name]
-    if non_interactive:
-        proc = subprocess.run(["bash", "-lc", f"yes | {' '.join(cmd)}"], capture_output=True, text=True)
-    else:
-        proc = subprocess.run(cmd, capture_output=True, text=True)
-    if proc.returncode != 0:
-        raise RuntimeError(f"unload_mod failed: {proc.stderr}\n{proc.stdout}")
-    return proc.stdout
-
-
-def restart_server() -> str:
-    """Restart the minetest server using systemd. Requires sudo without password."""
-    cmd = ["sudo", "-n", "systemctl", "restart", "minetest-server"]
-    proc = subprocess.run(cmd, capture_output=True, text=True)
-    if proc.returncode != 0:
-        # Try without -n in case NOPASSWD not set; it will likely fail silently in web context
-        fallback = subprocess.run(["sudo", "systemctl", "restart", "minetest-server"], capture_output=True, text=True)
-        out = f"restart attempt failed: {proc.stderr}\n{proc.stdout}\nfallback: {fallback.stderr}\n{fallback.stdout}"
-        raise RuntimeError(out)
-    return proc.stdout or "server restart requested"
-
-
-def server_is_active() -> bool:
-    cmd = ["systemctl", "is-active", "minetest-server"]
-    proc = subprocess.run(cmd, capture_output=True, text=True)
-    return proc.returncode == 0 and proc.stdout.strip() == "active"
+        data = content.encode("utf-8")
+        digest = _content_hash(data)
+        manifest[rel_path] = digest
+        existed = target_path.is_file()
+        known = previous.get(rel_path)
+        if known is None and existed:
+            # No manifest entry yet (older deploy): compare against what is on disk
+            known = _content_hash(target_path.read_bytes())
+        if known == digest and existed:
+            changes.unchanged.append(rel_path)
+            continue
+        _atomic_write(target_path, data)
+        (changes.modified if existed else changes.added).append(rel_path)
+
+    for rel_path in previous:
+        if rel_path in manifest:
+            continue
+        target_path = mod_dir / rel_path
+        try:
+            target_path.unlink()
+        except FileNotFoundError:
+            continue
+        changes.removed.append(rel_path)
+        parent = target_path.parent
+        while parent != mod_dir and parent.is_dir() and not any(parent.iterdir()):
+            parent.rmdir()
+            parent = parent.parent
+
+    if manifest != previous:
+        _atomic_write(manifest_path, json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8"))
+    return changes
+
+
+class ServerWatcher:
+    """Keeps the minetest-server unit state in memory.
+
+    One background loop asks systemd for the unit's properties every
+    SERVER_POLL_SECONDS; every reader gets the cached snapshot. Transitions are
+    timestamped; a restart is counted whenever the unit comes back to active or its
+    main PID changes while it stays active. systemd's own NRestarts is reported too.
+    """
+
+    PROPERTIES = ("ActiveState", "SubState", "MainPID", "NRestarts", "ActiveEnterTimestamp")
+
+    def __init__(self, unit: str = SERVER_UNIT, interval: float = SERVER_POLL_SECONDS):
+        self.unit = unit
+        self.interval = interval
+        self.active_state = "unknown"
+        self.sub_state = "unknown"
+        self.main_pid = 0
+        self.since: float | None = None
+        self.checked_at: float | None = None
+        self.active_since: str | None = None
+        self.transitions = 0
+        self.restarts = 0
+        self.systemd_restarts: int | None = None
+        self.polls = 0
+        self.error: str | None = None
+        self._task: asyncio.Task | None = None
+        self._poke: asyncio.Event | None = None
+
+    @property
+    def running(self) -> bool:
+        return self.active_state == "active"
+
+    def fresh(self) -> bool:
+        return self.checked_at is not None and time.time() - self.checked_at < self.interval * 3
+
+    async def _query(self) -> dict[str, str]:
+        proc = await asyncio.create_subprocess_exec(
+            "systemctl", "show", self.unit, "--property=" + ",".join(self.PROPERTIES),
+            stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+        )
+        try:
+            out, err = await asyncio.wait_for(proc.communicate(), 5.0)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            raise RuntimeError("systemctl show timed out")
+        if proc.returncode != 0:
+            raise RuntimeError(err.decode("utf-8", "replace").strip() or f"systemctl exit {proc.returncode}")
+        props: dict[str, str] = {}
+        for line in out.decode("utf-8", "replace").splitlines():
+            key, sep, value = line.partition("=")
+            if sep:
+                props[key] = value
+        return props
+
+    async def refresh(self) -> None:
+        self.polls += 1
+        try:
+            props = await self._query()
+        except (OSError, RuntimeError) as e:
+            self.error = str(e)
+            props = {"ActiveState": "unknown", "SubState": "unknown", "MainPID": "0"}
+        else:
+            self.error = None
+        now = time.time()
+        state = props.get("ActiveState", "unknown")
+        pid = int(props.get("MainPID") or 0)
+        nrestarts = props.get("NRestarts")
+        first = self.checked_at is None
+        if state != self.active_state:
+            if not first:
+                self.transitions += 1
+                if state == "active":
+                    self.restarts += 1
+            self.since = now
+        elif state == "active" and pid and self.main_pid and pid != self.main_pid:
+            # Restarted between two polls without us seeing it go down
+            self.restarts += 1
+            self.transitions += 2
+            self.since = now
+        if nrestarts is not None and nrestarts.isdigit():
+            # systemd's own count of automatic restarts (Restart=on-failure) since the unit was loaded
+            self.systemd_restarts = int(nrestarts)
+        self.active_state = state
+        self.sub_state = props.get("SubState", "unknown")
+        self.main_pid = pid
+        self.active_since = props.get("ActiveEnterTimestamp") or None
+        self.checked_at = now
+
+    def poke(self) -> None:
+        """Re-check right away (after a restart was issued) instead of waiting for the next poll."""
+        if self._poke is not None:
+            self._poke.set()
+
+    async def _run(self) -> None:
+        while True:
+            await self.refresh()
+            self._poke = asyncio.Event()
+            try:
+                await asyncio.wait_for(self._poke.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def start(self) -> None:
+        if self._task is None:
+            await self.refresh()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "unit": self.unit,
+            "running": self.running,
+            "active_state": self.active_state,
+            "sub_state": self.sub_state,
+            "main_pid": self.main_pid,
+            "state_since": self.since,
+            "active_enter_timestamp": self.active_since,
+            "checked_at": self.checked_at,
+            "transitions": self.transitions,
+            "restarts": self.restarts,
+            "systemd_restarts": self.systemd_restarts,
+            "polls": self.polls,
+            "poll_interval_s": self.interval,
+            "error": self.error,
+        }
+
+
+server_watcher = ServerWatcher()
+
+
+LineCallback = Callable[[dict[str, Any]], None]
+
+
+class DeployLog:
+    """Recent deploy subprocess output, one entry per line, with sequence numbers.
+
+    Every async deploy step publishes here, so pages can follow deploys that other
+    requests (or the restart scheduler) started: since(seq) returns what is new and
+    wait(seq) blocks until something is.
+    """
+
+    def __init__(self, size: int = 2000):
+        self.lines: deque[dict[str, Any]] = deque(maxlen=size)
+        self.seq = 0
+        self._wake: asyncio.Event | None = None
+
+    def publish(self, entry: dict[str, Any]) -> dict[str, Any]:
+        self.seq += 1
+        entry = {"seq": self.seq, "ts": time.time(), **entry}
+        self.lines.append(entry)
+        if self._wake is not None:
+            self._wake.set()
+            self._wake = None
+        return entry
+
+    def since(self, seq: int = 0, limit: int = 500) -> list[dict[str, Any]]:
+        new = [e for e in self.lines if e["seq"] > seq]
+        return new[-limit:]
+
+    async def wait(self, seq: int, timeout: float) -> list[dict[str, Any]]:
+        if self.seq <= seq:
+            if self._wake is None:
+                self._wake = asyncio.Event()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.since(seq)
+
+
+deploy_output = DeployLog()
+
+
+class StepResult:
+    """Outcome of one deploy subprocess."""
+
+    def __init__(self, step: str, cmd: list[str]):
+        self.step = step
+        self.cmd = cmd
+        self.returncode: int | None = None
+        self.started_at = time.time()
+        self.duration_s = 0.0
+        self.timed_out = False
+        self.lines: list[str] = []
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0 and not self.timed_out
+
+    @property
+    def output(self) -> str:
+        return "".join(line + "\n" for line in self.lines)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "step": self.step,
+            "cmd": self.cmd,
+            "returncode": self.returncode,
+            "started_at": self.started_at,
+            "duration_s": round(self.duration_s, 3),
+            "timed_out": self.timed_out,
+        }
+
+
+class DeployStepError(RuntimeError):
+    def __init__(self, message: str, result: StepResult):
+        super().__init__(message)
+        self.result = result
+
+
+def _kill_group(proc: asyncio.subprocess.Process, sig: int) -> None:
+    try:
+        os.killpg(proc.pid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+async def run_step(step: str, cmd: list[str], timeout: float, mod_name: str | None = None,
+                   env: dict[str, str] | None = None, stdin_data: bytes | None = None,
+                   on_line: LineCallback | None = None) -> StepResult:
+    """Run one deploy command, streaming its stdout/stderr lines as they arrive.
+
+    The command gets its own process group; on timeout or cancellation the whole
+    group gets SIGTERM, then SIGKILL after a grace period, so helper processes the
+    scripts spawn die with them. Non-zero exits are returned, not raised.
+    """
+    result = StepResult(step, cmd)
+    started = time.monotonic()
+
+    def emit(stream: str, text: str) -> None:
+        result.lines.append(text if stream == "stdout" else f"[{stream}] {text}")
+        entry = deploy_output.publish({"step": step, "mod": mod_name, "stream": stream, "line": text})
+        if on_line is not None:
+            try:
+                on_line(entry)
+            except Exception:
+                pass
+
+    emit("meta", f"$ {' '.join(cmd)}")
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.PIPE if stdin_data is not None else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env=env,
+            start_new_session=True,
+        )
+    except OSError as e:
+        result.returncode = 127
+        result.duration_s = time.monotonic() - started
+        emit("stderr", str(e))
+        return result
+
+    async def pump(reader: asyncio.StreamReader, stream: str) -> None:
+        while True:
+            raw = await reader.readline()
+            if not raw:
+                return
+            emit(stream, raw.decode("utf-8", "replace").rstrip("\r\n"))
+
+    async def feed() -> None:
+        if stdin_data is None or proc.stdin is None:
+            return
+        try:
+            proc.stdin.write(stdin_data)
+            await proc.stdin.drain()
+            proc.stdin.close()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    async def communicate() -> None:
+        await asyncio.gather(pump(proc.stdout, "stdout"), pump(proc.stderr, "stderr"), feed())
+        await proc.wait()
+
+    try:
+        await asyncio.wait_for(communicate(), timeout)
+    except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+        result.timed_out = isinstance(e, asyncio.TimeoutError)
+        _kill_group(proc, signal.SIGTERM)
+        try:
+            await asyncio.wait_for(proc.wait(), 5.0)
+        except asyncio.TimeoutError:
+            _kill_group(proc, signal.SIGKILL)
+            await proc.wait()
+        if isinstance(e, asyncio.CancelledError):
+            raise
+        emit("meta", f"timed out after {timeout:.0f}s; process group killed")
+    finally:
+        result.returncode = proc.returncode
+        result.duration_s = time.monotonic() - started
+    emit("meta", f"exit {result.returncode} in {result.duration_s:.2f}s")
+    return result
+
+
+def _step_error(name: str, result: StepResult) -> DeployStepError:
+    reason = "timed out" if result.timed_out else f"exit {result.returncode}"
+    return DeployStepError(f"{name} failed ({reason}):\n{result.output}", result)
+
+
+async def load_mod_async(mod_path_or_name: str, on_line: LineCallback | None = None) -> StepResult:
+    env = os.environ.copy()
+    env["NONINTERACTIVE"] = "1"
+    # The caller restarts through restart_scheduler, which coalesces restarts across deploys
+    env["AUTO_RESTART"] = "0"
+    result = await run_step("load", ["sudo", str(LOAD_SCRIPT), mod_path_or_name], STEP_TIMEOUTS["load"],
+                            mod_name=Path(mod_path_or_name).name, env=env, on_line=on_line)
+    if not result.ok:
+        raise _step_error("load_mod", result)
+    return result
+
+
+async def unload_mod_async(mod_name: str, on_line: LineCallback | None = None) -> StepResult:
+    # Answer the script's confirmation prompts on stdin instead of piping `yes` through a shell
+    env = os.environ.copy()
+    env["NONINTERACTIVE"] = "1"
+    result = await run_step("unload", ["sudo", str(UNLOAD_SCRIPT), mod_name], STEP_TIMEOUTS["unload"],
+                            mod_name=mod_name, env=env, stdin_data=b"y\n" * 64, on_line=on_line)
+    if not result.ok:
+        raise _step_error("unload_mod", result)
+    return result
+
+
+async def restart_server_async(on_line: LineCallback | None = None) -> StepResult:
+    result = await run_step("restart", ["sudo", "-n", "systemctl", "restart", SERVER_UNIT],
+                            STEP_TIMEOUTS["restart"], on_line=on_line)
+    if not result.ok:
+        raise _step_error("restart", result)
+    if not result.lines[1:-1]:
+        result.lines.append("server restart requested")
+    return result
+
+
+async def sync_mod_async(changes: ModChanges, on_line: LineCallback | None = None,
+                         force: bool = False) -> StepResult | None:
+    """Push a write_mod change set to the server; None when nothing changed, else the
+    result of the last step run.
+
+    A mod already on the server gets only its changed files copied and dropped ones
+    removed. Otherwise (new mod, or the partial copy failed) the full load script runs.
+    force=True pushes the whole mod even if write_mod found nothing new, for retrying a
+    deploy whose files were written by an attempt that failed before reaching the server.
+    """
+    if not changes.changed and not force:
+        deploy_output.publish({"step": "sync", "mod": changes.mod_name, "stream": "meta",
+                            "line": "no file changes, deploy skipped"})
+        return None
+    server_dir = SERVER_MODS_DIR / changes.mod_name
+    if force or changes.first_write or not server_dir.is_dir():
+        return await load_mod_async(str(changes.mod_dir.resolve()), on_line=on_line)
+    result: StepResult | None = None
+    for rel_path in changes.added + changes.modified:
+        cmd = ["sudo", "-n", "install", "-D", "-m", "0644", str(changes.mod_dir / rel_path), str(server_dir / rel_path)]
+        result = await run_step("sync", cmd, STEP_TIMEOUTS["sync"], mod_name=changes.mod_name, on_line=on_line)
+        if not result.ok:
+            return await load_mod_async(str(changes.mod_dir.resolve()), on_line=on_line)
+    for rel_path in changes.removed:
+        result = await run_step("sync", ["sudo", "-n", "rm", "-f", str(server_dir / rel_path)], STEP_TIMEOUTS["sync"],
+                                mod_name=changes.mod_name, on_line=on_line)
+    return result
+
+
+class RestartTicket:
+    """One scheduled server restart, shared by every deploy that joined it."""
+
+    def __init__(self, ticket_id: str, deadline: float):
+        self.id = ticket_id
+        self.state = "pending"  # pending -> restarting -> done | failed
+        self.reasons: list[str] = []
+        self.requested_at = time.time()
+        self.first_request = time.monotonic()
+        self.deadline = deadline
+        self.started_at: float | None = None
+        self.finished_at: float | None = None
+        self.message: str | None = None
+        self.error: str | None = None
+        self._done = asyncio.Event()
+        self._callbacks: list[Callable[["RestartTicket"], None]] = []
+
+    @property
+    def done(self) -> bool:
+        return self.state in ("done", "failed")
+
+    def add_done_callback(self, fn: Callable[["RestartTicket"], None]) -> None:
+        if self.done:
+            fn(self)
+        else:
+            self._callbacks.append(fn)
+
+    async def wait(self, timeout: float | None = None) -> bool:
+        """Wait for the restart to finish; returns False if the timeout ran out first."""
+        try:
+            await asyncio.wait_for(self._done.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def _finish(self, state: str, message: str | None = None, error: str | None = None) -> None:
+        self.state = state
+        self.message = message
+        self.error = error
+        self.finished_at = time.time()
+        self._done.set()
+        for fn in self._callbacks:
+            try:
+                fn(self)
+            except Exception:
+                pass
+        self._callbacks.clear()
+
+    def to_dict(self) -> dict[str, Any]:
+        eta = None
+        if self.state == "pending":
+            eta = round(max(0.0, self.deadline - time.monotonic()), 1)
+        return {
+            "ticket": self.id,
+            "state": self.state,
+            "reasons": list(self.reasons),
+            "requested_at": self.requested_at,
+            "restart_in_s": eta,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "message": self.message,
+            "error": self.error,
+        }
+
+
+class RestartScheduler:
+    """Debounces restart requests so a burst of deploys costs one server restart.
+
+    request() returns immediately with the pending ticket, creating one if needed.
+    Every request pushes the restart back to RESTART_QUIET_SECONDS after the latest
+    deploy, but never past RESTART_MAX_DELAY after the first. A request that arrives
+    while a restart is running starts a new ticket, because the running restart may
+    have missed its files; its restart waits for the running one to finish.
+    """
+
+    def __init__(self, quiet: float = RESTART_QUIET_SECONDS, max_delay: float = RESTART_MAX_DELAY,
+                 restart_fn: Callable[[], Awaitable[str]] | None = None, history: int = 50):
+        self.quiet = quiet
+        self.max_delay = max_delay
+        self.restart_fn = restart_fn
+        self.pending: RestartTicket | None = None
+        self.tickets: "OrderedDict[str, RestartTicket]" = OrderedDict()
+        self.history = history
+        self.restarts = 0
+        self.requests = 0
+        self._ids = itertools.count(1)
+        self._wake: asyncio.Event | None = None
+        self._tasks: set[asyncio.Task] = set()
+        self._restarting = asyncio.Lock()
+
+    def request(self, reason: str, immediate: bool = False) -> RestartTicket:
+        self.requests += 1
+        now = time.monotonic()
+        ticket = self.pending
+        if ticket is None:
+            ticket = RestartTicket(f"r{int(time.time())}-{next(self._ids)}", now + self.quiet)
+            self.pending = ticket
+            self.tickets[ticket.id] = ticket
+            while len(self.tickets) > self.history:
+                self.tickets.popitem(last=False)
+            task = asyncio.get_running_loop().create_task(self._run(ticket))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        ticket.reasons.append(reason)
+        ticket.deadline = min(now + (0.0 if immediate else self.quiet), ticket.first_request + self.max_delay)
+        if self._wake is not None:
+            self._wake.set()
+        return ticket
+
+    def get(self, ticket_id: str) -> RestartTicket | None:
+        return self.tickets.get(ticket_id)
+
+    async def _run(self, ticket: RestartTicket) -> None:
+        while True:
+            remaining = ticket.deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self._wake = asyncio.Event()
+            try:
+                await asyncio.wait_for(self._wake.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+        # Two systemctl restarts must never overlap. The ticket stays pending while it waits,
+        # so requests arriving during the running restart are still covered by this one.
+        async with self._restarting:
+            if self.pending is ticket:
+                self.pending = None
+            ticket.state = "restarting"
+            ticket.started_at = time.time()
+            try:
+                if self.restart_fn is not None:
+                    message = await self.restart_fn()
+                else:
+                    message = (await restart_server_async()).output
+            except Exception as e:
+                ticket._finish("failed", error=str(e))
+            else:
+                ticket._finish("done", message=message)
+            self.restarts += 1
+        server_watcher.poke()
+
+    def status(self) -> dict[str, Any]:
+        return {
+            "quiet_s": self.quiet,
+            "max_delay_s": self.max_delay,
+            "requests": self.requests,
+            "restarts": self.restarts,
+            "pending": self.pending.to_dict() if self.pending else None,
+            "recent": [t.to_dict() for t in reversed(self.tickets.values())][:10],
+        }
+
+
+restart_scheduler = RestartScheduler()
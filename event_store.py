@@ -0,0 +1,70 @@
+"""Bounded in-memory store for the agent's activity events.
+
+Events go into a fixed-size ring buffer and get a monotonic sequence number, so readers
+can ask for everything after the last `seq` they saw (and long-poll for more) instead
+of re-reading the whole list. Numbering starts over with every process, so events also
+carry the store's `epoch` and cursors are `<epoch>:<seq>`. The latest event of each action is indexed, which makes
+questions like "last error" and "last restart" O(1).
+"""
+import asyncio
+import secrets
+import time
+from typing import Any, Dict, List, Optional
+
+
+class EventStore:
+    def __init__(self, capacity: int = 200):
+        self.capacity = capacity
+        self.seq = 0
+        self.epoch = secrets.token_hex(4)
+        self._ring: List[Optional[Dict[str, Any]]] = [None] * capacity
+        self._last_by_action: Dict[str, Dict[str, Any]] = {}
+        self._changed = asyncio.Event()
+
+    def __len__(self) -> int:
+        return min(self.seq, self.capacity)
+
+    def append(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        """Store an event, stamping it in place with `seq` and `ts`."""
+        self.seq += 1
+        event["seq"] = self.seq
+        event["epoch"] = self.epoch
+        event.setdefault("ts", time.time())
+        self._ring[self.seq % self.capacity] = event
+        self._last_by_action[event.get("action", "")] = event
+        self._changed.set()
+        self._changed = asyncio.Event()
+        return event
+
+    def resolve(self, cursor: str) -> Optional[int]:
+        """The seq of an `<epoch>:<seq>` cursor, or None when this store did not issue it
+        (a cursor from before a restart, or a bare seq)."""
+        epoch, _, seq = cursor.rpartition(":")
+        if epoch != self.epoch or not seq.isdigit() or int(seq) > self.seq:
+            return None
+        return int(seq)
+
+    def since(self, seq: int = 0, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Events after `seq` still in the buffer, oldest first; with `limit`, only the newest ones."""
+        start = max(seq + 1, self.seq - len(self) + 1)
+        if limit is not None:
+            start = max(start, self.seq - limit + 1)
+        return [self._ring[i % self.capacity] for i in range(start, self.seq + 1)]
+
+    def recent(self, n: int) -> List[Dict[str, Any]]:
+        return self.since(0, n)
+
+    def last(self, action: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Most recent event overall, or of one action (even if it has left the buffer)."""
+        if action is not None:
+            return self._last_by_action.get(action)
+        return self._ring[self.seq % self.capacity] if self.seq else None
+
+    async def wait(self, seq: int, timeout: float, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Like since(), but waits up to `timeout` seconds for something newer than `seq`."""
+        if self.seq == seq:
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.since(seq, limit)
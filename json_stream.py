@@ -0,0 +1,264 @@
+"""Incremental extraction of the JSON object a model emits inside a ```json fence.
+
+JsonObjectScanner takes model output chunk by chunk, in one linear pass. It tracks
+braces and strings so that braces inside Lua code strings never close the object,
+and fence language tags so that a ```lua example is never mistaken for the answer.
+It repairs the mistakes models commonly make while copying, and it reports where
+the object starts and ends in the output.
+"""
+import json
+import re
+from typing import Any, Dict, List
+
+# Next character that matters outside / inside a JSON string
+_STRUCTURAL = re.compile(r'[{}\[\]",`]')
+_STRING_SPECIAL = re.compile(r'["\\\x00-\x1f]')
+# A run of string content that needs no repair: plain characters and valid escapes
+_STRING_RUN = re.compile(r'(?:[^"\\\x00-\x1f]+|\\["\\/bfnrt]|\\u[0-9a-fA-F]{4})+')
+_VALID_ESCAPES = set('"\\/bfnrt')
+_HEX = set("0123456789abcdefABCDEF")
+_CONTROL_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}
+# Fence tags whose contents may hold the answer; any other tag (lua, bash, ...) is skipped
+_JSON_TAGS = {"", "json", "jsonc", "json5"}
+
+
+class JsonObjectScanner:
+    """Feed model output chunk by chunk; reports the first complete JSON object inside a ```json fence.
+
+    Repairs applied while copying: trailing commas before } or ], raw control
+    characters inside strings, and invalid backslash escapes (including a \\u not
+    followed by four hex digits). Untagged fences count as JSON fences, and the
+    contents of fences tagged with another language (```lua, ```bash) are skipped.
+    Objects outside a fence, such as examples in the prose before it, are never
+    reported by feed(). The first of them is kept, and close() falls back to it when
+    the output turned out to have no JSON fence at all.
+    Offsets are counted over everything fed so far: `start`/`end` in characters,
+    `start_byte`/`end_byte` in UTF-8 bytes.
+    """
+
+    def __init__(self) -> None:
+        self.result: Dict[str, Any] | None = None
+        self.start = -1
+        self.end = -1
+        self.start_byte = -1
+        self.end_byte = -1
+        self.repairs: List[str] = []
+        self._chars_before = 0
+        self._bytes_before = 0
+        self._fences = 0  # ``` seen outside strings; odd while inside a fenced block
+        self._json_fence = False
+        self._fallback: tuple | None = None
+        self._tag: str | None = None  # info string after an opening fence, until its line ends
+        self._skip = False  # inside a fence tagged with another language
+        self._reset()
+
+    @property
+    def done(self) -> bool:
+        return self.result is not None
+
+    def _reset(self) -> None:
+        self._out: List[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._pending_comma = False
+        self._backticks = 0
+        self._unicode: str | None = None  # hex digits after a \\u, while deciding if it is valid
+        self._candidate_repairs: List[str] = []
+
+    def _repair(self, kind: str) -> None:
+        if kind not in self._candidate_repairs:
+            self._candidate_repairs.append(kind)
+
+    def _finish(self, chunk: str, i: int) -> bool:
+        """Parse the closed candidate; True when it is the fenced result."""
+        try:
+            obj = json.loads("".join(self._out))
+        except ValueError:
+            return False
+        if not isinstance(obj, dict):
+            return False
+        end, end_byte = self._offsets(chunk, i)
+        found = (obj, self.start, self.start_byte, end, end_byte, self._candidate_repairs)
+        if self._fences % 2:
+            self._accept(found)
+            return True
+        if self._fallback is None and not self._json_fence:
+            self._fallback = found
+        return False
+
+    def _accept(self, found: tuple) -> None:
+        self.result, self.start, self.start_byte, self.end, self.end_byte, self.repairs = found
+
+    def _fence(self) -> None:
+        self._fences += 1
+        self._backticks = 0
+        self._tag = "" if self._fences % 2 else None
+        self._skip = False
+
+    def close(self) -> Dict[str, Any] | None:
+        """End of output: the fenced object, or the first bare one when there was no JSON fence."""
+        if self.result is None and self._fallback is not None:
+            self._accept(self._fallback)
+        return self.result
+
+    def _offsets(self, chunk: str, i: int) -> tuple[int, int]:
+        return self._chars_before + i, self._bytes_before + len(chunk[:i].encode("utf-8"))
+
+    def _scan_string(self, chunk: str, i: int) -> int:
+        """Copy string content from chunk[i:]; returns the index after the string or len(chunk)."""
+        n = len(chunk)
+        out = self._out
+        while i < n:
+            if self._unicode is not None:
+                ch = chunk[i]
+                if ch in _HEX:
+                    self._unicode += ch
+                    i += 1
+                    if len(self._unicode) == 4:
+                        out.append("\\u" + self._unicode)
+                        self._unicode = None
+                    continue
+                # Not an escape after all (say C:\\users): keep the backslash literally
+                out.append("\\\\u" + self._unicode)
+                self._unicode = None
+                self._repair("invalid_escape")
+                continue
+            if self._escape:
+                ch = chunk[i]
+                self._escape = False
+                if ch == "u":
+                    self._unicode = ""
+                elif ch in _VALID_ESCAPES:
+                    out.append("\\" + ch)
+                elif ch == "'":
+                    out.append("'")
+                    self._repair("invalid_escape")
+                else:
+                    # A lone backslash meant literally (Lua patterns, Windows paths)
+                    out.append("\\\\" + _CONTROL_ESCAPES.get(ch, ch))
+                    self._repair("invalid_escape")
+                i += 1
+                continue
+            run = _STRING_RUN.match(chunk, i)
+            if run is not None:
+                out.append(run.group())
+                i = run.end()
+                if i >= n:
+                    return n
+            m = _STRING_SPECIAL.search(chunk, i)
+            if m is None:
+                out.append(chunk[i:])
+                return n
+            j = m.start()
+            if j > i:
+                out.append(chunk[i:j])
+            ch = chunk[j]
+            if ch == '"':
+                out.append('"')
+                self._in_string = False
+                return j + 1
+            if ch == "\\":
+                self._escape = True
+            else:
+                out.append(_CONTROL_ESCAPES.get(ch) or "\\u%04x" % ord(ch))
+                self._repair("control_character")
+            i = j + 1
+        return n
+
+    def feed(self, chunk: str) -> Dict[str, Any] | None:
+        if self.result is not None or not chunk:
+            return self.result
+        i = 0
+        n = len(chunk)
+        while i < n:
+            if self._depth == 0:
+                if self._tag is not None:
+                    # The fence's language tag runs to the end of its line
+                    ends = [k for k in (chunk.find("\n", i), chunk.find("{", i)) if k >= 0]
+                    if not ends:
+                        self._tag += chunk[i:]
+                        break
+                    k = min(ends)
+                    self._skip = (self._tag + chunk[i:k]).strip().lower() not in _JSON_TAGS
+                    self._tag = None
+                    if not self._skip:
+                        self._json_fence = True
+                        self._fallback = None
+                    i = k
+                    continue
+                j = -1 if self._skip else chunk.find("{", i)
+                k = chunk.find("`", i, j if j >= 0 else n)
+                if k >= 0:
+                    # Backticks between objects: count ``` fences, even when split across chunks
+                    self._backticks = self._backticks + 1 if k == i else 1
+                    if self._backticks >= 3:
+                        self._fence()
+                    i = k + 1
+                    continue
+                self._backticks = 0
+                if j < 0:
+                    break
+                self._reset()
+                self._out.append("{")
+                self._depth = 1
+                self.start, self.start_byte = self._offsets(chunk, j)
+                i = j + 1
+                continue
+            if self._in_string:
+                i = self._scan_string(chunk, i)
+                continue
+            m = _STRUCTURAL.search(chunk, i)
+            j = m.start() if m else n
+            if j > i:
+                segment = chunk[i:j]
+                if segment.strip():
+                    self._backticks = 0
+                    if self._pending_comma:
+                        self._out.append(",")
+                        self._pending_comma = False
+                    self._out.append(segment)
+            if m is None:
+                break
+            ch = chunk[j]
+            i = j + 1
+            if ch == "`":
+                self._backticks += 1
+                if self._backticks >= 3:
+                    # A fence while an object is open: that object was prose, the fenced one follows
+                    self._reset()
+                    self._fence()
+                continue
+            self._backticks = 0
+            if ch == ",":
+                if self._pending_comma:
+                    self._out.append(",")
+                self._pending_comma = True
+                continue
+            if self._pending_comma:
+                if ch in "}]":
+                    self._repair("trailing_comma")
+                else:
+                    self._out.append(",")
+                self._pending_comma = False
+            self._out.append(ch)
+            if ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    if self._finish(chunk, i):
+                        break
+                    self._reset()
+        self._chars_before += n
+        self._bytes_before += len(chunk.encode("utf-8"))
+        return self.result
+
+
+def extract_json(text: str) -> Dict[str, Any] | None:
+    """Return the JSON object in the text's ```json fence (or its first object if unfenced), or None."""
+    scanner = JsonObjectScanner()
+    scanner.feed(text)
+    return scanner.close()
@@ -0,0 +1,92 @@
+"""Push channel for the dashboard pages (Server-Sent Events).
+
+Everything the pages used to poll for is published here once, as it happens, and fanned
+out to every open stream: activity events, status deltas, mod-list changes and new log
+lines. Each message gets an `<epoch>:<seq>` id, the epoch being new with every
+process. A client that reconnects with Last-Event-ID gets what it missed from a bounded
+replay buffer, or a `reset` message when it was gone so long that the buffer no longer
+covers the gap, or when its id comes from a process that has since restarted.
+"""
+import asyncio
+import json
+import os
+import secrets
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+LIVE_HISTORY = int(os.environ.get("XYRUS_LIVE_HISTORY", "1000"))
+LIVE_QUEUE = int(os.environ.get("XYRUS_LIVE_QUEUE", "1000"))
+LIVE_STATUS_SECONDS = float(os.environ.get("XYRUS_LIVE_STATUS_SECONDS", "2"))
+LIVE_KEEPALIVE_SECONDS = 15.0
+
+
+class LiveHub:
+    def __init__(self, history: int = LIVE_HISTORY, queue_size: int = LIVE_QUEUE):
+        self.seq = 0
+        self.epoch = secrets.token_hex(4)
+        self.queue_size = queue_size
+        self._buffer: Deque[Dict[str, Any]] = deque(maxlen=history)
+        self._subscribers: set[asyncio.Queue] = set()
+        self.dropped = 0
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+
+    def publish(self, event: str, data: Any) -> int:
+        self.seq += 1
+        msg = {"id": self.seq, "event": event, "data": data}
+        self._buffer.append(msg)
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(msg)
+            except asyncio.QueueFull:
+                # A client this far behind is cut off; it reconnects and replays from its last id
+                self._subscribers.discard(queue)
+                self.dropped += 1
+                queue.get_nowait()
+                queue.put_nowait(None)
+        return self.seq
+
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        self._subscribers.discard(queue)
+
+    def event_id(self, seq: int) -> str:
+        return f"{self.epoch}:{seq}"
+
+    def replay(self, last_event_id: str) -> Optional[List[Dict[str, Any]]]:
+        """Messages after `last_event_id`, or None when the client must start over: some of
+        them have already left the buffer, or the id carries another process's epoch."""
+        epoch, _, seq = last_event_id.rpartition(":")
+        if epoch != self.epoch or not seq.isdigit() or int(seq) > self.seq:
+            return None
+        last_id = int(seq)
+        if last_id == self.seq:
+            return []
+        if not self._buffer or self._buffer[0]["id"] > last_id + 1:
+            return None
+        return [m for m in self._buffer if m["id"] > last_id]
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"epoch": self.epoch, "seq": self.seq, "subscribers": self.subscribers, "buffered": len(self._buffer),
+                "dropped": self.dropped}
+
+
+def sse_frame(event: str, data: Any, event_id: Optional[str] = None) -> str:
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def changed_keys(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    """Top-level keys of `new` that differ from `old` (removed keys come back as None)."""
+    delta = {k: v for k, v in new.items() if old.get(k) != v}
+    delta.update({k: None for k in old if k not in new})
+    return delta
+
+
+live_hub = LiveHub()
@@ -0,0 +1,408 @@
+"""Search over minetest.log and its rotated archives.
+
+Files are searched oldest first: archives next to the log (`minetest.log.1`,
+`minetest.log.2.gz`, `minetest.log-<date>.gz`, ...) in mtime order, then the live file.
+Uncompressed files are mapped with mmap and scanned by the regex engine directly, so
+matching runs at C speed and only matching lines are decoded. For each of them a sparse
+index of (timestamp, offset) points, one every `XYRUS_LOG_SEARCH_INDEX_STEP` bytes, is
+kept and extended as the file grows; a time-bounded query seeks straight to the points
+around its range. Gzip archives are streamed; the first and last timestamp of each is
+remembered after one full pass, so archives outside the range are skipped afterwards.
+
+Luanti writes local-time "YYYY-MM-DD HH:MM:SS" stamps, which compare correctly as
+strings, so time filtering never parses a date. Results come in pages; a page ends at
+`limit` matches or when the time budget runs out, and carries a cursor
+("<inode>:<offset>") to continue from.
+"""
+import bisect
+import gzip
+import mmap
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from log_tailer import MINETEST_LOG
+
+LOG_SEARCH_INDEX_STEP = int(os.environ.get("XYRUS_LOG_SEARCH_INDEX_STEP", str(1 << 20)))
+LOG_SEARCH_MAX_SECONDS = float(os.environ.get("XYRUS_LOG_SEARCH_MAX_SECONDS", "10"))
+LOG_SEARCH_MAX_LINE = 4000
+_GZ_CHUNK = 8 << 20
+_FOLD_WINDOW = 4 << 20
+
+# Used with match(), which anchors at the given position
+_STAMP = re.compile(rb"(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}): (?:([A-Z]+)\[[^\]]*\]: )?")
+LEVELS = ("error", "warning", "action", "info", "verbose", "none")
+
+
+def stamp_of(when: float) -> bytes:
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(when)).encode()
+
+
+def _first_stamp(buf, pos: int, end: int, max_scan: int = 65536) -> Tuple[Optional[bytes], int]:
+    """Stamp of the first timestamped line at or after line start `pos`, and that line's offset."""
+    limit = min(end, pos + max_scan)
+    while pos < limit:
+        m = _STAMP.match(buf, pos, end)
+        if m:
+            return m.group(1), pos
+        nl = buf.find(b"\n", pos, limit)
+        if nl < 0:
+            break
+        pos = nl + 1
+    return None, pos
+
+
+def _last_stamp(buf, end: int, max_scan: int = 65536) -> Optional[bytes]:
+    """Stamp of the last timestamped line before `end` (which is just past a newline)."""
+    pos = end - 1
+    floor = max(0, end - max_scan)
+    while pos > floor:
+        start = buf.rfind(b"\n", floor, pos) + 1
+        m = _STAMP.match(buf, start, end)
+        if m:
+            return m.group(1)
+        pos = start - 1
+    return None
+
+
+class SparseIndex:
+    """(stamp, offset) points of one uncompressed file; each offset is a line start."""
+
+    def __init__(self, inode: int):
+        self.inode = inode
+        self.stamps: List[bytes] = []
+        self.offsets: List[int] = []
+        self.size = 0
+        self._next = 0  # where the next point is looked for
+
+    def extend(self, buf, size: int, step: int) -> None:
+        pos = self._next
+        while pos < size:
+            if pos:
+                # Move to the start of the next line (or stay, when already on one)
+                nl = buf.find(b"\n", pos - 1, size)
+                if nl < 0:
+                    break
+                pos = nl + 1
+            stamp, at = _first_stamp(buf, pos, size)
+            if stamp is None:
+                if buf.find(b"\n", at, size) < 0:
+                    break  # nothing stamped up to the end yet; retried when the file grows
+                pos = at + step
+                continue
+            if not self.stamps or stamp >= self.stamps[-1]:
+                self.stamps.append(stamp)
+                self.offsets.append(at)
+            pos = at + step
+        self._next = pos
+        self.size = size
+
+    def range(self, since: Optional[bytes], until: Optional[bytes], size: int) -> Tuple[int, int]:
+        start, end = 0, size
+        if since is not None:
+            # Last point strictly before `since`: every line in range is at or after it
+            i = bisect.bisect_left(self.stamps, since) - 1
+            if i >= 0:
+                start = self.offsets[i]
+        if until is not None:
+            i = bisect.bisect_right(self.stamps, until)
+            if i < len(self.stamps):
+                end = self.offsets[i]
+        return start, end
+
+
+class _Finder:
+    """Offset of the next candidate match in buf[pos:end], or -1.
+
+    Plain substrings go through bytes.find. Case-insensitive ones search a lowercased copy
+    of a few MB at a time, which is several times faster than an IGNORECASE regex.
+    """
+
+    def __init__(self, needle: Optional[bytes] = None, pattern: Optional["re.Pattern[bytes]"] = None,
+                 fold: bool = False):
+        self.needle = needle.lower() if needle is not None and fold else needle
+        self.pattern = pattern
+        self.fold = fold and needle is not None and needle.lower() != needle.upper()
+        self._window: Optional[Tuple[Any, int, int, bytes]] = None
+
+    def find(self, buf, pos: int, end: int) -> int:
+        if self.pattern is not None:
+            m = self.pattern.search(buf, pos, end)
+            return m.start() if m else -1
+        if not self.fold:
+            return buf.find(self.needle, pos, end)
+        overlap = len(self.needle) - 1
+        while pos < end:
+            window = self._window
+            if window is None or window[0] is not buf or not window[1] <= pos < window[2] or window[2] > end:
+                stop = min(end, pos + _FOLD_WINDOW)
+                window = self._window = (buf, pos, stop, buf[pos:stop].lower())
+            _, start, stop, folded = window
+            i = folded.find(self.needle, pos - start)
+            if i >= 0:
+                return start + i
+            if stop >= end:
+                return -1
+            self._window = None
+            pos = stop - overlap
+        return -1
+
+
+class SearchQuery:
+    def __init__(self, q: Optional[str] = None, regex: bool = False, case: bool = False,
+                 levels: Optional[List[str]] = None, mod: Optional[str] = None,
+                 since: Optional[float] = None, until: Optional[float] = None, limit: int = 100):
+        self.mod_pattern = None
+        if mod:
+            name = re.escape(mod.encode())
+            self.mod_pattern = re.compile(rb"mods/" + name + rb"/|\bmod ['\"]" + name + rb"['\"]")
+        self.levels = {lv.upper().encode() for lv in levels} if levels else None
+        self.since = stamp_of(since) if since is not None else None
+        self.until = stamp_of(until) if until is not None else None
+        self.limit = limit
+        # Candidate lines are found with the most selective test available; accept() checks the rest
+        self.finder: Optional[_Finder] = None
+        if q and regex:
+            self.finder = _Finder(pattern=re.compile(q.encode(), re.MULTILINE | (0 if case else re.IGNORECASE)))
+        elif q:
+            self.finder = _Finder(q.encode(), fold=not case)
+        elif mod:
+            self.finder = _Finder(mod.encode())
+        elif self.levels and b"NONE" not in self.levels:
+            if len(self.levels) == 1:
+                self.finder = _Finder(b": " + next(iter(self.levels)) + b"[")
+            else:
+                self.finder = _Finder(pattern=re.compile(
+                    rb": (?:" + b"|".join(re.escape(lv) for lv in sorted(self.levels)) + rb")\["))
+
+    @property
+    def timed(self) -> bool:
+        return self.since is not None or self.until is not None
+
+    def accept(self, when: Optional[bytes], level: Optional[bytes], line: bytes) -> Optional[bool]:
+        """None when the line is past `until`, so nothing later can match either."""
+        if when is not None:
+            if self.until is not None and when > self.until:
+                return None
+            if self.since is not None and when < self.since:
+                return False
+        if self.levels is not None and (level or b"NONE") not in self.levels:
+            return False
+        if self.mod_pattern is not None and not self.mod_pattern.search(line):
+            return False
+        return True
+
+
+class _Page:
+    def __init__(self, query: SearchQuery, deadline: float):
+        self.query = query
+        self.deadline = deadline
+        self.matches: List[Dict[str, Any]] = []
+        self.next_cursor: Optional[str] = None
+        self.done = False  # past `until`, or page full
+        self.scanned = 0
+
+    def scan(self, buf, start: int, end: int, base: int, inode: int, name: str) -> int:
+        """Scan complete lines of buf[start:end]; returns the offset scanning stopped at."""
+        query = self.query
+        pos = start
+        checks = 0
+        while pos < end:
+            if query.finder is not None:
+                found = query.finder.find(buf, pos, end)
+                if found < 0:
+                    pos = end
+                    break
+                ls = buf.rfind(b"\n", pos, found) + 1 or pos
+            else:
+                ls = pos
+            le = buf.find(b"\n", ls, end)
+            if le < 0:
+                le = end
+            line = buf[ls:le]
+            pos = le + 1
+            m = _STAMP.match(line)
+            stamp = m.group(1) if m else None
+            level = (m.group(2) or b"NONE") if m else None
+            # Continuation lines (traceback frames and such) take the time of the line they follow
+            when = stamp if stamp is not None or not query.timed else _last_stamp(buf, ls)
+            verdict = query.accept(when, level, line)
+            if verdict is None:
+                self.done = True
+                pos = ls
+                break
+            if verdict:
+                self.matches.append({
+                    "file": name,
+                    "cursor": f"{inode}:{base + ls}",
+                    "time": when.decode() if when else None,
+                    "level": level.decode().lower() if level else None,
+                    "line": line[:LOG_SEARCH_MAX_LINE].decode("utf-8", errors="replace").rstrip("\r"),
+                })
+                if len(self.matches) >= query.limit:
+                    self.next_cursor = f"{inode}:{base + min(pos, end)}"
+                    self.done = True
+                    break
+            checks += 1
+            if checks % 1024 == 0 and time.monotonic() > self.deadline:
+                self.next_cursor = f"{inode}:{base + min(pos, end)}"
+                self.done = True
+                break
+        pos = min(pos, end)
+        self.scanned += pos - start
+        return pos
+
+
+class LogSearch:
+    def __init__(self, path: Path, index_step: int = LOG_SEARCH_INDEX_STEP,
+                 max_seconds: float = LOG_SEARCH_MAX_SECONDS):
+        self.path = path
+        self.index_step = index_step
+        self.max_seconds = max_seconds
+        self._indexes: Dict[int, SparseIndex] = {}
+        self._gz_bounds: Dict[Tuple[int, int, int], Tuple[Optional[bytes], Optional[bytes]]] = {}
+        self._lock = threading.Lock()
+        self.searches = 0
+
+    def files(self) -> List[Tuple[Path, os.stat_result]]:
+        """Archives oldest first, then the live log."""
+        found: List[Tuple[Path, os.stat_result]] = []
+        name = self.path.name
+        try:
+            for p in self.path.parent.iterdir():
+                if p.name.startswith((name + ".", name + "-")) and p.is_file():
+                    found.append((p, p.stat()))
+        except OSError:
+            pass
+        found.sort(key=lambda item: item[1].st_mtime)
+        try:
+            found.append((self.path, self.path.stat()))
+        except OSError:
+            pass
+        return found
+
+    def _index_for(self, st: os.stat_result, buf) -> SparseIndex:
+        with self._lock:
+            index = self._indexes.get(st.st_ino)
+            if index is None or index.size > st.st_size:
+                index = self._indexes[st.st_ino] = SparseIndex(st.st_ino)
+            if index.size < st.st_size:
+                index.extend(buf, st.st_size, self.index_step)
+            return index
+
+    def _search_plain(self, page: _Page, path: Path, st: os.stat_result, resume: Optional[int]) -> Dict[str, Any]:
+        info = {"name": path.name, "size": st.st_size, "compressed": False, "skipped": False}
+        if st.st_size == 0:
+            return info
+        with path.open("rb") as f, mmap.mmap(f.fileno(), st.st_size, access=mmap.ACCESS_READ) as buf:
+            index = self._index_for(st, buf)
+            start, end = index.range(page.query.since, page.query.until, st.st_size)
+            if resume is not None:
+                start = max(start, resume)
+            # Only whole lines of the live file: a line still being written is left for the next search
+            if path == self.path and end == st.st_size and buf[end - 1:end] != b"\n":
+                end = buf.rfind(b"\n", 0, end) + 1
+            if start >= end:
+                info["skipped"] = True
+                return info
+            page.scan(buf, start, end, 0, st.st_ino, path.name)
+        return info
+
+    def _search_gz(self, page: _Page, path: Path, st: os.stat_result, resume: Optional[int]) -> Dict[str, Any]:
+        info = {"name": path.name, "size": st.st_size, "compressed": True, "skipped": False}
+        key = (st.st_ino, int(st.st_mtime), st.st_size)
+        bounds = self._gz_bounds.get(key)
+        query = page.query
+        if bounds is not None:
+            first, last = bounds
+            if ((query.since is not None and last is not None and last < query.since)
+                    or (query.until is not None and first is not None and first > query.until)):
+                info["skipped"] = True
+                return info
+        first = last = None
+        offset = 0
+        carry = b""
+        with gzip.open(path, "rb") as f:
+            while not page.done:
+                chunk = f.read(_GZ_CHUNK)
+                if not chunk and not carry:
+                    break
+                buf = carry + (chunk or b"\n")
+                cut = buf.rfind(b"\n") + 1
+                buf, carry = buf[:cut], buf[cut:]
+                if not buf:
+                    continue
+                if first is None:
+                    first = _first_stamp(buf, 0, len(buf))[0]
+                chunk_last = _last_stamp(buf, len(buf))
+                last = chunk_last or last
+                start = min(max(0, resume - offset), len(buf)) if resume is not None else 0
+                # Chunks that end before `since` are decompressed but not matched
+                if query.since is None or chunk_last is None or chunk_last >= query.since:
+                    page.scan(buf, start, len(buf), offset, st.st_ino, path.name)
+                offset += len(buf)
+        if not page.done:
+            self._gz_bounds[key] = (first, last)
+        return info
+
+    def search(self, query: SearchQuery, cursor: Optional[str] = None) -> Dict[str, Any]:
+        started = time.monotonic()
+        page = _Page(query, started + self.max_seconds)
+        resume_inode = resume_offset = None
+        if cursor:
+            try:
+                ino, off = cursor.split(":", 1)
+                resume_inode, resume_offset = int(ino), int(off)
+            except ValueError:
+                raise ValueError(f"Bad cursor: {cursor}")
+        files = all_files = self.files()
+        if resume_inode is not None:
+            position = next((i for i, (_, st) in enumerate(files) if st.st_ino == resume_inode), None)
+            if position is None:
+                raise LookupError("Cursor refers to a log file that no longer exists")
+            files = files[position:]
+        searched: List[Dict[str, Any]] = []
+        for path, st in files:
+            if page.done:
+                break
+            if time.monotonic() > page.deadline:
+                page.next_cursor = f"{st.st_ino}:{resume_offset if st.st_ino == resume_inode else 0}"
+                break
+            resume = resume_offset if st.st_ino == resume_inode else None
+            try:
+                if path.suffix == ".gz":
+                    searched.append(self._search_gz(page, path, st, resume))
+                else:
+                    searched.append(self._search_plain(page, path, st, resume))
+            except (OSError, EOFError, ValueError) as e:
+                searched.append({"name": path.name, "size": st.st_size, "error": str(e)})
+        with self._lock:
+            live = {st.st_ino for _, st in all_files}
+            for inode in [i for i in self._indexes if i not in live]:
+                del self._indexes[inode]
+            for key in [k for k in self._gz_bounds if k[0] not in live]:
+                del self._gz_bounds[key]
+        self.searches += 1
+        return {
+            "matches": page.matches,
+            "next_cursor": page.next_cursor,
+            "timed_out": page.next_cursor is not None and len(page.matches) < query.limit,
+            "scanned_bytes": page.scanned,
+            "files": searched,
+            "elapsed_ms": round((time.monotonic() - started) * 1000, 1),
+        }
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "path": str(self.path),
+            "indexed_files": len(self._indexes),
+            "index_points": sum(len(i.offsets) for i in self._indexes.values()),
+            "gz_bounds": len(self._gz_bounds),
+            "searches": self.searches,
+        }
+
+
+log_search = LogSearch(MINETEST_LOG)
@@ -0,0 +1,348 @@
+"""Background follower for minetest.log with rolling error/warning aggregates.
+
+One task follows the log (inotify on the log directory when available, polling
+otherwise), classifies each new line once and updates per-level and per-mod counters
+over a few rolling windows, plus small buffers of recent sample lines. Every line also goes to the per-mod
+traceback index in mod_errors. Readers such as /api/status get the aggregates without
+touching the file.
+"""
+import asyncio
+import ctypes
+import ctypes.util
+import os
+import re
+import struct
+import time
+from collections import Counter, deque
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from mod_errors import ModErrorIndex
+
+MINETEST_LOG = Path(os.environ.get("XYRUS_MINETEST_LOG", "/var/log/minetest/minetest.log"))
+LOG_WINDOWS = [int(w) for w in os.environ.get("XYRUS_LOG_WINDOWS", "60,600,3600").split(",") if w.strip()]
+LOG_STATUS_WINDOW = int(os.environ.get("XYRUS_LOG_STATUS_WINDOW", "3600"))
+LOG_SAMPLES = int(os.environ.get("XYRUS_LOG_SAMPLES", "20"))
+LOG_POLL_SECONDS = float(os.environ.get("XYRUS_LOG_POLL_SECONDS", "1"))
+# How much of an existing log to read at startup, so recent errors are counted right away
+LOG_BACKFILL_BYTES = int(os.environ.get("XYRUS_LOG_BACKFILL_BYTES", "262144"))
+_READ_CHUNK = 1 << 20
+
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+_INOTIFY_EVENT = struct.Struct("iIII")
+
+_TIMESTAMP = re.compile(r"^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}):")
+# Mod attribution: a path inside a mods directory, or Luanti's "from mod 'x'" wording
+_MOD_PATTERNS = (
+    re.compile(r"/mods/([A-Za-z0-9_]+)/"),
+    re.compile(r"\bmod ['\"]([A-Za-z0-9_]+)['\"]"),
+)
+
+
+def inotify_open(directories: List[Path], mask: int) -> Optional[tuple[int, Dict[int, Path]]]:
+    """Non-blocking inotify fd watching `directories`, with watch descriptor -> directory;
+    None where inotify is unavailable or any directory cannot be watched."""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            return None
+        watches: Dict[int, Path] = {}
+        for directory in directories:
+            wd = libc.inotify_add_watch(fd, str(directory).encode(), mask)
+            if wd < 0:
+                os.close(fd)
+                return None
+            watches[wd] = directory
+        return fd, watches
+    except (OSError, AttributeError):
+        return None
+
+
+def inotify_read(fd: int) -> List[tuple[int, int, str]]:
+    """Drain pending events as (watch descriptor, mask, file name)."""
+    events: List[tuple[int, int, str]] = []
+    try:
+        while True:
+            data = os.read(fd, 65536)
+            if not data:
+                break
+            pos = 0
+            while pos + _INOTIFY_EVENT.size <= len(data):
+                wd, mask, _cookie, length = _INOTIFY_EVENT.unpack_from(data, pos)
+                pos += _INOTIFY_EVENT.size
+                name = data[pos:pos + length].split(b"\0", 1)[0].decode("utf-8", errors="replace")
+                pos += length
+                events.append((wd, mask, name))
+    except OSError:
+        pass
+    return events
+
+
+def classify_line(line: str) -> Optional[str]:
+    lower = line.lower()
+    if "error" in lower:
+        return "error"
+    if "warn" in lower:
+        return "warning"
+    return None
+
+
+def mod_of_line(line: str) -> Optional[str]:
+    for pattern in _MOD_PATTERNS:
+        found = pattern.findall(line)
+        if found:
+            return found[-1].lower()
+    return None
+
+
+def line_time(line: str, default: float) -> float:
+    m = _TIMESTAMP.match(line)
+    if m:
+        try:
+            return time.mktime(time.strptime(m.group(1), "%Y-%m-%d %H:%M:%S"))
+        except ValueError:
+            pass
+    return default
+
+
+class RollingCounter:
+    """Counts per key over the last `window` seconds, kept in fixed-width time buckets.
+
+    Adding is O(1); reading drops expired buckets first, so both stay cheap no matter
+    how long the window is.
+    """
+
+    def __init__(self, window: float, buckets: int = 60):
+        self.window = window
+        self.bucket_s = max(1.0, window / buckets)
+        self._buckets: Deque[tuple[float, Counter]] = deque()
+        self.totals: Counter = Counter()
+
+    def add(self, key: Any, ts: float, n: int = 1) -> None:
+        start = ts - ts % self.bucket_s
+        if self._buckets and start <= self._buckets[-1][0]:
+            if start <= self._buckets[-1][0] - self.window:
+                return  # older than the window already is
+            bucket = self._buckets[-1][1]  # late line: count it in the newest bucket
+        else:
+            bucket = Counter()
+            self._buckets.append((start, bucket))
+        bucket[key] += n
+        self.totals[key] += n
+
+    def expire(self, now: float) -> None:
+        cutoff = now - self.window
+        while self._buckets and self._buckets[0][0] + self.bucket_s <= cutoff:
+            _, bucket = self._buckets.popleft()
+            self.totals.subtract(bucket)
+            for key in list(bucket):
+                if self.totals[key] <= 0:
+                    del self.totals[key]
+
+    def counts(self, now: float) -> Counter:
+        self.expire(now)
+        return self.totals
+
+
+class LogTailer:
+    def __init__(self, path: Path = MINETEST_LOG, windows: List[int] = LOG_WINDOWS, samples: int = LOG_SAMPLES,
+                 poll_seconds: float = LOG_POLL_SECONDS):
+        self.path = path
+        self.windows = {w: RollingCounter(w) for w in sorted(set(windows) | {LOG_STATUS_WINDOW})}
+        self.poll_seconds = poll_seconds
+        self.samples: Dict[str, Deque[Dict[str, Any]]] = {
+            "error": deque(maxlen=samples),
+            "warning": deque(maxlen=samples),
+        }
+        # Lua tracebacks grouped, attributed to mod/file/line and deduplicated
+        self.errors = ModErrorIndex()
+        self.totals: Counter = Counter()
+        self.lines_seen = 0
+        self.last_error_mod: Optional[str] = None
+        self.last_line_at: Optional[float] = None
+        self.rotations = 0
+        self.mode = "stopped"
+        self._inode: Optional[int] = None
+        self._offset = 0
+        self._partial = b""
+        self._task: Optional[asyncio.Task] = None
+        self._wake = asyncio.Event()
+        self._inotify_fd: Optional[int] = None
+        # Called with each batch of new complete lines and the "<inode>:<offset>" cursor after them
+        self.listeners: List[Callable[[List[str], str], None]] = []
+
+    def ingest(self, line: str, now: Optional[float] = None) -> None:
+        """Fold one log line into the counters and samples."""
+        now = time.time() if now is None else now
+        self.lines_seen += 1
+        self.errors.feed(line, now)
+        level = classify_line(line)
+        if level is None:
+            return
+        ts = line_time(line, now)
+        mod = mod_of_line(line)
+        self.totals[level] += 1
+        for counter in self.windows.values():
+            counter.add(level, ts)
+            if mod:
+                counter.add((level, mod), ts)
+        self.samples[level].append({"ts": ts, "line": line, "mod": mod})
+        if mod and level == "error":
+            self.last_error_mod = mod
+        self.last_line_at = ts
+
+    def _ingest_bytes(self, data: bytes) -> List[str]:
+        data = self._partial + data
+        raw_lines = data.split(b"\n")
+        self._partial = raw_lines.pop()
+        now = time.time()
+        lines = [raw.decode("utf-8", errors="replace").rstrip("\r") for raw in raw_lines]
+        for line in lines:
+            self.ingest(line, now)
+        return lines
+
+    def read_new(self) -> int:
+        """Read whatever was appended since the last call; handles rotation and truncation."""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return 0
+        backfill = self._inode is None
+        if backfill:
+            self._inode = st.st_ino
+            self._offset = max(0, st.st_size - LOG_BACKFILL_BYTES)
+            self._partial = b""
+            skip_partial = self._offset > 0
+        elif st.st_ino != self._inode or st.st_size < self._offset:
+            # Rotated or truncated: the new file is read from its start
+            self.rotations += 1
+            self.errors.flush()
+            self._inode, self._offset, self._partial = st.st_ino, 0, b""
+            skip_partial = False
+        else:
+            skip_partial = False
+        if st.st_size == self._offset:
+            return 0
+        read = 0
+        new_lines: List[str] = []
+        try:
+            with self.path.open("rb") as f:
+                f.seek(self._offset)
+                while True:
+                    chunk = f.read(_READ_CHUNK)
+                    if not chunk:
+                        break
+                    if skip_partial:
+                        nl = chunk.find(b"\n")
+                        self._offset += nl + 1 if nl >= 0 else len(chunk)
+                        chunk = chunk[nl + 1:] if nl >= 0 else b""
+                        skip_partial = nl < 0
+                    self._offset += len(chunk)
+                    read += len(chunk)
+                    new_lines.extend(self._ingest_bytes(chunk))
+        except OSError:
+            pass
+        # A traceback is written in one go, so a batch boundary also ends the block being collected
+        self.errors.flush()
+        if new_lines and not backfill:
+            cursor = f"{self._inode}:{self._offset - len(self._partial)}"
+            for listener in self.listeners:
+                try:
+                    listener(new_lines, cursor)
+                except Exception:
+                    pass
+        return read
+
+    def _open_inotify(self) -> bool:
+        # Watch the directory, not the file, so a rotated-in file is noticed too
+        opened = inotify_open([self.path.parent], IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE)
+        if opened is None:
+            return False
+        fd = opened[0]
+        asyncio.get_running_loop().add_reader(fd, self._on_inotify)
+        self._inotify_fd = fd
+        return True
+
+    def _on_inotify(self) -> None:
+        inotify_read(self._inotify_fd)
+        self._wake.set()
+
+    def _close_inotify(self) -> None:
+        if self._inotify_fd is not None:
+            try:
+                asyncio.get_running_loop().remove_reader(self._inotify_fd)
+            except RuntimeError:
+                pass
+            os.close(self._inotify_fd)
+            self._inotify_fd = None
+
+    async def _run(self) -> None:
+        while True:
+            if self._inotify_fd is None and self._open_inotify():
+                self.mode = "inotify"
+            elif self._inotify_fd is None:
+                self.mode = "poll"
+            self._wake.clear()
+            self.read_new()
+            # With inotify the timeout is only a safety net for missed events
+            timeout = self.poll_seconds * (30 if self._inotify_fd is not None else 1)
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._close_inotify()
+        self.mode = "stopped"
+
+    def window_counts(self, window: int, now: Optional[float] = None) -> Dict[str, Any]:
+        counts = self.windows[window].counts(time.time() if now is None else now)
+        by_mod: Dict[str, Dict[str, int]] = {}
+        for key, n in counts.items():
+            if isinstance(key, tuple):
+                by_mod.setdefault(key[1], {"error": 0, "warning": 0})[key[0]] = n
+        return {"errors": counts.get("error", 0), "warnings": counts.get("warning", 0), "by_mod": by_mod}
+
+    def summary(self, window: int = LOG_STATUS_WINDOW, samples: int = 5) -> Dict[str, Any]:
+        """Error/warning counts over `window` seconds, with the latest sample lines in that window."""
+        now = time.time()
+        current = self.window_counts(window, now)
+        cutoff = now - window
+        err = [s["line"] for s in self.samples["error"] if s["ts"] >= cutoff][-samples:]
+        warn = [s["line"] for s in self.samples["warning"] if s["ts"] >= cutoff][-samples:]
+        return {
+            "errors": current["errors"],
+            "warnings": current["warnings"],
+            "error_samples": err,
+            "warning_samples": warn,
+            "by_mod": current["by_mod"],
+            "window_s": window,
+            "windows": {str(w): {k: v for k, v in self.window_counts(w, now).items() if k != "by_mod"}
+                        for w in self.windows},
+            "last_error_mod": self.last_error_mod if current["errors"] else None,
+            "totals": dict(self.totals),
+            "lines_seen": self.lines_seen,
+            "rotations": self.rotations,
+            "tracebacks": self.errors.status(),
+            "mode": self.mode,
+        }
+
+
+log_tailer = LogTailer()
@@ -0,0 +1,201 @@
+"""Per-mod index of Lua errors seen in minetest.log.
+
+Lines are fed in as the log is followed. Consecutive ERROR lines that belong to one
+report (the message, a "Failed to load and run script" follow-up, the stack traceback
+and its frames) are grouped into a single block. When the block ends it is attributed
+to a mod, a file and a line: the first `mods/<name>/<file>.lua:<line>` location in the
+message, otherwise the mod Luanti names, otherwise the first frame inside a mod. Blocks
+are deduplicated by a signature of mod, location and message with addresses and
+coordinates normalized away, and per-mod counts, first/last-seen times and the exact
+text of each distinct traceback are kept. Reads are dictionary lookups.
+"""
+import hashlib
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+MOD_ERROR_SIGNATURES = int(os.environ.get("XYRUS_MOD_ERROR_SIGNATURES", "50"))
+MOD_ERROR_TRACEBACK_LINES = 40
+
+_PREFIX = re.compile(r"^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}): ([A-Z]+)\[([^\]]*)\]: ?(.*)$")
+# A Lua source location inside a mods directory; Lua may shorten the front of a long path to "..."
+_LOCATION = re.compile(r"(?:^|[/.\s])(?:world)?mods/([A-Za-z0-9_]+)/((?:[^\s:/]+/)*[^\s:/]+\.lua):(\d+):")
+_ANY_LOCATION = re.compile(r"^\S*\.lua:\d+:")
+_NAMED_MOD = re.compile(r"\bmod ['\"]([A-Za-z0-9_]+)['\"]")
+_ADDRESS = re.compile(r"0x[0-9a-fA-F]+")
+_COORDS = re.compile(r"\(\s*-?\d+(?:\.\d+)?\s*,\s*-?\d+(?:\.\d+)?\s*,\s*-?\d+(?:\.\d+)?\s*\)")
+
+
+def _line_time(stamp: str, default: float) -> float:
+    try:
+        return time.mktime(time.strptime(stamp, "%Y-%m-%d %H:%M:%S"))
+    except ValueError:
+        return default
+
+
+def _is_continuation(text: str) -> bool:
+    return (not text or text[0].isspace() or text.startswith(("stack traceback", "[C]", "(...tail calls"))
+            or bool(_ANY_LOCATION.match(text)))
+
+
+class ErrorSignature:
+    def __init__(self, sig: str, mod: str, file: Optional[str], line: Optional[int], message: str,
+                 traceback: List[str], ts: float):
+        self.sig = sig
+        self.mod = mod
+        self.file = file
+        self.line = line
+        self.message = message
+        self.traceback = traceback
+        self.count = 0
+        self.first_seen = ts
+        self.last_seen = ts
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "signature": self.sig,
+            "file": self.file,
+            "line": self.line,
+            "message": self.message,
+            "count": self.count,
+            "first_seen": self.first_seen,
+            "last_seen": self.last_seen,
+            "traceback": "\n".join(self.traceback),
+        }
+
+
+class ModErrors:
+    def __init__(self, mod: str, ts: float):
+        self.mod = mod
+        self.count = 0
+        self.first_seen = ts
+        self.last_seen = ts
+        self.dropped = 0
+        # Least recently seen first, so the oldest distinct error is the one evicted
+        self.signatures: "OrderedDict[str, ErrorSignature]" = OrderedDict()
+        self.files: Dict[str, int] = {}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "mod": self.mod,
+            "errors": self.count,
+            "first_seen": self.first_seen,
+            "last_seen": self.last_seen,
+            "files": dict(self.files),
+            "distinct": len(self.signatures),
+            "evicted": self.dropped,
+            "signatures": [s.to_dict() for s in reversed(self.signatures.values())],
+        }
+
+
+class ModErrorIndex:
+    def __init__(self, max_signatures: int = MOD_ERROR_SIGNATURES):
+        self.max_signatures = max_signatures
+        self.mods: Dict[str, ModErrors] = {}
+        self.last_mod: Optional[str] = None
+        self.blocks = 0
+        self.unattributed = 0
+        self._block: Optional[List[str]] = None
+        self._block_ts = 0.0
+        self._block_thread = ""
+
+    def feed(self, line: str, now: float) -> None:
+        m = _PREFIX.match(line)
+        if m is None:
+            # Older servers write the extra lines of a multi-line message without a prefix
+            if self._block is not None and line.strip():
+                self._append(line)
+            return
+        stamp, level, thread, text = m.groups()
+        if level != "ERROR":
+            self.flush()
+            return
+        if self._block is not None and thread == self._block_thread and _is_continuation(text):
+            self._append(text)
+            return
+        self.flush()
+        self._block = [text]
+        self._block_ts = _line_time(stamp, now)
+        self._block_thread = thread
+
+    def _append(self, text: str) -> None:
+        if len(self._block) < MOD_ERROR_TRACEBACK_LINES:
+            self._block.append(text)
+
+    def flush(self) -> None:
+        """Close the block being collected; called at the end of each batch of read lines."""
+        block, self._block = self._block, None
+        if block:
+            self._record(block, self._block_ts)
+
+    def _record(self, block: List[str], ts: float) -> None:
+        self.blocks += 1
+        split = next((i for i, text in enumerate(block) if text.lstrip().startswith("stack traceback")), len(block))
+        message_lines, frames = block[:split], block[split:]
+        mod = file = lineno = None
+        message = block[0].strip()
+        for text in message_lines:
+            loc = _LOCATION.search(text)
+            if loc:
+                mod, file, lineno = loc.group(1).lower(), loc.group(2), int(loc.group(3))
+                message = text[loc.end():].strip() or message
+                break
+        if mod is None:
+            named = _NAMED_MOD.search(" ".join(message_lines))
+            frame = next((f for f in map(_LOCATION.search, frames) if f), None)
+            if named:
+                mod = named.group(1).lower()
+                if frame and frame.group(1).lower() == mod:
+                    file, lineno = frame.group(2), int(frame.group(3))
+            elif frame:
+                mod, file, lineno = frame.group(1).lower(), frame.group(2), int(frame.group(3))
+        if mod is None:
+            self.unattributed += 1
+            return
+        normalized = _COORDS.sub("(pos)", _ADDRESS.sub("0x?", message))
+        sig = hashlib.sha1(f"{mod}|{file}|{lineno}|{normalized}".encode("utf-8")).hexdigest()[:12]
+        entry = self.mods.get(mod)
+        if entry is None:
+            entry = self.mods[mod] = ModErrors(mod, ts)
+        signature = entry.signatures.get(sig)
+        if signature is None:
+            signature = entry.signatures[sig] = ErrorSignature(sig, mod, file, lineno, message, block, ts)
+            if len(entry.signatures) > self.max_signatures:
+                entry.signatures.popitem(last=False)
+                entry.dropped += 1
+        else:
+            entry.signatures.move_to_end(sig)
+        signature.count += 1
+        signature.last_seen = max(signature.last_seen, ts)
+        entry.count += 1
+        entry.last_seen = max(entry.last_seen, ts)
+        if file:
+            entry.files[file] = entry.files.get(file, 0) + 1
+        self.last_mod = mod
+
+    def for_mod(self, mod: str) -> Optional[ModErrors]:
+        return self.mods.get(mod.lower())
+
+    def tracebacks(self, mod: str, since: Optional[float] = None, n: int = 3) -> List[ErrorSignature]:
+        """The `n` most recently seen distinct errors of `mod`, newest first."""
+        entry = self.mods.get(mod.lower())
+        if entry is None:
+            return []
+        found: List[ErrorSignature] = []
+        for signature in reversed(entry.signatures.values()):
+            if since is not None and signature.last_seen < since:
+                break
+            found.append(signature)
+            if len(found) >= n:
+                break
+        return found
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "mods": {name: e.count for name, e in self.mods.items()},
+            "blocks": self.blocks,
+            "unattributed": self.unattributed,
+            "last_mod": self.last_mod,
+        }
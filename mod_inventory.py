@@ -0,0 +1,165 @@
+"""Cached view of which mods exist and which are enabled.
+
+world.mt is parsed and the server and repo mod directories are listed only when one of
+them changed. Changes are noticed through inotify on the three directories when
+possible, otherwise by comparing their mtimes on each read. The snapshot also keeps
+the sorted /api/mods payload already serialized, with an ETag.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from log_tailer import (
+    inotify_open, inotify_read, IN_MODIFY, IN_CLOSE_WRITE, IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE,
+)
+
+
+def parse_enabled_mods(world_mt_path: Path) -> dict[str, bool]:
+    enabled: dict[str, bool] = {}
+    try:
+        if not world_mt_path.exists():
+            return enabled
+        text = world_mt_path.read_text(encoding="utf-8", errors="replace")
+        for line in text.splitlines():
+            line = line.strip()
+            if not line.startswith("load_mod_"):
+                continue
+            try:
+                left, right = line.split("=", 1)
+                mod_key = left.strip()
+                value = right.strip().lower() == "true"
+                mod_name = mod_key[len("load_mod_"):].strip()
+                enabled[mod_name] = value
+            except ValueError:
+                continue
+    except Exception:
+        pass
+    return enabled
+
+
+def list_mods_in_directory(dir_path: Path) -> list[str]:
+    if not dir_path.exists():
+        return []
+    names: list[str] = []
+    try:
+        for p in dir_path.iterdir():
+            if p.is_dir() and not p.name.startswith('.'):
+                names.append(p.name)
+    except Exception:
+        pass
+    return sorted(names)
+
+
+def _stat_key(path: Path) -> tuple:
+    try:
+        st = os.stat(path)
+        return st.st_ino, st.st_mtime_ns, st.st_size
+    except OSError:
+        return None, None, None
+
+
+class ModSnapshot:
+    def __init__(self, version: int, enabled: Dict[str, bool], server_mods: List[str], repo_mods: List[str]):
+        self.version = version
+        self.taken_at = time.time()
+        self.enabled = enabled
+        self.server_mods = server_mods
+        self.repo_mods = repo_mods
+        server, repo = set(server_mods), set(repo_mods)
+        entries = [
+            {"name": name, "enabled": bool(enabled.get(name, False)), "on_server": name in server, "in_repo": name in repo}
+            for name in sorted(server | repo | set(enabled))
+        ]
+        # Sort: enabled first, then on_server, then in_repo, then name
+        entries.sort(key=lambda m: (
+            0 if m["enabled"] else 1,
+            0 if m["on_server"] else 1,
+            0 if m["in_repo"] else 1,
+            m["name"],
+        ))
+        self.entries = entries
+        self.body = json.dumps({"mods": entries}, ensure_ascii=False).encode("utf-8")
+        self.etag = '"' + hashlib.sha1(self.body).hexdigest()[:16] + '"'
+
+    @property
+    def enabled_count(self) -> int:
+        return sum(1 for v in self.enabled.values() if v)
+
+
+class ModInventory:
+    def __init__(self, world_mt: Path, server_dir: Path, repo_dir: Path):
+        self.world_mt = world_mt
+        self.server_dir = server_dir
+        self.repo_dir = repo_dir
+        self.mode = "stat"
+        self.rebuilds = 0
+        self._snapshot: Optional[ModSnapshot] = None
+        self._key: Optional[tuple] = None
+        self._dirty = True
+        self._inotify: Optional[tuple[int, Dict[int, Path]]] = None
+
+    def _current_key(self) -> tuple:
+        # A directory's mtime moves whenever an entry is added, removed or renamed
+        return _stat_key(self.world_mt), _stat_key(self.server_dir), _stat_key(self.repo_dir)
+
+    def snapshot(self) -> ModSnapshot:
+        if self._snapshot is not None and self._inotify is not None and not self._dirty:
+            return self._snapshot
+        key = self._current_key()
+        if self._snapshot is None or key != self._key:
+            self.rebuilds += 1
+            version = self._snapshot.version + 1 if self._snapshot else 1
+            self._snapshot = ModSnapshot(version, parse_enabled_mods(self.world_mt),
+                                         list_mods_in_directory(self.server_dir), list_mods_in_directory(self.repo_dir))
+            self._key = key
+        self._dirty = False
+        return self._snapshot
+
+    def invalidate(self) -> None:
+        self._dirty = True
+        self._key = None
+
+    def start(self) -> None:
+        """Switch to inotify-driven invalidation when all three directories can be watched."""
+        if self._inotify is not None:
+            return
+        dirs = [self.world_mt.parent, self.server_dir, self.repo_dir]
+        if not all(d.is_dir() for d in dirs):
+            return
+        mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+        opened = inotify_open(dirs, mask)
+        if opened is None:
+            return
+        self._inotify = opened
+        self._dirty = True
+        asyncio.get_running_loop().add_reader(opened[0], self._on_inotify)
+        self.mode = "inotify"
+
+    def _on_inotify(self) -> None:
+        fd, watches = self._inotify
+        for wd, _mask, name in inotify_read(fd):
+            directory = watches.get(wd)
+            # The world directory also holds the constantly written map database
+            if directory == self.world_mt.parent and name != self.world_mt.name:
+                continue
+            self._dirty = True
+
+    def stop(self) -> None:
+        if self._inotify is not None:
+            fd = self._inotify[0]
+            try:
+                asyncio.get_running_loop().remove_reader(fd)
+            except RuntimeError:
+                pass
+            os.close(fd)
+            self._inotify = None
+            self.mode = "stat"
+
+    def status(self) -> Dict[str, Any]:
+        snap = self._snapshot
+        return {"mode": self.mode, "rebuilds": self.rebuilds, "version": snap.version if snap else None,
+                "etag": snap.etag if snap else None}
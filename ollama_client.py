@@ -1,7 +1,21 @@
 import os
 import json
+import time
+import asyncio
+import heapq
+import random
+import hashlib
+import itertools
+import sqlite3
+import threading
+import importlib.util
+import contextlib
+from collections import OrderedDict, deque
+from pathlib import Path
 import httpx
-from typing import AsyncGenerator, Dict, Any, List
+from typing import AsyncGenerator, Callable, Dict, Any, List
+
+from json_stream import JsonObjectScanner
 
 _OLLAMA_HOST = os.environ.get("OLLAMA_HOST")
 _OLLAMA_BASE_URL = os.environ.get("OLLAMA_BASE_URL")
@@ -9,38 +23,1144 @@ OLLAMA_BASE_URL = (_OLLAMA_HOST or _OLLAMA_BASE_URL or "http://127.0.0.1:11434")
 MODEL_FAST = os.environ.get("OLLAMA_MODEL_FAST", "gpt-oss:20b")
 MODEL_STRONG = os.environ.get("OLLAMA_MODEL_STRONG", "gpt-oss:120b")
 
+# How system prompts are sent: "generate" puts them in /api/generate's system field,
+# "chat" sends a system message to /api/chat so the rendered prompt always starts with
+# the same static prefix and Ollama can reuse its KV cache for it across calls
+OLLAMA_PROMPT_MODE = os.environ.get("OLLAMA_PROMPT_MODE", "generate")
+PROMPT_MODES = ("generate", "chat")
 
-async def stream_generate(prompt: str, use_strong: bool = False, system: str | None = None) -> AsyncGenerator[str, None]:
-    model = MODEL_STRONG if use_strong else MODEL_FAST
-    url = f"{OLLAMA_BASE_URL}/api/generate"
-    payload: Dict[str, Any] = {
-        "model": model,
-        "prompt": prompt,
-        "stream": True,
-    }
-    if system:
-        payload["system"] = system
-
-    async with httpx.AsyncClient(timeout=httpx.Timeout(120.0, read=120.0)) as client:
-        async with client.stream("POST", url, json=payload) as resp:
+# Append every streamed request/response (with per-line timing) to this JSONL cassette;
+# bench/ollama_stub.py replays it
+OLLAMA_RECORD = os.environ.get("OLLAMA_RECORD", "")
+
+# Inference hosts. OLLAMA_ENDPOINTS is a comma-separated list; OLLAMA_PLACEMENT pins
+# models to a subset, e.g. "gpt-oss:120b=http://gpu1:11434;gpt-oss:20b=http://gpu1:11434,http://gpu2:11434"
+OLLAMA_ENDPOINTS = [u.strip().rstrip("/") for u in os.environ.get("OLLAMA_ENDPOINTS", OLLAMA_BASE_URL).split(",") if u.strip()]
+OLLAMA_PLACEMENT = os.environ.get("OLLAMA_PLACEMENT", "")
+OLLAMA_BREAKER_FAILURES = int(os.environ.get("OLLAMA_BREAKER_FAILURES", "3"))
+OLLAMA_BREAKER_COOLDOWN = float(os.environ.get("OLLAMA_BREAKER_COOLDOWN", "30"))
+# Fast-model calls with no first token after this latency percentile get a second request elsewhere
+OLLAMA_HEDGE_TIERS = {t.strip() for t in os.environ.get("OLLAMA_HEDGE_TIERS", "fast").split(",") if t.strip()}
+OLLAMA_HEDGE_PERCENTILE = float(os.environ.get("OLLAMA_HEDGE_PERCENTILE", "0.95"))
+OLLAMA_HEDGE_MIN_SAMPLES = int(os.environ.get("OLLAMA_HEDGE_MIN_SAMPLES", "20"))
+
+# Connection pool settings shared by every call to a given base URL
+OLLAMA_MAX_CONNECTIONS = int(os.environ.get("OLLAMA_MAX_CONNECTIONS", "20"))
+OLLAMA_MAX_KEEPALIVE = int(os.environ.get("OLLAMA_MAX_KEEPALIVE", "10"))
+OLLAMA_KEEPALIVE_EXPIRY = float(os.environ.get("OLLAMA_KEEPALIVE_EXPIRY", "60"))
+OLLAMA_HTTP2 = os.environ.get("OLLAMA_HTTP2", "").lower() in ("1", "true", "yes")
+
+# Per-tier timeouts: the strong model can take far longer between tokens
+TIMEOUTS: dict[str, httpx.Timeout] = {
+    "fast": httpx.Timeout(
+        120.0,
+        connect=float(os.environ.get("OLLAMA_CONNECT_TIMEOUT_FAST", "5")),
+        read=float(os.environ.get("OLLAMA_READ_TIMEOUT_FAST", "120")),
+    ),
+    "strong": httpx.Timeout(
+        120.0,
+        connect=float(os.environ.get("OLLAMA_CONNECT_TIMEOUT_STRONG", "5")),
+        read=float(os.environ.get("OLLAMA_READ_TIMEOUT_STRONG", "120")),
+    ),
+}
+
+# Response cache for complete(): bounded in-memory LRU in front of a SQLite file
+OLLAMA_CACHE_PATH = Path(os.environ.get("OLLAMA_CACHE_PATH", str(Path(__file__).resolve().parent / "llm_cache.sqlite3")))
+OLLAMA_CACHE_MAX_ITEMS = int(os.environ.get("OLLAMA_CACHE_MAX_ITEMS", "256"))
+OLLAMA_CACHE_TTL = float(os.environ.get("OLLAMA_CACHE_TTL", "86400"))
+OLLAMA_CACHE_ENABLED = os.environ.get("OLLAMA_CACHE", "1").lower() not in ("0", "false", "no")
+
+# Admission control: concurrent generations and waiting room per model tier
+OLLAMA_CONCURRENCY = {
+    "fast": int(os.environ.get("OLLAMA_CONCURRENCY_FAST", "4")),
+    "strong": int(os.environ.get("OLLAMA_CONCURRENCY_STRONG", "1")),
+}
+OLLAMA_QUEUE_LIMIT = {
+    "fast": int(os.environ.get("OLLAMA_QUEUE_LIMIT_FAST", "32")),
+    "strong": int(os.environ.get("OLLAMA_QUEUE_LIMIT_STRONG", "6")),
+}
+
+# Lower value is served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BATCH = 2
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_NORMAL: "normal", PRIORITY_BATCH: "batch"}
+
+# Model residency: how long Ollama keeps each tier loaded, and what to preload at startup
+OLLAMA_KEEP_ALIVE = {
+    "fast": os.environ.get("OLLAMA_KEEP_ALIVE_FAST", "30m"),
+    "strong": os.environ.get("OLLAMA_KEEP_ALIVE_STRONG", "15m"),
+}
+OLLAMA_WARM_STRONG = os.environ.get("OLLAMA_WARM_STRONG", "").lower() in ("1", "true", "yes")
+OLLAMA_KEEP_WARM_INTERVAL = float(os.environ.get("OLLAMA_KEEP_WARM_INTERVAL", "240"))
+# Keep pinging a tier only while it has been used within this many seconds
+OLLAMA_KEEP_WARM_WINDOW = float(os.environ.get("OLLAMA_KEEP_WARM_WINDOW", "1800"))
+
+_clients: dict[str, httpx.AsyncClient] = {}
+
+
+def _http2_available() -> bool:
+    # httpx only speaks HTTP/2 when the optional h2 package is installed (pip install httpx[http2])
+    return importlib.util.find_spec("h2") is not None
+
+
+def get_client(base_url: str = OLLAMA_BASE_URL) -> httpx.AsyncClient:
+    """Return the shared pooled client for base_url, creating it on first use."""
+    base_url = base_url.rstrip("/")
+    client = _clients.get(base_url)
+    if client is None or client.is_closed:
+        limits = httpx.Limits(
+            max_connections=OLLAMA_MAX_CONNECTIONS,
+            max_keepalive_connections=OLLAMA_MAX_KEEPALIVE,
+            keepalive_expiry=OLLAMA_KEEPALIVE_EXPIRY,
+        )
+        client = httpx.AsyncClient(
+            base_url=base_url,
+            limits=limits,
+            timeout=TIMEOUTS["fast"],
+            http2=OLLAMA_HTTP2 and _http2_available(),
+        )
+        _clients[base_url] = client
+    return client
+
+
+async def open_clients() -> None:
+    """Create the pooled clients up front; called from the app startup hook."""
+    for url in router.urls():
+        get_client(url)
+
+
+async def close_clients() -> None:
+    """Close every pooled client; called from the app shutdown hook."""
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        try:
+            await client.aclose()
+        except Exception:
+            pass
+
+
+def cache_key(model: str, system: str | None, prompt: str, options: Dict[str, Any] | None = None, structured: bool = False) -> str:
+    raw = json.dumps([model, system or "", prompt, options or {}, structured], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """LRU of recent responses backed by a SQLite table that survives restarts."""
+
+    def __init__(self, path: Path, max_items: int = 256):
+        self.path = path
+        self.max_items = max_items
+        self._memory: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: sqlite3.Connection | None = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(str(self.path), check_same_thread=False)
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, model TEXT, created_at REAL, expires_at REAL, response TEXT)"
+            )
+            db.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+            db.commit()
+            self._db = db
+        return self._db
+
+    def _remember(self, key: str, expires_at: float, text: str) -> None:
+        self._memory[key] = (expires_at, text)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+
+    def get_memory(self, key: str) -> str | None:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            expires_at, text = entry
+            if expires_at <= time.time():
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return text
+
+    def get_disk(self, key: str) -> str | None:
+        with self._lock:
+            try:
+                row = self._conn().execute(
+                    "SELECT expires_at, response FROM responses WHERE key = ? AND expires_at > ?",
+                    (key, time.time()),
+                ).fetchone()
+            except sqlite3.Error:
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._remember(key, row[0], row[1])
+            self.hits += 1
+            self.disk_hits += 1
+            return row[1]
+
+    def put(self, key: str, text: str, ttl: float, model: str = "") -> None:
+        now = time.time()
+        with self._lock:
+            self._remember(key, now + ttl, text)
+            self.stores += 1
+            try:
+                db = self._conn()
+                db.execute(
+                    "INSERT OR REPLACE INTO responses (key, model, created_at, expires_at, response) VALUES (?, ?, ?, ?, ?)",
+                    (key, model, now, now + ttl, text),
+                )
+                db.commit()
+            except sqlite3.Error:
+                pass
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            try:
+                db = self._conn()
+                db.execute("DELETE FROM responses")
+                db.commit()
+            except sqlite3.Error:
+                pass
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": OLLAMA_CACHE_ENABLED,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "memory_items": len(self._memory),
+                "max_items": self.max_items,
+                "path": str(self.path),
+            }
+
+
+response_cache = ResponseCache(OLLAMA_CACHE_PATH, OLLAMA_CACHE_MAX_ITEMS)
+
+
+def cache_stats() -> dict[str, Any]:
+    return response_cache.stats()
+
+
+class OllamaBusyError(RuntimeError):
+    """Raised when a model tier's queue is full; retry_after is a hint in seconds."""
+
+    def __init__(self, tier: str, queued: int, retry_after: float):
+        self.tier = tier
+        self.queued = queued
+        self.retry_after = max(1, int(round(retry_after)))
+        super().__init__(f"{tier} model is busy ({queued} requests queued); retry in ~{self.retry_after}s")
+
+
+class TierScheduler:
+    """Concurrency cap plus a priority queue for one model tier."""
+
+    def __init__(self, tier: str, capacity: int, max_queue: int):
+        self.tier = tier
+        self.capacity = max(1, capacity)
+        self.max_queue = max(0, max_queue)
+        self.active = 0
+        self.avg_service_s = 30.0 if tier == "strong" else 5.0
+        self.served = 0
+        self.rejected = 0
+        self._queue: list[list[Any]] = []  # [priority, seq, future, on_queue, enqueued_at]
+        self._seq = itertools.count()
+
+    def retry_after(self) -> float:
+        return (len(self._queue) + 1) / self.capacity * self.avg_service_s
+
+    def check_admission(self) -> None:
+        if self.active >= self.capacity and len(self._queue) >= self.max_queue:
+            self.rejected += 1
+            raise OllamaBusyError(self.tier, len(self._queue), self.retry_after())
+
+    def _report_positions(self) -> None:
+        now = time.monotonic()
+        for pos, entry in enumerate(sorted(self._queue, key=lambda e: (e[0], e[1])), start=1):
+            if entry[3] is not None:
+                entry[3]({"state": "queued", "tier": self.tier, "position": pos,
+                          "queued": len(self._queue), "waited_s": round(now - entry[4], 3)})
+
+    async def acquire(self, priority: int = PRIORITY_NORMAL, on_queue: Callable[[dict], None] | None = None) -> float:
+        """Wait for a slot; returns seconds spent queued."""
+        if self.active < self.capacity and not self._queue:
+            self.active += 1
+            if on_queue is not None:
+                on_queue({"state": "running", "tier": self.tier, "position": 0, "waited_s": 0.0})
+            return 0.0
+        self.check_admission()
+        enqueued_at = time.monotonic()
+        fut: asyncio.Future = asyncio.get_running_loop().create_future()
+        entry = [priority, next(self._seq), fut, on_queue, enqueued_at]
+        heapq.heappush(self._queue, entry)
+        self._report_positions()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # Slot was granted just as we were cancelled; hand it on
+                self.release(0.0, record=False)
+            else:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                self._report_positions()
+            raise
+        waited = time.monotonic() - enqueued_at
+        if on_queue is not None:
+            on_queue({"state": "running", "tier": self.tier, "position": 0, "waited_s": round(waited, 3)})
+        return waited
+
+    def release(self, service_s: float, record: bool = True) -> None:
+        self.active -= 1
+        if record:
+            self.served += 1
+            self.avg_service_s = 0.8 * self.avg_service_s + 0.2 * service_s
+        while self._queue and self.active < self.capacity:
+            entry = heapq.heappop(self._queue)
+            fut = entry[2]
+            if fut.done():
+                continue
+            self.active += 1
+            fut.set_result(None)
+        self._report_positions()
+
+    def snapshot(self) -> dict[str, Any]:
+        by_priority: dict[str, int] = {}
+        for entry in self._queue:
+            name = PRIORITY_NAMES.get(entry[0], str(entry[0]))
+            by_priority[name] = by_priority.get(name, 0) + 1
+        return {
+            "tier": self.tier,
+            "capacity": self.capacity,
+            "active": self.active,
+            "queued": len(self._queue),
+            "queued_by_priority": by_priority,
+            "max_queue": self.max_queue,
+            "avg_service_s": round(self.avg_service_s, 2),
+            "served": self.served,
+            "rejected": self.rejected,
+        }
+
+
+schedulers: dict[str, TierScheduler] = {
+    tier: TierScheduler(tier, OLLAMA_CONCURRENCY[tier], OLLAMA_QUEUE_LIMIT[tier])
+    for tier in ("fast", "strong")
+}
+
+
+def scheduler_status() -> dict[str, Any]:
+    return {tier: sched.snapshot() for tier, sched in schedulers.items()}
+
+
+class OllamaUnavailableError(RuntimeError):
+    """Raised when every endpoint able to serve a model has its circuit breaker open."""
+
+
+class Endpoint:
+    """One Ollama host with an outstanding-request count and a circuit breaker."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.outstanding = 0
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.requests = 0
+        self.errors = 0
+
+    def state(self, now: float | None = None) -> str:
+        if self.opened_at is None:
+            return "closed"
+        now = time.monotonic() if now is None else now
+        return "half_open" if now - self.opened_at >= OLLAMA_BREAKER_COOLDOWN else "open"
+
+    def available(self) -> bool:
+        state = self.state()
+        # Half-open lets a single trial request through to probe the host
+        return state == "closed" or (state == "half_open" and self.outstanding == 0)
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self) -> None:
+        self.errors += 1
+        self.failures += 1
+        if self.opened_at is not None or self.failures >= OLLAMA_BREAKER_FAILURES:
+            self.opened_at = time.monotonic()
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "url": self.url,
+            "state": self.state(),
+            "outstanding": self.outstanding,
+            "consecutive_failures": self.failures,
+            "requests": self.requests,
+            "errors": self.errors,
+        }
+
+
+class Router:
+    """Routes each model to the least-busy healthy endpoint that hosts it."""
+
+    def __init__(self, urls: List[str], placement: str = ""):
+        self.configure(urls, placement)
+
+    def configure(self, urls: List[str], placement: str = "") -> None:
+        self.endpoints: dict[str, Endpoint] = {u.rstrip("/"): Endpoint(u.rstrip("/")) for u in urls}
+        self.placement: dict[str, List[str]] = {}
+        for part in placement.split(";"):
+            if "=" not in part:
+                continue
+            model, hosts = part.split("=", 1)
+            chosen = [h.strip().rstrip("/") for h in hosts.split(",") if h.strip()]
+            for h in chosen:
+                self.endpoints.setdefault(h, Endpoint(h))
+            self.placement[model.strip()] = chosen
+        self.ttft: dict[str, deque] = {}
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def urls(self) -> List[str]:
+        return list(self.endpoints)
+
+    def endpoints_for(self, model: str) -> List[Endpoint]:
+        urls = self.placement.get(model) or list(self.endpoints)
+        return [self.endpoints[u] for u in urls]
+
+    def pick(self, model: str, exclude: tuple[str, ...] = ()) -> Endpoint | None:
+        candidates = [ep for ep in self.endpoints_for(model) if ep.url not in exclude and ep.available()]
+        if not candidates:
+            return None
+        least = min(ep.outstanding for ep in candidates)
+        return random.choice([ep for ep in candidates if ep.outstanding == least])
+
+    def record_ttft(self, model: str, seconds: float) -> None:
+        self.ttft.setdefault(model, deque(maxlen=200)).append(seconds)
+
+    def hedge_delay(self, model: str) -> float | None:
+        samples = self.ttft.get(model)
+        if not samples or len(samples) < OLLAMA_HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(OLLAMA_HEDGE_PERCENTILE * len(ordered)))]
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "endpoints": [ep.snapshot() for ep in self.endpoints.values()],
+            "placement": self.placement,
+            "hedge_delay_s": {m: self.hedge_delay(m) for m in self.ttft},
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+        }
+
+
+router = Router(OLLAMA_ENDPOINTS, OLLAMA_PLACEMENT)
+
+
+def configure_endpoints(urls: List[str], placement: str = "") -> None:
+    """Replace the endpoint set at runtime (stub servers, tests, admin tooling)."""
+    router.configure(urls, placement)
+
+
+def endpoint_status() -> dict[str, Any]:
+    return router.snapshot()
+
+
+class ModelResidency:
+    """Tracks whether each model tier is loaded in Ollama and keeps it warm.
+
+    At startup the fast model (and the strong one when OLLAMA_WARM_STRONG is set) is
+    loaded with a zero-token request. A background loop then polls /api/ps and pings
+    any tier that has been used recently, so its keep_alive timer never runs out.
+    """
+
+    def __init__(self) -> None:
+        self.models = {"fast": MODEL_FAST, "strong": MODEL_STRONG}
+        self.state: dict[str, dict[str, Any]] = {
+            tier: {"model": model, "state": "unknown", "loaded_at": None, "expires_at": None,
+                   "last_used": None, "last_ping": None, "load_s": None, "error": None}
+            for tier, model in self.models.items()
+        }
+        self._task: asyncio.Task | None = None
+
+    def note_used(self, tier: str) -> None:
+        self.state[tier]["last_used"] = time.time()
+
+    def note_generating(self, tier: str) -> None:
+        # Tokens are flowing, so the model is loaded whatever the last poll said
+        info = self.state[tier]
+        if info["state"] != "warm":
+            info["state"] = "warm"
+            info["loaded_at"] = time.time()
+            info["error"] = None
+
+    async def _ping(self, url: str, tier: str) -> dict[str, Any]:
+        # An empty prompt loads the model (if needed) and resets its keep_alive timer
+        resp = await get_client(url).post(
+            "/api/generate",
+            json={"model": self.models[tier], "prompt": "", "stream": False, "keep_alive": OLLAMA_KEEP_ALIVE[tier]},
+            timeout=httpx.Timeout(600.0, connect=TIMEOUTS[tier].connect),
+        )
+        resp.raise_for_status()
+        return resp.json()
+
+    async def warm(self, tier: str) -> None:
+        info = self.state[tier]
+        if info["state"] != "warm":
+            info["state"] = "loading"
+        started = time.monotonic()
+        urls = [ep.url for ep in router.endpoints_for(info["model"])]
+        results = await asyncio.gather(*(self._ping(url, tier) for url in urls), return_exceptions=True)
+        hosts = info.setdefault("endpoints", {})
+        load_s = None
+        for url, result in zip(urls, results):
+            if isinstance(result, BaseException):
+                hosts[url] = "error"
+                info["error"] = str(result) or type(result).__name__
+            else:
+                hosts[url] = "warm"
+                load_ns = result.get("load_duration")
+                load_s = max(load_s or 0.0, load_ns / 1e9 if load_ns else time.monotonic() - started)
+        if load_s is None:
+            info["state"] = "error"
+            return
+        now = time.time()
+        if info["state"] != "warm":
+            info["loaded_at"] = now
+        info["state"] = "warm"
+        info["error"] = None
+        info["last_ping"] = now
+        info["load_s"] = round(load_s, 2)
+
+    async def _running(self, url: str) -> dict[str, Any]:
+        resp = await get_client(url).get("/api/ps", timeout=httpx.Timeout(10.0))
+        resp.raise_for_status()
+        return {m.get("name") or m.get("model"): m for m in resp.json().get("models", [])}
+
+    async def refresh(self) -> None:
+        """Update load state from each endpoint's list of running models."""
+        urls = router.urls()
+        results = dict(zip(urls, await asyncio.gather(*(self._running(u) for u in urls), return_exceptions=True)))
+        for info in self.state.values():
+            if info["state"] == "loading":
+                continue
+            hosts: dict[str, str] = {}
+            expires = None
+            error = None
+            for ep in router.endpoints_for(info["model"]):
+                running = results.get(ep.url)
+                if isinstance(running, BaseException) or running is None:
+                    hosts[ep.url] = "error"
+                    error = str(running) or type(running).__name__
+                elif info["model"] in running:
+                    hosts[ep.url] = "warm"
+                    expires = running[info["model"]].get("expires_at")
+                else:
+                    hosts[ep.url] = "cold"
+            info["endpoints"] = hosts
+            info["expires_at"] = expires
+            if "warm" in hosts.values():
+                info["state"] = "warm"
+                info["error"] = None
+            elif "cold" in hosts.values():
+                info["state"] = "cold"
+                info["error"] = None
+            else:
+                info["state"] = "error"
+                info["error"] = error
+
+    async def _run(self) -> None:
+        tiers = ["fast"] + (["strong"] if OLLAMA_WARM_STRONG else [])
+        await self.refresh()
+        for tier in tiers:
+            if self.state[tier]["state"] != "warm":
+                await self.warm(tier)
+        while True:
+            await asyncio.sleep(OLLAMA_KEEP_WARM_INTERVAL)
+            await self.refresh()
+            now = time.time()
+            for tier, info in self.state.items():
+                last_used = info["last_used"]
+                if last_used is not None and now - last_used < OLLAMA_KEEP_WARM_WINDOW:
+                    await self.warm(tier)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+
+    def snapshot(self) -> dict[str, Any]:
+        return {tier: dict(info) for tier, info in self.state.items()}
+
+
+residency = ModelResidency()
+
+
+def residency_status() -> dict[str, Any]:
+    return residency.snapshot()
+
+
+async def start_residency() -> None:
+    """Preload models and start the keep-warm loop; called from the app startup hook."""
+    residency.start()
+
+
+async def stop_residency() -> None:
+    await residency.stop()
+
+
+_record_lock = threading.Lock()
+
+
+def record_interaction(entry: dict[str, Any], path: str | None = None) -> None:
+    """Append one request/response exchange to the cassette file."""
+    target = Path(path or OLLAMA_RECORD)
+    line = json.dumps(entry, ensure_ascii=False)
+    with _record_lock:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        with target.open("a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+async def _endpoint_stream(ep: Endpoint, payload: Dict[str, Any], timeout: httpx.Timeout,
+                           stats: dict[str, Any] | None = None) -> AsyncGenerator[str, None]:
+    ep.outstanding += 1
+    ep.requests += 1
+    started = time.monotonic()
+    first = True
+    path = "/api/chat" if "messages" in payload else "/api/generate"
+    recorded: List[list] | None = [] if OLLAMA_RECORD else None
+    status: int | None = None
+    complete_stream = False
+    try:
+        async with get_client(ep.url).stream("POST", path, json=payload, timeout=timeout) as resp:
+            status = resp.status_code
             resp.raise_for_status()
             async for line in resp.aiter_lines():
                 if not line:
                     continue
-                # Each line is a JSON object with {response: str, done: bool}
+                if recorded is not None:
+                    recorded.append([round(time.monotonic() - started, 4), line])
+                # Each line is a JSON object with {response: str, done: bool}; /api/chat nests
+                # the text under message.content
                 try:
                     data = json.loads(line)
                 except Exception:
                     continue
-                chunk = data.get("response")
+                chunk = data.get("response") or (data.get("message") or {}).get("content")
                 if chunk:
+                    if first:
+                        router.record_ttft(payload["model"], time.monotonic() - started)
+                        first = False
                     yield chunk
                 if data.get("done"):
+                    if stats is not None:
+                        stats.update({k: v for k, v in data.items() if k not in ("response", "message", "context")})
+                        stats["endpoint"] = ep.url
+                    complete_stream = True
                     break
+        ep.record_success()
+    except httpx.HTTPStatusError as e:
+        # 4xx (unknown model, bad request) is our fault, not the host's
+        if e.response.status_code >= 500:
+            ep.record_failure()
+        raise
+    except (httpx.TransportError, OSError):
+        ep.record_failure()
+        raise
+    finally:
+        ep.outstanding -= 1
+        if recorded is not None and status is not None:
+            try:
+                record_interaction({"path": path, "request": payload, "status": status, "complete": complete_stream,
+                                    "recorded_at": time.time(), "lines": recorded})
+            except OSError:
+                pass
+
+
+async def _discard(task: asyncio.Task, gen: AsyncGenerator[str, None]) -> None:
+    task.cancel()
+    try:
+        await task
+    except BaseException:
+        pass
+    try:
+        await gen.aclose()
+    except BaseException:
+        pass
+
+
+async def _ollama_stream(payload: Dict[str, Any], timeout: httpx.Timeout, hedge: bool = False,
+                         stats: dict[str, Any] | None = None) -> AsyncGenerator[str, None]:
+    """Stream from the least-busy healthy endpoint, hedging slow first tokens when asked."""
+    model = payload["model"]
+    primary = router.pick(model)
+    if primary is None:
+        raise OllamaUnavailableError(f"no healthy Ollama endpoint for {model}")
+    delay = router.hedge_delay(model) if hedge else None
+    if delay is None:
+        tried: tuple[str, ...] = ()
+        ep: Endpoint | None = primary
+        while ep is not None:
+            tried += (ep.url,)
+            started = False
+            try:
+                async for chunk in _endpoint_stream(ep, payload, timeout, stats):
+                    started = True
+                    yield chunk
+                return
+            except httpx.TransportError:
+                # Fail over only while nothing has been yielded; a half-sent answer can't be resumed
+                ep = None if started else router.pick(model, exclude=tried)
+                if ep is None:
+                    raise
+
+    gens: dict[str, AsyncGenerator[str, None]] = {}
+    tasks: dict[asyncio.Future, str] = {}
+
+    def launch(ep: Endpoint) -> asyncio.Future:
+        gens[ep.url] = _endpoint_stream(ep, payload, timeout, stats)
+        task = asyncio.ensure_future(gens[ep.url].__anext__())
+        tasks[task] = ep.url
+        return task
+
+    winner: str | None = None
+    first_chunk: str | None = None
+    pending = {launch(primary)}
+    backups: set[str] = set()
+    error: BaseException | None = None
+    while pending and winner is None:
+        done, pending = await asyncio.wait(pending, timeout=None if backups else delay,
+                                           return_when=asyncio.FIRST_COMPLETED)
+        if not done:
+            # The first token is late: race a backup against it
+            backup = router.pick(model, exclude=tuple(gens))
+            if backup is None:
+                delay = None
+                continue
+            router.hedges += 1
+            backups.add(backup.url)
+            pending.add(launch(backup))
+            continue
+        for task in done:
+            if winner is not None:
+                continue
+            exc = task.exception()
+            if exc is None:
+                winner, first_chunk = tasks[task], task.result()
+            elif isinstance(exc, StopAsyncIteration):
+                winner = tasks[task]
+            else:
+                error = exc
+        # Every racing host failed before its first token: fail over as the unhedged loop does
+        if winner is None and not pending and isinstance(error, httpx.TransportError):
+            ep = router.pick(model, exclude=tuple(gens))
+            if ep is not None:
+                pending.add(launch(ep))
+    # Every other stream goes, including one whose first chunk landed in the same wait as the
+    # winner's; closing it runs its cleanup, which releases the endpoint's outstanding count
+    for task, url in tasks.items():
+        if url != winner:
+            await _discard(task, gens[url])
+    if winner is None:
+        raise error or OllamaUnavailableError(f"no Ollama endpoint answered for {model}")
+    if winner in backups:
+        router.hedge_wins += 1
+    if first_chunk is None:
+        return
+    try:
+        yield first_chunk
+        async for chunk in gens[winner]:
+            yield chunk
+    finally:
+        await gens[winner].aclose()
+
+
+_HISTOGRAM_BOUNDS = [10 ** (e / 4) for e in range(-12, 25)]  # 1ms .. 1e6, four buckets per decade
+
+
+class Histogram:
+    """Log-bucketed histogram; percentiles are bucket upper bounds, capped at the max seen."""
+
+    def __init__(self) -> None:
+        self.buckets = [0] * (len(_HISTOGRAM_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value: float) -> None:
+        lo, hi = 0, len(_HISTOGRAM_BOUNDS)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if value <= _HISTOGRAM_BOUNDS[mid]:
+                hi = mid
+            else:
+                lo = mid + 1
+        self.buckets[lo] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n:
+                bound = _HISTOGRAM_BOUNDS[i] if i < len(_HISTOGRAM_BOUNDS) else self.max
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count, 4) if self.count else 0.0,
+            "p50": round(self.percentile(0.5), 4),
+            "p95": round(self.percentile(0.95), 4),
+            "max": round(self.max, 4),
+        }
 
 
-async def complete(prompt: str, use_strong: bool = False, system: str | None = None) -> str:
+class LLMTelemetry:
+    """Per-call-site latency, throughput and GPU-time accounting.
+
+    Upstream numbers (prompt tokens, tokens/sec, load time, GPU seconds) come from
+    the stats on Ollama's final stream line and are only attributed to the caller
+    that started the generation; callers that joined an identical in-flight
+    request or hit the cache are counted separately.
+    """
+
+    METRICS = ("ttft_s", "latency_s", "tokens_per_s", "prompt_tokens", "prompt_eval_s", "eval_tokens", "load_s")
+
+    def __init__(self) -> None:
+        self.sites: dict[str, dict[str, Any]] = {}
+        self.started = time.time()
+
+    def _site(self, call_site: str) -> dict[str, Any]:
+        site = self.sites.get(call_site)
+        if site is None:
+            site = {"calls": 0, "errors": 0, "cache_hits": 0, "coalesced": 0, "gpu_s": 0.0,
+                    "models": {}, "modes": {}, "histograms": {m: Histogram() for m in self.METRICS}}
+            self.sites[call_site] = site
+        return site
+
+    def record_cache_hit(self, call_site: str) -> None:
+        self._site(call_site)["cache_hits"] += 1
+
+    def record_call(self, call_site: str, model: str, ttft_s: float | None, latency_s: float,
+                    stats: dict[str, Any] | None, error: bool = False) -> None:
+        site = self._site(call_site)
+        site["calls"] += 1
+        site["models"][model] = site["models"].get(model, 0) + 1
+        if error:
+            site["errors"] += 1
+            return
+        h = site["histograms"]
+        if ttft_s is not None:
+            h["ttft_s"].add(ttft_s)
+        h["latency_s"].add(latency_s)
+        if stats is None:
+            site["coalesced"] += 1
+            return
+        prompt_ns = stats.get("prompt_eval_duration") or 0
+        eval_ns = stats.get("eval_duration") or 0
+        load_ns = stats.get("load_duration") or 0
+        if stats.get("prompt_eval_count") is not None:
+            h["prompt_tokens"].add(stats["prompt_eval_count"])
+        if "prompt_eval_duration" in stats:
+            h["prompt_eval_s"].add(prompt_ns / 1e9)
+        if stats.get("eval_count"):
+            h["eval_tokens"].add(stats["eval_count"])
+            if eval_ns > 1e6:
+                h["tokens_per_s"].add(stats["eval_count"] / (eval_ns / 1e9))
+        if "load_duration" in stats:
+            h["load_s"].add(load_ns / 1e9)
+        # Prompt evaluation split by prompt mode, to compare prefix reuse against the baseline
+        mode = site["modes"].setdefault(stats.get("mode", "generate"),
+                                        {"calls": 0, "prompt_tokens": Histogram(), "prompt_eval_s": Histogram()})
+        mode["calls"] += 1
+        if stats.get("prompt_eval_count") is not None:
+            mode["prompt_tokens"].add(stats["prompt_eval_count"])
+        if "prompt_eval_duration" in stats:
+            mode["prompt_eval_s"].add(prompt_ns / 1e9)
+        site["gpu_s"] += (prompt_ns + eval_ns + load_ns) / 1e9
+
+    def snapshot(self) -> dict[str, Any]:
+        sites = {}
+        for name, site in sorted(self.sites.items(), key=lambda kv: -kv[1]["gpu_s"]):
+            sites[name] = {
+                "calls": site["calls"],
+                "errors": site["errors"],
+                "cache_hits": site["cache_hits"],
+                "coalesced": site["coalesced"],
+                "gpu_s": round(site["gpu_s"], 2),
+                "models": dict(site["models"]),
+                "modes": {
+                    mode: {"calls": m["calls"], "prompt_tokens": m["prompt_tokens"].snapshot(),
+                           "prompt_eval_s": m["prompt_eval_s"].snapshot()}
+                    for mode, m in site["modes"].items()
+                },
+                **{m: hist.snapshot() for m, hist in site["histograms"].items()},
+            }
+        return {"since": self.started, "sites": sites}
+
+    def reset(self) -> None:
+        self.sites.clear()
+        self.started = time.time()
+
+
+telemetry = LLMTelemetry()
+
+
+def telemetry_status() -> dict[str, Any]:
+    return telemetry.snapshot()
+
+
+class _Flight:
+    """One in-flight Ollama generation shared by every caller asking for the same thing.
+
+    A background task reads the upstream stream and appends to `chunks`; each
+    subscriber replays what it missed and then follows along. The upstream call is
+    cancelled when the last subscriber goes away.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: BaseException | None = None
+        self.subscribers = 0
+        self.task: asyncio.Task | None = None
+        self.queue_state: dict[str, Any] | None = None
+        self.queue_listeners: List[Callable[[dict], None]] = []
+        # Filled from Ollama's final stream line (token counts and durations in ns)
+        self.stats: dict[str, Any] = {}
+        self._wake = asyncio.Event()
+
+    def _notify(self) -> None:
+        wake, self._wake = self._wake, asyncio.Event()
+        wake.set()
+
+    def _queue_event(self, info: dict[str, Any]) -> None:
+        self.queue_state = info
+        for listener in list(self.queue_listeners):
+            try:
+                listener(info)
+            except Exception:
+                pass
+
+    def listen(self, on_queue: Callable[[dict], None] | None) -> None:
+        if on_queue is None:
+            return
+        self.queue_listeners.append(on_queue)
+        if self.queue_state is not None:
+            on_queue(self.queue_state)
+
+    async def run(self, source: AsyncGenerator[str, None], scheduler: TierScheduler, priority: int,
+                  structured: bool = False) -> None:
+        scanner = JsonObjectScanner() if structured else None
+        try:
+            await scheduler.acquire(priority, self._queue_event)
+            started = time.monotonic()
+            try:
+                # Closing the source drops the HTTP stream, which makes Ollama stop generating
+                async with contextlib.aclosing(source):
+                    async for chunk in source:
+                        if not self.chunks:
+                            self.stats["first_chunk_at"] = time.monotonic()
+                        self.chunks.append(chunk)
+                        self._notify()
+                        if scanner is not None and scanner.feed(chunk) is not None:
+                            break
+                first_at = self.stats.get("first_chunk_at")
+                if not self.stats.get("done") and first_at is not None:
+                    # Stopped before Ollama's final line: estimate from the stream (about one token
+                    # per chunk, prompt evaluation until the first chunk)
+                    self.stats.update({"eval_count": len(self.chunks),
+                                       "eval_duration": int((time.monotonic() - first_at) * 1e9),
+                                       "prompt_eval_duration": int((first_at - started) * 1e9),
+                                       "estimated": True})
+            finally:
+                scheduler.release(time.monotonic() - started)
+        except asyncio.CancelledError:
+            self.error = RuntimeError("generation cancelled")
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            if _inflight.get(self.key) is self:
+                del _inflight[self.key]
+            self._notify()
+
+    async def subscribe(self) -> AsyncGenerator[str, None]:
+        self.subscribers += 1
+        i = 0
+        try:
+            while True:
+                wake = self._wake
+                while i < len(self.chunks):
+                    yield self.chunks[i]
+                    i += 1
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await wake.wait()
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.done and self.task is not None:
+                # Nobody is listening any more: detach so new callers start fresh
+                if _inflight.get(self.key) is self:
+                    del _inflight[self.key]
+                self.task.cancel()
+
+
+_inflight: dict[str, _Flight] = {}
+
+
+def inflight_count() -> int:
+    return len(_inflight)
+
+
+def build_payload(model: str, prompt: str, system: str | None, options: Dict[str, Any] | None,
+                  keep_alive: str, mode: str = "generate") -> Dict[str, Any]:
+    if mode == "chat" and system:
+        payload: Dict[str, Any] = {
+            "model": model,
+            "messages": [{"role": "system", "content": system}, {"role": "user", "content": prompt}],
+            "stream": True,
+            "keep_alive": keep_alive,
+        }
+    else:
+        payload = {"model": model, "prompt": prompt, "stream": True, "keep_alive": keep_alive}
+        if system:
+            payload["system"] = system
+    if options:
+        payload["options"] = options
+    return payload
+
+
+async def stream_generate(
+    prompt: str,
+    use_strong: bool = False,
+    system: str | None = None,
+    options: Dict[str, Any] | None = None,
+    priority: int = PRIORITY_NORMAL,
+    on_queue: Callable[[dict], None] | None = None,
+    structured: bool = False,
+    call_site: str = "unknown",
+    prompt_mode: str | None = None,
+) -> AsyncGenerator[str, None]:
+    """Stream response chunks for a prompt.
+
+    Identical requests that arrive while one is already running attach to it, so
+    the model only runs once and every caller sees the same chunks. New requests
+    wait for a slot on their model tier; on_queue receives queue position and wait
+    time updates, and OllamaBusyError is raised when the tier's queue is full.
+
+    With structured=True the stream ends as soon as a complete JSON object has
+    been produced; anything the model would have written after it is never generated.
+    Per-call stop sequences and num_predict caps go in options. call_site names
+    the caller in the telemetry from telemetry_status(). prompt_mode overrides
+    OLLAMA_PROMPT_MODE for this call.
+    """
+    model = MODEL_STRONG if use_strong else MODEL_FAST
+    tier = "strong" if use_strong else "fast"
+    mode = prompt_mode or OLLAMA_PROMPT_MODE
+    if mode not in PROMPT_MODES:
+        raise ValueError(f"unknown prompt mode {mode!r}")
+    payload = build_payload(model, prompt, system, options, OLLAMA_KEEP_ALIVE[tier], mode)
+
+    key = cache_key(model, system, prompt, options, structured)
+    residency.note_used(tier)
+    flight = _inflight.get(key)
+    owner = flight is None
+    if flight is None:
+        scheduler = schedulers[tier]
+        scheduler.check_admission()
+        flight = _Flight(key)
+        flight.stats["mode"] = mode if system else "generate"
+        _inflight[key] = flight
+        source = _ollama_stream(payload, TIMEOUTS[tier], hedge=tier in OLLAMA_HEDGE_TIERS, stats=flight.stats)
+        flight.task = asyncio.create_task(flight.run(source, scheduler, priority, structured))
+    flight.listen(on_queue)
+    started = time.monotonic()
+    ttft: float | None = None
+    try:
+        async for chunk in flight.subscribe():
+            if ttft is None:
+                ttft = time.monotonic() - started
+                residency.note_generating(tier)
+            yield chunk
+    except Exception:
+        telemetry.record_call(call_site, model, ttft, time.monotonic() - started, None, error=True)
+        raise
+    if flight.done:
+        telemetry.record_call(call_site, model, ttft, time.monotonic() - started, flight.stats if owner else None)
+
+
+async def complete(
+    prompt: str,
+    use_strong: bool = False,
+    system: str | None = None,
+    options: Dict[str, Any] | None = None,
+    cache: bool = True,
+    cache_ttl: float | None = None,
+    priority: int = PRIORITY_NORMAL,
+    on_queue: Callable[[dict], None] | None = None,
+    structured: bool = False,
+    call_site: str = "unknown",
+    prompt_mode: str | None = None,
+) -> str:
+    """Run a generation to completion.
+
+    Responses are cached by (model, system, prompt, options); pass cache=False for
+    calls whose output is expected to differ on every run.
+    """
+    use_cache = cache and OLLAMA_CACHE_ENABLED
+    model = MODEL_STRONG if use_strong else MODEL_FAST
+    key = cache_key(model, system, prompt, options, structured)
+    if use_cache:
+        cached = response_cache.get_memory(key)
+        if cached is None:
+            cached = await asyncio.to_thread(response_cache.get_disk, key)
+        if cached is not None:
+            telemetry.record_cache_hit(call_site)
+            return cached
+
     chunks: List[str] = []
-    async for c in stream_generate(prompt, use_strong=use_strong, system=system):
+    async for c in stream_generate(prompt, use_strong=use_strong, system=system, options=options,
+                                   priority=priority, on_queue=on_queue, structured=structured,
+                                   call_site=call_site, prompt_mode=prompt_mode):
         chunks.append(c)
-    return "".join(chunks)
+    text = "".join(chunks)
+    if use_cache and text:
+        ttl = OLLAMA_CACHE_TTL if cache_ttl is None else cache_ttl
+        await asyncio.to_thread(response_cache.put, key, text, ttl, model)
+    return text
+